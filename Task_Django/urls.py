@@ -36,6 +36,7 @@ urlpatterns = [
     path('projects/', task_views.project_list, name='project_list'),
     path('projects/<int:proj_id>/', task_views.project_detail, name='project_detail'),
     path('outbound/add/', digi_views.add_outbound, name='add_outbound'),
+    path('outbound/import/', digi_views.import_outbounds, name='import_outbounds'),
     path('outbound/list/', digi_views.outbound_list, name='outbound_list'),
     path('outbound/<int:out_id>/claim/', digi_views.claim_outbound, name='claim_outbound'),
     path('workorder/<int:out_id>/edit/', digi_views.edit_workorder, name='edit_workorder'),
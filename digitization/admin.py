@@ -1,11 +1,14 @@
 from django.contrib import admin
-from .models import Outbound, WorkOrder, QualityCheck
+from .models import Outbound, WorkOrder, QualityCheck, DailySequence
+from .services import catalogue_stage
 
 @admin.register(Outbound)
 class OutboundAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'out_time', 'librarian', 'taken_by', 'taken_at')
-    list_filter = ('category', 'taken_by')
+    list_display = ('name', 'category', 'stage', 'out_time', 'librarian', 'taken_by', 'taken_at')
+    list_filter = ('stage', 'category', 'taken_by')
     search_fields = ('name', 'notes')
+    # 阶段只随业务动作推进（承接 / 著录 / 质检 / 入库），后台不可直接修改
+    readonly_fields = ('stage',)
 
 @admin.register(WorkOrder)
 class WorkOrderAdmin(admin.ModelAdmin):
@@ -13,7 +16,16 @@ class WorkOrderAdmin(admin.ModelAdmin):
     search_fields = ('batch_no', 'title')
     readonly_fields = ('batch_no', 'start_time', 'operator')
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        catalogue_stage(obj)  # 与工作单编辑页一致：题名填写/清空时同步阶段
+
 @admin.register(QualityCheck)
 class QualityCheckAdmin(admin.ModelAdmin):
     list_display = ('work_order', 'inspector', 'inspected_at', 'ocr_score', 'tiff_complete', 'jpeg_consistent', 'pdf_assembled', 'ocr_done', 'data_intact')
     list_filter = ('tiff_complete', 'jpeg_consistent', 'pdf_assembled', 'ocr_done', 'data_intact')
+
+@admin.register(DailySequence)
+class DailySequenceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'day', 'value')
+    list_filter = ('name',)
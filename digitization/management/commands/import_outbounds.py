@@ -0,0 +1,52 @@
+# digitization/management/commands/import_outbounds.py
+from __future__ import annotations
+import csv
+import time
+from pathlib import Path
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from digitization.services import import_outbounds, IMPORT_CHUNK
+from flow.utils import read_numbered_rows
+
+
+class Command(BaseCommand):
+    help = '从 CSV / XLSX 表格批量登记出库单；非法行写入错误报告，不中断整批'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='表格文件：.csv 或 .xlsx（首行表头，可用字段名或中文标题）')
+        parser.add_argument('--librarian', required=True, help='登记人用户名')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK)
+        parser.add_argument('--errors', help='错误报告输出路径（CSV）')
+
+    def handle(self, *args, **opts):
+        librarian = get_user_model().objects.filter(username=opts['librarian']).first()
+        if not librarian:
+            raise CommandError('登记人不存在')
+
+        path = Path(opts['path'])
+        fmt = 'xlsx' if path.suffix.lower() == '.xlsx' else 'csv'
+        t0 = time.perf_counter()
+        try:
+            with path.open('rb') as fh:
+                numbered = read_numbered_rows(fh, fmt)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        rows = [r for _, r in numbered]
+        created, errors = import_outbounds(rows, librarian, chunk_size=opts['chunk_size'],
+                                           lines=[no for no, _ in numbered])
+
+        for no, msg in errors[:20]:
+            self.stderr.write(f'第 {no} 行：{msg}')
+        if len(errors) > 20:
+            self.stderr.write(f'…… 其余 {len(errors) - 20} 条错误见报告')
+        if opts['errors'] and errors:
+            with open(opts['errors'], 'w', newline='', encoding='utf-8-sig') as fh:
+                w = csv.writer(fh)
+                w.writerow(['行号', '错误'])
+                w.writerows(errors)
+        self.stdout.write(self.style.SUCCESS(
+            f'共 {len(rows)} 行，登记 {created} 张出库单，失败 {len(errors)} 行（{time.perf_counter() - t0:.1f}s）'
+        ))
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitization', '0005_outbound_is_returned_outbound_returned_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, verbose_name='序列名')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('value', models.PositiveIntegerField(default=0, verbose_name='当前值')),
+            ],
+            options={
+                'verbose_name': '每日序号',
+                'verbose_name_plural': '每日序号',
+                'unique_together': {('name', 'day')},
+            },
+        ),
+    ]
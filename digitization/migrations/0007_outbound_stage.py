@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:42
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_stage(apps, schema_editor):
+    """按原来的 isnull 连接推导阶段；依次推进，后一步覆盖前一步，每步一条 UPDATE"""
+    Outbound = apps.get_model('digitization', 'Outbound')
+    WorkOrder = apps.get_model('digitization', 'WorkOrder')
+    QualityCheck = apps.get_model('digitization', 'QualityCheck')
+    Outbound.objects.filter(taken_by__isnull=False).update(stage='claimed')
+    Outbound.objects.filter(
+        pk__in=WorkOrder.objects.filter(title__gt='').values('out_bound_id'),
+    ).update(stage='catalogued')
+    Outbound.objects.filter(
+        pk__in=QualityCheck.objects.values('work_order__out_bound_id'),
+    ).update(stage='checked')
+    # 与原“已入库列表”一致：入库且有质检记录
+    Outbound.objects.filter(is_returned=True, stage='checked').update(stage='returned')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitization', '0006_daily_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='outbound',
+            name='stage',
+            field=models.CharField(choices=[('registered', '待承接'), ('claimed', '已承接'), ('catalogued', '已著录'), ('checked', '已质检'), ('returned', '已入库')], db_index=True, default='registered', max_length=16, verbose_name='流程阶段'),
+        ),
+        migrations.RunPython(backfill_stage, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='outbound',
+            index=models.Index(fields=['librarian', 'stage'], name='dig_outbound_lib_stage_idx'),
+        ),
+    ]
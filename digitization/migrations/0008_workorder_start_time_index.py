@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('digitization', '0007_outbound_stage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='workorder',
+            name='start_time',
+            field=models.DateTimeField(db_index=True, verbose_name='数字化开始时间'),
+        ),
+    ]
@@ -1,7 +1,16 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Max
 from django.conf import settings
 import datetime
 
+class OutboundStage(models.TextChoices):
+    REGISTERED = 'registered', '待承接'
+    CLAIMED = 'claimed', '已承接'
+    CATALOGUED = 'catalogued', '已著录'
+    CHECKED = 'checked', '已质检'
+    RETURNED = 'returned', '已入库'
+
+
 class Outbound(models.Model):
     CATEGORY_CHOICES = [
         ('book', '图书'),
@@ -31,14 +40,52 @@ class Outbound(models.Model):
     taken_at = models.DateTimeField("承接时间", null=True, blank=True)
     is_returned = models.BooleanField(default=False, verbose_name="是否已入库")
     returned_at = models.DateTimeField(null=True, blank=True, verbose_name="入库时间")
+    # 显式的流程阶段：各列表按单列索引过滤，不再拼 WorkOrder/QualityCheck 的 isnull 连接
+    stage = models.CharField("流程阶段", max_length=16, choices=OutboundStage.choices,
+                             default=OutboundStage.REGISTERED, db_index=True)
+
+    class Meta:
+        indexes = [
+            # 待入库列表：登记人 + 阶段
+            models.Index(fields=['librarian', 'stage'], name='dig_outbound_lib_stage_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} - {self.get_category_display()}"
 
+class DailySequence(models.Model):
+    """按天递增的计数器（如工作单批次号）：取号是一次带行锁的 UPDATE，与当天已有多少单无关"""
+    name = models.CharField("序列名", max_length=32)
+    day = models.DateField("日期")
+    value = models.PositiveIntegerField("当前值", default=0)
+
+    class Meta:
+        unique_together = ('name', 'day')
+        verbose_name = "每日序号"
+        verbose_name_plural = "每日序号"
+
+    def __str__(self):
+        return f"{self.name}@{self.day}: {self.value}"
+
+    @classmethod
+    @transaction.atomic
+    def next_value(cls, name, day, seed=None):
+        """
+        取下一个序号。UPDATE 持有行锁直到事务结束，并发取号依次排队、不会重复。
+        当天首次取号先插入计数行（已存在则忽略），初值由 seed() 给出，兼容上线前已按旧方式编号的单据；
+        先插入再 UPDATE，而不是 UPDATE 落空后再插入，避免 MySQL 间隙锁导致并发首插互相死锁。
+        """
+        rows = cls.objects.filter(name=name, day=day)
+        if not rows.exists():
+            cls.objects.bulk_create([cls(name=name, day=day, value=seed() if seed else 0)], ignore_conflicts=True)
+        rows.update(value=F('value') + 1)
+        return rows.values_list('value', flat=True).get()
+
+
 class WorkOrder(models.Model):
     out_bound = models.OneToOneField(Outbound, on_delete=models.CASCADE, verbose_name="对应出库单")
     batch_no = models.CharField("批次号", max_length=12, unique=True)
-    start_time = models.DateTimeField("数字化开始时间")
+    start_time = models.DateTimeField("数字化开始时间", db_index=True)
     operator = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.PROTECT, verbose_name="数字化负责人员"
     )
@@ -61,6 +108,17 @@ class WorkOrder(models.Model):
     def __str__(self):
         return f"WorkOrder({self.batch_no}) - {self.title}"
 
+    @classmethod
+    def next_batch_no(cls, day):
+        """批次号 = 日期 + 当日四位序号"""
+        date_str = day.strftime("%Y%m%d")
+
+        def seed():
+            last = cls.objects.filter(batch_no__startswith=date_str).aggregate(m=Max('batch_no'))['m']
+            return int(last[len(date_str):]) if last else 0
+
+        return f"{date_str}{DailySequence.next_value('batch_no', day, seed):04d}"
+
 class QualityCheck(models.Model):
     work_order = models.OneToOneField(WorkOrder, on_delete=models.CASCADE, verbose_name="对应工作单")
     tiff_complete = models.BooleanField("TIFF图片完整")
@@ -0,0 +1,318 @@
+# digitization/services.py
+from __future__ import annotations
+
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, Count, Q
+from django.utils import timezone
+
+from flow.services import emit
+from tasks.models import Task, Project, Category
+from .models import Outbound, OutboundStage, WorkOrder, QualityCheck
+
+DIGITIZATION_PROJECT = "馆藏纸本资源数字化"
+SCAN_CATEGORY = "扫描"
+
+# 项目/分类的主键几乎不变：缓存起来，承接时不再每次按名称查询；改名或删除时由 signals 失效
+LOOKUP_KEY = 'digitization:lookup:{}:{}'
+LOOKUP_TTL = 3600
+
+
+def _lookup_id(model, name):
+    key = LOOKUP_KEY.format(model._meta.label_lower, name)
+    pk = cache.get(key)
+    if pk is None:
+        pk = model.objects.filter(name=name).values_list('id', flat=True).first()
+        if pk is not None:  # 未创建时不缓存，管理员补建后立即可用
+            cache.set(key, pk, LOOKUP_TTL)
+    return pk
+
+
+def _drop_lookups() -> None:
+    cache.delete_many([
+        LOOKUP_KEY.format(Project._meta.label_lower, DIGITIZATION_PROJECT),
+        LOOKUP_KEY.format(Category._meta.label_lower, SCAN_CATEGORY),
+    ])
+
+
+def forget_lookups() -> None:
+    """项目/分类变更提交后再丢弃缓存，避免并发请求在提交前把旧 id 重新写回"""
+    transaction.on_commit(_drop_lookups)
+
+
+def claim_lookups():
+    """
+    返回 (项目 id, 分类 id)；缺少任何一个时抛 LookupError。
+    失效只作用于当前进程所连的缓存：未配置共享缓存时，其它 worker 可能在 LOOKUP_TTL 内仍持有
+    已删除记录的旧 id，由 claim_outbound 在外键冲突时丢弃缓存重查兜底。
+    """
+    project_id = _lookup_id(Project, DIGITIZATION_PROJECT)
+    if project_id is None:
+        raise LookupError(f"请先创建项目：{DIGITIZATION_PROJECT}")
+    category_id = _lookup_id(Category, SCAN_CATEGORY)
+    if category_id is None:
+        raise LookupError(f"请先创建分类：{SCAN_CATEGORY}")
+    return project_id, category_id
+
+
+def advance_stage(outbound_id, stage, from_stages, **fields) -> bool:
+    """
+    条件 UPDATE 推进阶段（可顺带更新其它字段）：只有处于 from_stages 的出库单会被修改，
+    并发或重复提交不会把阶段拉回。成功后让看板缓存失效。
+    """
+    done = bool(Outbound.objects.filter(pk=outbound_id, stage__in=from_stages).update(stage=stage, **fields))
+    if done:
+        stage_changed()
+    return done
+
+
+# ---- 数字化看板：各阶段数量、每日扫描页数、平均 OCR 评分、各人待质检数 ----
+DASHBOARD_KEY = 'digitization:dashboard'
+DASHBOARD_TTL = 30
+DASHBOARD_DAYS = 14
+
+
+def stage_changed() -> None:
+    """
+    阶段变化后（事务提交时）丢弃看板缓存。未配置共享缓存时各进程的 LocMemCache 互不相通，
+    其它 worker 上的看板最多滞后 DASHBOARD_TTL（30 秒），页面上的“统计于”时间即为其计算时刻。
+    """
+    transaction.on_commit(lambda: cache.delete(DASHBOARD_KEY))
+
+
+def pipeline_dashboard():
+    data = cache.get(DASHBOARD_KEY)
+    if data is None:
+        data = _compute_dashboard()
+        cache.set(DASHBOARD_KEY, data, DASHBOARD_TTL)
+    return data
+
+
+def _compute_dashboard():
+    """四条聚合查询：阶段计数为一条条件聚合（走 stage 索引），其余按窗口或阶段过滤后分组"""
+    stages = Outbound.objects.aggregate(
+        **{s.value: Count('id', filter=Q(stage=s.value)) for s in OutboundStage}
+    )
+    qc = QualityCheck.objects.aggregate(avg=Avg('ocr_score'), n=Count('id'))
+
+    today = timezone.localdate()
+    since = today - timedelta(days=DASHBOARD_DAYS - 1)
+    pages = {since + timedelta(days=i): 0 for i in range(DASHBOARD_DAYS)}
+    # 按承接时写入、此后不再改动的 start_time 分桶（带索引）；registered_at 每次编辑工作单都会刷新，不宜作统计口径
+    window = WorkOrder.objects.filter(
+        start_time__gte=timezone.make_aware(datetime.combine(since, time.min)),
+        total_pages__gt=0,
+    )
+    # 按本地日期分桶放在 Python 里做：窗口内行数有限，且避免依赖 MySQL 时区表（CONVERT_TZ）
+    for start_time, n in window.values_list('start_time', 'total_pages').iterator():
+        day = timezone.localdate(start_time)
+        if day in pages:
+            pages[day] += n
+
+    waiting = list(
+        WorkOrder.objects.filter(out_bound__stage=OutboundStage.CATALOGUED)
+        .values('operator_id', 'operator__full_name').annotate(n=Count('id')).order_by('-n', 'operator_id')
+    )
+    return {
+        'stages': [(s.label, stages[s.value]) for s in OutboundStage],
+        'total': sum(stages.values()),
+        'ocr_avg': round(qc['avg'], 1) if qc['avg'] is not None else None,
+        'ocr_checked': qc['n'],
+        'pages_by_day': sorted(pages.items()),
+        'pages_total': sum(pages.values()),
+        'waiting_qc': [{'operator': r['operator__full_name'], 'n': r['n']} for r in waiting],
+        'computed_at': timezone.now(),
+    }
+
+
+@transaction.atomic
+def claim_outbound(out_bound: Outbound, user) -> WorkOrder:
+    """
+    承接出库单：以 WHERE taken_by IS NULL 的条件 UPDATE 抢占，受影响行数即胜负；
+    工作单、任务及其分类、outbound.claimed 事件与抢占在同一事务内，任何一步失败整体回滚，不留孤儿工作单。
+    抢占条件与阶段推进是同一条语句：stage 从“待承接”改为“已承接”。
+    """
+    if out_bound.librarian_id == user.id:
+        raise PermissionError("不可承接自己登记的资料")
+    project_id, category_id = claim_lookups()
+
+    now = timezone.now()
+    won = Outbound.objects.filter(pk=out_bound.pk, stage=OutboundStage.REGISTERED, taken_by__isnull=True).update(
+        taken_by=user, taken_at=now, stage=OutboundStage.CLAIMED,
+    )
+    if not won:
+        raise ValueError("该出库单已被承接")
+    out_bound.taken_by = user
+    out_bound.taken_at = now
+    out_bound.stage = OutboundStage.CLAIMED
+
+    # ➤ 生成批次号（日期+当日序号）
+    batch_no = WorkOrder.next_batch_no(now.date())
+
+    # ➤ 创建数字化工作单
+    work_order = WorkOrder.objects.create(
+        out_bound=out_bound,
+        batch_no=batch_no,
+        start_time=now,
+        operator=user,
+        title="",  # 待填写
+        main_responsibility="", other_responsibility="",
+        other_title="", pub_place="", publisher="", pub_year="",
+        total_pages=0, doc_type="",
+        registrar=user,
+        registered_at=now,
+    )
+
+    # ➤ 创建任务（描述 = 批次号数字化），分类关联直接写中间表
+    try:
+        with transaction.atomic():
+            _create_task(batch_no, user, out_bound, project_id, category_id)
+    except IntegrityError:
+        # 缓存的项目/分类 id 已失效（其它进程删除后重建）：丢弃缓存、按名称重查后再试一次
+        _drop_lookups()
+        project_id, category_id = claim_lookups()
+        _create_task(batch_no, user, out_bound, project_id, category_id)
+
+    emit('outbound.claimed', out_bound.pk, {
+        'id': out_bound.pk, 'taken_by_id': user.id, 'taken_by': user.full_name,
+    })
+    stage_changed()
+    return work_order
+
+
+def _create_task(batch_no, user, out_bound, project_id, category_id) -> Task:
+    task = Task.objects.create(
+        title=DIGITIZATION_PROJECT,
+        description=f"{batch_no}数字化",
+        responsible=user,
+        project_id=project_id,
+        out_bound=out_bound,
+    )
+    Task.categories.through.objects.create(task=task, category_id=category_id)
+    return task
+
+
+def catalogue_stage(work_order: WorkOrder) -> None:
+    """保存工作单后同步阶段：题名已填为“已著录”，被清空则退回“已承接”（已质检及之后不受影响）"""
+    target = OutboundStage.CATALOGUED if work_order.title else OutboundStage.CLAIMED
+    advance_stage(work_order.out_bound_id, target, (OutboundStage.CLAIMED, OutboundStage.CATALOGUED))
+
+
+# ---- 批量登记出库单（CSV / XLSX）----
+IMPORT_CHUNK = 500
+
+# 表头别名：既接受字段名，也接受登记页面上的中文标题
+IMPORT_HEADERS = {
+    'name': ('name', '资料名称'),
+    'category': ('category', '资料种类', '种类'),
+    'pages': ('pages', '页数'),
+    'platen': ('platen', '扫描设备', '扫描压板需求'),
+    'color_paper': ('color_paper', '色纸需求', '是否需要色纸'),
+    'condition': ('condition', '出库书况登记', '书况'),
+    'notes': ('notes', '备注'),
+}
+_TRUE = {'1', 'true', 'yes', 'y', 'on', '是', '需要'}
+_FALSE = {'', '0', 'false', 'no', 'n', 'off', '否', '不需要'}
+
+
+def _choice_map(choices):
+    """选项值与中文标题都映射到值，如 {'book': 'book', '图书': 'book'}"""
+    return {str(k).lower(): v for v, label in choices for k in (v, label)}
+
+
+def _column(rows, field):
+    """按别名取出整列（去掉首尾空白，None 视为空串）"""
+    aliases = IMPORT_HEADERS[field]
+    out = []
+    for r in rows:
+        v = next((r[a] for a in aliases if a in r), None)
+        out.append('' if v is None else str(v).strip())
+    return out
+
+
+# 页数列是 IntegerField：按 MySQL INT 的范围校验，越界值不能进入 bulk_create（否则整块事务失败）
+PAGES_MAX = 2 ** 31 - 1
+
+
+def _int_or_error(v):
+    if v == '':
+        return None, None
+    try:
+        n = int(v)
+    except ValueError:
+        try:
+            f = float(v)  # Excel 里的数字常读成 120.0
+        except ValueError:
+            return None, '页数必须是整数'
+        if not f.is_integer():  # 含 12.5 以及 inf / nan（1e400）
+            return None, '页数必须是整数'
+        n = int(f)
+    if n < 0:
+        return None, '页数不能为负数'
+    if n > PAGES_MAX:
+        return None, f'页数不能超过 {PAGES_MAX}'
+    return n, None
+
+
+def import_outbounds(rows, librarian, chunk_size: int = IMPORT_CHUNK,
+                     lines: list[int] | None = None) -> tuple[int, list[tuple[int, str]]]:
+    """
+    批量登记出库单：rows 为读出的字典列表，lines 为各行在表格中的行号（read_numbered_rows，表头为第 1 行）；
+    未给出 lines 时按 rows 紧接表头连续编号。
+    先逐列校验（种类/设备选项表、页数、色纸）得到每行错误，合法行按 chunk 分块 bulk_create，
+    每块一个事务并写一条 outbound.created 事件。非法行记录 (行号, 原因) 后跳过。返回 (创建数量, 错误列表)。
+    """
+    categories = _choice_map(Outbound.CATEGORY_CHOICES)
+    platens = _choice_map(Outbound.PLATEN_CHOICES)
+    names = _column(rows, 'name')
+    cat_col = [categories.get(v.lower()) for v in _column(rows, 'category')]
+    platen_col = [platens.get(v.lower()) for v in _column(rows, 'platen')]
+    pages_col = [_int_or_error(v) for v in _column(rows, 'pages')]
+    color_col = [v.lower() for v in _column(rows, 'color_paper')]
+    conditions = _column(rows, 'condition')
+    notes = _column(rows, 'notes')
+    name_limit = Outbound._meta.get_field('name').max_length
+
+    valid: list[Outbound] = []
+    errors: list[tuple[int, str]] = []
+    for i in range(len(rows)):
+        errs = []
+        if not names[i]:
+            errs.append('资料名称为必填')
+        elif len(names[i]) > name_limit:
+            errs.append(f'资料名称不能超过 {name_limit} 字')
+        if cat_col[i] is None:
+            errs.append('资料种类必须是：图书 / 照片 / 手稿 / 其它')
+        if platen_col[i] is None:
+            errs.append('扫描设备必须是：平板 / V型板')
+        pages, err = pages_col[i]
+        if err:
+            errs.append(err)
+        if color_col[i] not in _TRUE and color_col[i] not in _FALSE:
+            errs.append('色纸需求请填 是 / 否')
+        if errs:
+            errors.append((lines[i] if lines else i + 2, '；'.join(errs)))
+            continue
+        valid.append(Outbound(
+            name=names[i], category=cat_col[i], pages=pages, platen=platen_col[i],
+            color_paper=color_col[i] in _TRUE, condition=conditions[i], notes=notes[i],
+            librarian=librarian,
+        ))
+
+    batch = timezone.now().strftime('%Y%m%d%H%M%S%f')
+    for start in range(0, len(valid), chunk_size):
+        _import_chunk(valid[start:start + chunk_size], librarian, f'{batch}:{start}')
+    if valid:
+        stage_changed()
+    return len(valid), errors
+
+
+@transaction.atomic
+def _import_chunk(objs, librarian, key) -> None:
+    Outbound.objects.bulk_create(objs)
+    # 一块一条事件：待承接列表据 count 提示新登记数量（MySQL 的 bulk_create 不回填主键）
+    emit('outbound.created', f'import:{key}', {
+        'count': len(objs), 'librarian_id': librarian.id, 'librarian': librarian.full_name,
+    })
@@ -0,0 +1,31 @@
+# digitization/signals.py
+from __future__ import annotations
+
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from tasks.models import Project, Category
+from .models import OutboundStage, QualityCheck, WorkOrder
+from .services import advance_stage, forget_lookups
+
+
+@receiver([post_save, post_delete], sender=Project)
+@receiver([post_save, post_delete], sender=Category)
+def _lookup_changed(sender, instance, **kwargs):
+    forget_lookups()
+
+
+@receiver(post_save, sender=QualityCheck)
+def _quality_checked(sender, instance, created, **kwargs):
+    """质检记录无论来自质检页面还是后台，都把出库单推进到“已质检”（阶段字段在后台只读）"""
+    if created:
+        advance_stage(instance.work_order.out_bound_id, OutboundStage.CHECKED,
+                      (OutboundStage.CLAIMED, OutboundStage.CATALOGUED))
+
+
+@receiver(post_delete, sender=QualityCheck)
+def _quality_check_removed(sender, instance, **kwargs):
+    """后台删除质检记录：尚未入库的出库单退回质检前的阶段"""
+    row = WorkOrder.objects.filter(pk=instance.work_order_id).values_list('out_bound_id', 'title').first()
+    if row:  # 工作单已不存在时无需处理
+        advance_stage(row[0], OutboundStage.CATALOGUED if row[1] else OutboundStage.CLAIMED, (OutboundStage.CHECKED,))
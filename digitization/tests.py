@@ -1,3 +1,311 @@
-from django.test import TestCase
+import datetime
+import io
+import threading
+from unittest import mock, skipIf
 
-# Create your tests here.
+from django.contrib.admin import site
+from django.core.cache import cache
+from django.db import IntegrityError, connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from tasks.models import Task, Project, Category
+from flow.utils import read_rows, read_numbered_rows
+from users.models import User
+from . import services
+from .models import Outbound, OutboundStage, WorkOrder, DailySequence, QualityCheck
+
+try:
+    import openpyxl
+except ImportError:  # 可选依赖
+    openpyxl = None
+
+DAY = datetime.date(2025, 3, 1)
+
+
+def _work_order(user, batch_no):
+    ob = Outbound.objects.create(name='资料', category='book', platen='flat', librarian=user)
+    return WorkOrder.objects.create(
+        out_bound=ob, batch_no=batch_no, start_time=timezone.now(), operator=user, title='',
+        total_pages=0, registrar=user, registered_at=timezone.now(),
+    )
+
+
+class DailySequenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='seq', emp_id='S1', full_name='取号人')
+
+    def test_continues_after_legacy_numbers_and_restarts_each_day(self):
+        for i in range(1, 4):
+            _work_order(self.user, f'20250301{i:04d}')
+        self.assertEqual(WorkOrder.next_batch_no(DAY), '202503010004')
+        self.assertEqual(WorkOrder.next_batch_no(DAY), '202503010005')
+        self.assertEqual(WorkOrder.next_batch_no(DAY + datetime.timedelta(days=1)), '202503020001')
+
+    def test_allocation_cost_does_not_grow_with_history(self):
+        WorkOrder.next_batch_no(DAY)
+        for i in range(2, 50):
+            _work_order(self.user, f'20250301{i:04d}')
+        # 已有当天计数行：存在性检查 + UPDATE + 读回（外加事务保存点），与当天单据数无关
+        with self.assertNumQueries(5):
+            self.assertEqual(WorkOrder.next_batch_no(DAY), '202503010002')
+
+
+class ClaimOutboundTests(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create(username='lib', emp_id='L1', full_name='库管')
+        self.operator = User.objects.create(username='op', emp_id='O1', full_name='扫描员')
+        Project.objects.create(name=services.DIGITIZATION_PROJECT)
+        Category.objects.create(name=services.SCAN_CATEGORY)
+        self.ob = Outbound.objects.create(name='资料', category='book', platen='flat', librarian=self.librarian)
+
+    def test_claim_creates_order_and_task_once(self):
+        wo = services.claim_outbound(self.ob, self.operator)
+        task = Task.objects.get(out_bound=self.ob)
+        self.assertEqual(task.description, f'{wo.batch_no}数字化')
+        self.assertEqual([c.name for c in task.categories.all()], [services.SCAN_CATEGORY])
+
+        other = User.objects.create(username='op2', emp_id='O2', full_name='扫描员乙')
+        with self.assertRaises(ValueError):  # 另一请求拿着承接前读到的旧行
+            services.claim_outbound(Outbound(pk=self.ob.pk, librarian=self.librarian), other)
+        self.assertEqual((WorkOrder.objects.count(), Task.objects.count()), (1, 1))
+
+    def test_missing_project_rolls_back_and_lookups_follow_renames(self):
+        Project.objects.update(name='改名')
+        with self.captureOnCommitCallbacks(execute=True):
+            services.forget_lookups()
+        with self.assertRaises(LookupError):
+            services.claim_outbound(self.ob, self.operator)
+        self.assertIsNone(Outbound.objects.get(pk=self.ob.pk).taken_by_id)
+
+        p = Project.objects.get()
+        p.name = services.DIGITIZATION_PROJECT
+        with self.captureOnCommitCallbacks(execute=True):
+            p.save()  # 信号在提交后清理缓存
+        self.assertEqual(services.claim_lookups()[0], p.id)
+
+    def test_stale_cached_lookup_is_refreshed_on_claim(self):
+        # 模拟另一进程的本地缓存：项目已删除重建，缓存里仍是旧 id
+        old = Project.objects.get()
+        services.claim_lookups()
+        old.delete()
+        cache.set(services.LOOKUP_KEY.format(Project._meta.label_lower, services.DIGITIZATION_PROJECT), old.pk)
+        new = Project.objects.create(name=services.DIGITIZATION_PROJECT)
+        real = services._create_task
+
+        def create_task(batch_no, user, out_bound, project_id, category_id):
+            if not Project.objects.filter(pk=project_id).exists():  # 与 MySQL 外键即时检查一致
+                raise IntegrityError('FOREIGN KEY constraint failed')
+            return real(batch_no, user, out_bound, project_id, category_id)
+
+        with mock.patch.object(services, '_create_task', side_effect=create_task):
+            services.claim_outbound(self.ob, self.operator)
+        self.assertEqual(Task.objects.get(out_bound=self.ob).project_id, new.pk)
+        self.assertEqual(services.claim_lookups()[0], new.pk)
+
+    def test_stage_follows_lifecycle_and_drives_lists(self):
+        inspector = User.objects.create(username='qc', emp_id='Q1', full_name='质检员')
+
+        def stage():
+            return Outbound.objects.get(pk=self.ob.pk).stage
+
+        def listed(user, name, context_key='records'):
+            self.client.force_login(user)
+            return [r.pk for r in self.client.get(reverse(name)).context[context_key]]
+
+        wo = services.claim_outbound(self.ob, self.operator)
+        self.assertEqual(stage(), OutboundStage.CLAIMED)
+        self.client.force_login(self.operator)
+        self.client.post(reverse('edit_workorder', args=[self.ob.pk]), {'title': '题名', 'total_pages': '3'})
+        self.assertEqual(stage(), OutboundStage.CATALOGUED)
+        self.assertEqual(listed(inspector, 'pending_quality_list', 'workorders'), [wo.pk])
+
+        self.client.force_login(inspector)
+        self.client.post(reverse('check_quality', args=[wo.pk]), {'ocr_score': '95'})
+        self.assertEqual(stage(), OutboundStage.CHECKED)
+        self.assertEqual(listed(self.librarian, 'return_list'), [self.ob.pk])
+
+        self.client.force_login(self.librarian)
+        self.client.get(reverse('confirm_return', args=[self.ob.pk]))
+        self.assertEqual(stage(), OutboundStage.RETURNED)
+        self.assertEqual(listed(self.librarian, 'return_list'), [])
+        self.assertEqual(listed(self.librarian, 'returned_list'), [self.ob.pk])
+
+    def test_dashboard_is_cached_until_a_stage_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            wo = services.claim_outbound(self.ob, self.operator)
+        first = services.pipeline_dashboard()
+        self.assertEqual(dict(first['stages'])['已承接'], 1)
+        with self.assertNumQueries(0):
+            services.pipeline_dashboard()
+
+        wo.title, wo.total_pages = '题名', 40
+        wo.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            services.catalogue_stage(wo)
+        stats = services.pipeline_dashboard()
+        self.assertEqual(dict(stats['stages'])['已著录'], 1)
+        self.assertEqual(stats['pages_total'], 40)
+        self.assertEqual(stats['waiting_qc'], [{'operator': '扫描员', 'n': 1}])
+
+        # 工作单后来再编辑（registered_at 刷新）不改变其所属的日期桶
+        started = timezone.localdate() - datetime.timedelta(days=2)
+        WorkOrder.objects.filter(pk=wo.pk).update(
+            start_time=timezone.make_aware(datetime.datetime.combine(started, datetime.time(9))),
+            registered_at=timezone.now(),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            services.stage_changed()
+        self.assertEqual(dict(services.pipeline_dashboard()['pages_by_day'])[started], 40)
+
+
+class StageAdminTests(TestCase):
+    def setUp(self):
+        self.librarian = User.objects.create(username='lib', emp_id='L1', full_name='库管')
+        self.operator = User.objects.create(username='op', emp_id='O1', full_name='扫描员')
+        self.wo = _work_order(self.librarian, '202503010001')
+        Outbound.objects.filter(pk=self.wo.out_bound_id).update(stage=OutboundStage.CLAIMED, taken_by=self.operator)
+
+    def stage(self):
+        return Outbound.objects.get(pk=self.wo.out_bound_id).stage
+
+    def test_stage_is_read_only_and_follows_admin_edits(self):
+        request = RequestFactory().post('/')
+        request.user = self.librarian
+        self.assertIn('stage', site._registry[Outbound].get_readonly_fields(request))
+
+        self.wo.title = '题名'
+        site._registry[WorkOrder].save_model(request, self.wo, None, True)
+        self.assertEqual(self.stage(), OutboundStage.CATALOGUED)
+
+        qc = QualityCheck.objects.create(  # 与后台新增质检记录相同的路径
+            work_order=self.wo, tiff_complete=True, jpeg_consistent=True, pdf_assembled=True, ocr_done=True,
+            ocr_score=90, data_intact=True, inspector=self.librarian,
+        )
+        self.assertEqual(self.stage(), OutboundStage.CHECKED)
+        qc.delete()
+        self.assertEqual(self.stage(), OutboundStage.CATALOGUED)
+
+
+class ImportOutboundsTests(TestCase):
+    def test_valid_rows_are_chunked_in_and_bad_rows_reported(self):
+        librarian = User.objects.create(username='lib', emp_id='L1', full_name='库管')
+        sheet = (
+            '\ufeff资料名称,资料种类,页数,扫描设备,色纸需求\n'
+            '甲,图书,120,平板,是\n'
+            '乙,photo,,vshape,\n'
+            ',卷轴,x,滚筒,也许\n'
+            '丙,手稿,3.0,V型板,否\n'
+        )
+        rows = read_rows(io.StringIO(sheet), 'csv')
+        created, errors = services.import_outbounds(rows, librarian, chunk_size=2)
+        self.assertEqual(created, 3)
+        self.assertEqual([no for no, _ in errors], [4])  # 表头为第 1 行
+        self.assertEqual(errors[0][1].count('；'), 4)  # 名称、种类、页数、设备、色纸各一条
+        self.assertEqual(
+            list(Outbound.objects.order_by('id').values_list('name', 'category', 'pages', 'platen', 'color_paper')),
+            [('甲', 'book', 120, 'flat', True), ('乙', 'photo', None, 'vshape', False),
+             ('丙', 'manuscript', 3, 'vshape', False)],
+        )
+        self.assertFalse(Outbound.objects.exclude(stage=OutboundStage.REGISTERED).exists())
+
+    def test_bad_page_counts_are_row_errors_with_sheet_line_numbers(self):
+        librarian = User.objects.create(username='lib', emp_id='L1', full_name='库管')
+        values = ['1e400', 'inf', 'nan', '12.5', '-1', str(services.PAGES_MAX + 1), '9' * 30,
+                  str(services.PAGES_MAX), '7.0']
+        sheet = '资料名称,资料种类,页数,扫描设备,色纸需求\n\n'
+        sheet += ''.join(f'书{i},图书,{v},平板,否\n\n' for i, v in enumerate(values))
+        numbered = read_numbered_rows(io.StringIO(sheet), 'csv')
+        created, errors = services.import_outbounds([r for _, r in numbered], librarian,
+                                                    lines=[no for no, _ in numbered])
+        self.assertEqual(created, 2)  # 越界值不会让整块 bulk_create 失败
+        # 空行被跳过但仍占行号：第 i 条数据在第 3 + 2i 行
+        self.assertEqual([no for no, _ in errors], [3 + 2 * i for i in range(7)])
+        self.assertEqual(sorted(Outbound.objects.values_list('pages', flat=True)), [7, services.PAGES_MAX])
+
+    @skipIf(openpyxl is None, '未安装 openpyxl')
+    def test_xlsx_rows_keep_their_sheet_line_numbers(self):
+        wb = openpyxl.Workbook()
+        ws = wb.active
+        for row, values in [(1, ['资料名称', '资料种类', '页数', '扫描设备', '色纸需求']),
+                            (2, ['甲', '图书', 120, '平板', '是']), (4, ['乙', '图书', 12.5, '平板', '否']),
+                            (6, ['丙', '照片', 3.0, 'V型板', '否'])]:
+            for col, v in enumerate(values, start=1):
+                ws.cell(row=row, column=col, value=v)
+        buf = io.BytesIO()
+        wb.save(buf)
+        buf.seek(0)
+        numbered = read_numbered_rows(buf, 'xlsx')
+        self.assertEqual([no for no, _ in numbered], [2, 4, 6])
+        librarian = User.objects.create(username='lib', emp_id='L1', full_name='库管')
+        _, errors = services.import_outbounds([r for _, r in numbered], librarian, lines=[no for no, _ in numbered])
+        self.assertEqual(errors, [(4, '页数必须是整数')])
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class DailySequenceContentionTests(TransactionTestCase):
+    THREADS = 8
+    ROUNDS = 25
+
+    def test_concurrent_claims_never_collide(self):
+        barrier = threading.Barrier(self.THREADS)
+        values, errors = [], []
+
+        def worker():
+            try:
+                barrier.wait()
+                for _ in range(self.ROUNDS):
+                    values.append(DailySequence.next_value('batch_no', DAY))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(values), list(range(1, self.THREADS * self.ROUNDS + 1)))
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ClaimOutboundContentionTests(TransactionTestCase):
+    THREADS = 8
+
+    def test_one_winner_and_no_orphans(self):
+        librarian = User.objects.create(username='lib', emp_id='L1', full_name='库管')
+        users = [User.objects.create(username=f'op{i}', emp_id=f'O{i}', full_name=f'扫描员{i}')
+                 for i in range(self.THREADS)]
+        Project.objects.create(name=services.DIGITIZATION_PROJECT)
+        Category.objects.create(name=services.SCAN_CATEGORY)
+        services.forget_lookups()
+        ob = Outbound.objects.create(name='资料', category='book', platen='flat', librarian=librarian)
+        barrier = threading.Barrier(self.THREADS)
+        winners, errors = [], []
+
+        def worker(user):
+            try:
+                stale = Outbound.objects.get(pk=ob.pk)
+                barrier.wait()
+                try:
+                    services.claim_outbound(stale, user)
+                    winners.append(user.id)
+                except ValueError:
+                    pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(u,)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(winners), 1)
+        self.assertEqual(Outbound.objects.get(pk=ob.pk).taken_by_id, winners[0])
+        self.assertEqual((WorkOrder.objects.count(), Task.objects.count()), (1, 1))
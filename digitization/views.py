@@ -1,7 +1,12 @@
 from django.http import HttpResponse
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
-from .models import Outbound, WorkOrder, QualityCheck
+from django.db import transaction
+from .models import Outbound, OutboundStage, WorkOrder, QualityCheck
+from . import services
+from flow.services import emit
+from flow.utils import read_numbered_rows
+from tasks.models import Task
 
 
 def is_librarian(user):
@@ -20,77 +25,67 @@ def add_outbound(request):
         condition = request.POST.get('condition', '')
         notes = request.POST.get('notes', '')
         # 创建出库单
-        Outbound.objects.create(
+        ob = Outbound.objects.create(
             name=name, category=category, pages=pages if pages else None,
             platen=platen, color_paper=color_paper,
             condition=condition, notes=notes,
             librarian=request.user
         )
+        services.stage_changed()
+        # 实时通知待承接列表
+        emit('outbound.created', ob.pk, {
+            'id': ob.pk, 'name': ob.name, 'category': ob.get_category_display(), 'pages': ob.pages,
+            'librarian_id': request.user.id, 'librarian': request.user.full_name,
+        })
         return redirect('outbound_list')
     # GET请求，展示表单
     return render(request, 'digitization/add_outbound.html')
 
+IMPORT_ERROR_PREVIEW = 200
+
+
+@login_required
+@user_passes_test(is_librarian)
+def import_outbounds(request):
+    """批量登记：上传 CSV / XLSX，逐行校验后分块写入，返回逐行错误报告"""
+    if request.method != 'POST':
+        return render(request, 'digitization/import_outbounds.html')
+    upload = request.FILES.get('file')
+    if not upload:
+        return render(request, 'digitization/import_outbounds.html', {'error': '请选择要上传的文件'})
+    fmt = 'xlsx' if upload.name.lower().endswith('.xlsx') else 'csv'
+    try:
+        numbered = read_numbered_rows(upload, fmt)
+    except ValueError as e:  # 含编码错误
+        return render(request, 'digitization/import_outbounds.html', {'error': f'文件读取失败：{e}'})
+    rows = [r for _, r in numbered]
+    created, errors = services.import_outbounds(rows, request.user, lines=[no for no, _ in numbered])
+    return render(request, 'digitization/import_outbounds.html', {
+        'report': {
+            'total': len(rows), 'created': created, 'failed': len(errors),
+            'errors': errors[:IMPORT_ERROR_PREVIEW], 'truncated': len(errors) > IMPORT_ERROR_PREVIEW,
+        },
+    })
+
+
 @login_required
 def outbound_list(request):
     # 查询未被承接的出库单
-    out_list = Outbound.objects.filter(taken_by__isnull=True)
+    out_list = Outbound.objects.filter(stage=OutboundStage.REGISTERED).select_related('librarian')
     return render(request, 'digitization/outbound_list.html', {'out_list': out_list})
 
 
-from tasks.models import Task, Project, Category
 @login_required
 def claim_outbound(request, out_id):
-    project = Project.objects.filter(name="馆藏纸本资源数字化").first()
-    if not project:
-        return HttpResponse("⚠️ 请先创建项目：馆藏纸本资源数字化")
-
     out_bound = get_object_or_404(Outbound, id=out_id)
-    category = Category.objects.filter(name="扫描").first()
-    if not category:
-        return HttpResponse("⚠️ 请先创建分类：扫描")
-
-    # 防止重复承接
-    if out_bound.taken_by or out_bound.taken_at:
+    try:
+        services.claim_outbound(out_bound, request.user)
+    except LookupError as e:
+        return HttpResponse(f"⚠️ {e}")
+    except (ValueError, PermissionError):
+        # 已被他人承接 / 不可承接自己登记的资料
         return redirect('outbound_list')
 
-    # 防止登记人自己承接
-    if out_bound.librarian_id == request.user.id:
-        return redirect('outbound_list')
-
-    # 执行承接
-    out_bound.taken_by = request.user
-    out_bound.taken_at = timezone.now()
-    out_bound.save()
-
-    # ➤ 生成批次号（日期+当日序号）
-    date_str = out_bound.taken_at.strftime("%Y%m%d")
-    today_count = WorkOrder.objects.filter(batch_no__startswith=date_str).count() + 1
-    batch_no = f"{date_str}{today_count:04d}"
-
-    # ➤ 创建数字化工作单
-    work_order = WorkOrder.objects.create(
-        out_bound=out_bound,
-        batch_no=batch_no,
-        start_time=out_bound.taken_at,
-        operator=request.user,
-        title="",  # 待填写
-        main_responsibility="", other_responsibility="",
-        other_title="", pub_place="", publisher="", pub_year="",
-        total_pages=0, doc_type="",
-        registrar=request.user,
-        registered_at=out_bound.taken_at
-    )
-
-    # ➤ 创建任务（描述 = 批次号数字化）
-    task = Task.objects.create(
-        title="馆藏纸本资源数字化",
-        description=f"{batch_no}数字化",
-        responsible=request.user,
-        project=project,
-        out_bound=out_bound,
-    )
-    task.categories.add(category)
-
     # 跳转至填写页面
     return redirect('edit_workorder', out_id)
 
@@ -117,7 +112,9 @@ def edit_workorder(request, out_id):
         work_order.notes = request.POST.get('notes', '')
         work_order.registrar = request.user
         work_order.registered_at = timezone.now()
-        work_order.save()
+        with transaction.atomic():
+            work_order.save()
+            services.catalogue_stage(work_order)
         return redirect('outbound_list')
     # GET: 显示表单，初始值为当前记录值
     return render(request, 'digitization/edit_workorder.html', {'wo': work_order})
@@ -125,8 +122,8 @@ def edit_workorder(request, out_id):
 @login_required
 def pending_quality_list(request):
     # 查询所有未检验且已登记完成的工作单
-    workorders = WorkOrder.objects.filter(qualitycheck__isnull=True).filter(title__gt="").select_related('out_bound')
-    # 过滤条件解释：qualitycheck__isnull=True确保没有对应检验；title__gt="" 确保题名已填写（用于排除尚未登记完成的）
+    workorders = WorkOrder.objects.filter(out_bound__stage=OutboundStage.CATALOGUED).select_related('out_bound')
+    # “已著录”即题名已填写且尚未质检
     return render(request, 'digitization/pending_quality_list.html', {'workorders': workorders})
 
 @login_required
@@ -146,19 +143,20 @@ def check_quality(request, wo_id):
         ocr_done = True if request.POST.get('ocr_done') == 'on' else False
         ocr_score = int(request.POST.get('ocr_score') or 0)
         data_intact = True if request.POST.get('data_intact') == 'on' else False
-        # 创建质检记录
-        qc = QualityCheck.objects.create(
-            work_order=work_order,
-            tiff_complete=tiff_complete,
-            jpeg_consistent=jpeg_consistent,
-            pdf_assembled=pdf_assembled,
-            ocr_done=ocr_done,
-            ocr_score=ocr_score,
-            data_intact=data_intact,
-            inspector=request.user
-        )
-        # 标记任务完成：通过出库单找到关联任务
-        Task.objects.filter(out_bound=work_order.out_bound).update(is_done=True, completed_at=timezone.now())
+        with transaction.atomic():
+            # 创建质检记录（signals 随之把阶段推进到“已质检”）
+            qc = QualityCheck.objects.create(
+                work_order=work_order,
+                tiff_complete=tiff_complete,
+                jpeg_consistent=jpeg_consistent,
+                pdf_assembled=pdf_assembled,
+                ocr_done=ocr_done,
+                ocr_score=ocr_score,
+                data_intact=data_intact,
+                inspector=request.user
+            )
+            # 标记任务完成：通过出库单找到关联任务
+            Task.objects.filter(out_bound=work_order.out_bound).update(is_done=True, completed_at=timezone.now())
         return redirect('pending_quality_list')
     # GET: 展示检验表单
     return render(request, 'digitization/check_quality.html', {'wo': work_order})
@@ -232,11 +230,7 @@ def export_full_report(request):
 def return_list(request):
     """展示当前用户负责的可入库出库单"""
     outbounds = Outbound.objects.filter(
-        librarian=request.user,
-        taken_by__isnull=False,
-        workorder__isnull=False,
-        workorder__qualitycheck__isnull=False,
-        is_returned=False
+        librarian=request.user, stage=OutboundStage.CHECKED,
     ).select_related('workorder__qualitycheck', 'taken_by')
 
     return render(request, 'digitization/return_list.html', {
@@ -251,12 +245,9 @@ def confirm_return(request, out_id):
     if outbound.librarian_id != request.user.id:
         return HttpResponse("⚠️ 只有最初出库人可以入库。", status=403)
 
-    if outbound.is_returned:
-        return redirect('return_list')
-
-    outbound.is_returned = True
-    outbound.returned_at = timezone.now()
-    outbound.save()
+    # 只有已质检的资料可以入库；条件 UPDATE，重复点击不会改写入库时间
+    services.advance_stage(outbound.pk, OutboundStage.RETURNED, (OutboundStage.CHECKED,),
+                           is_returned=True, returned_at=timezone.now())
 
     return redirect('return_list')
 
@@ -270,11 +261,7 @@ from django.utils import timezone
 @login_required
 def returned_list(request):
     """展示所有已完成入库的资料记录"""
-    records = Outbound.objects.filter(
-        is_returned=True,
-        workorder__isnull=False,
-        workorder__qualitycheck__isnull=False
-    ).select_related('librarian', 'taken_by', 'workorder__qualitycheck')
+    records = Outbound.objects.filter(stage=OutboundStage.RETURNED).select_related('librarian', 'taken_by', 'workorder__qualitycheck')
 
     return render(request, 'digitization/returned_list.html', {
         'records': records
@@ -301,11 +288,7 @@ def export_returned_csv(request):
         "是否已入库", "入库时间"
     ])
 
-    outbounds = Outbound.objects.filter(
-        is_returned=True,
-        workorder__isnull=False,
-        workorder__qualitycheck__isnull=False
-    ).select_related(
+    outbounds = Outbound.objects.filter(stage=OutboundStage.RETURNED).select_related(
         'librarian', 'taken_by', 'workorder__registrar', 'workorder__qualitycheck__inspector'
     )
 
@@ -4,17 +4,57 @@ from typing import List, Tuple
 
 from django import forms
 from django.contrib import admin
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.auth import get_user_model
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
 
 from .models import (
     FormDef, FormField, FlowTemplate, FlowNode, NodeFieldRule,
-    Transition, FlowInstance, WorkItem, ActionLog
+    Transition, FlowInstance, WorkItem, ActionLog, ArchivedInstance, OutboxEvent, OutboxStatus
 )
+from .compiled import get_compiled_form
+from .services import terminate_instances, reassign_work_items
+
+# 表的估算行数超过该值时，未过滤的列表页用估算值分页，不再精确 COUNT(*)
+ESTIMATE_THRESHOLD = 100_000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    大表分页：未加过滤条件时读 MySQL information_schema 里的估算行数（InnoDB 统计值，O(1)），
+    过滤后或小表仍精确计数。其它数据库后端直接精确计数。
+    """
+
+    @cached_property
+    def count(self):
+        qs = self.object_list
+        if connection.vendor == 'mysql' and not qs.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                    'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                    [qs.model._meta.db_table],
+                )
+                row = cursor.fetchone()
+            if row and row[0] and row[0] >= ESTIMATE_THRESHOLD:
+                return row[0]
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """大表后台的公共设置：估算分页、不再额外统计全表总数"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 # ----- 表单字段内联 -----
 class FormFieldInline(admin.TabularInline):
     model = FormField
     extra = 0
-    fields = ('order', 'name', 'title', 'type', 'required', 'options')
+    fields = ('order', 'name', 'title', 'type', 'required', 'indexed', 'options')
     ordering = ('order', 'id')
     classes = ('collapse',)  # 可视化更干净，想展开可去掉
 
@@ -26,25 +66,26 @@ class FormDefAdmin(admin.ModelAdmin):
 
 
 # ----- 工具：从 FormDef 取字段 choices -----
-def field_choices(tpl: FlowTemplate) -> List[Tuple[str, str]]:
-    try:
-        return [(f.name, f.title or f.name) for f in tpl.form_def.fields.all()]
-    except Exception:
+def field_choices(tpl: FlowTemplate | None) -> List[Tuple[str, str]]:
+    """走编译表单缓存（按 FormDef.version 失效），同一模板的多行内联不再重复查询字段"""
+    if tpl is None or not tpl.form_def_id:
         return []
+    return [(f.name, f.title) for f in get_compiled_form(tpl.form_def).fields]
 
 
 # ----- 节点里的“字段权限规则”内联 -----
 class NodeFieldRuleForm(forms.ModelForm):
+    # 由 NodeFieldRuleInline.get_formset 按所属节点一次性填入
+    field_name_choices: List[Tuple[str, str]] = []
+
     class Meta:
         model = NodeFieldRule
         fields = ('field_name', 'hidden', 'readonly', 'required')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        node = getattr(self.instance, 'node', None)
-        tpl = node.template if node else None
         self.fields['field_name'] = forms.ChoiceField(
-            choices=field_choices(tpl) if tpl else [],
+            choices=self.field_name_choices,
             required=True, label='字段名',
             help_text='从表单字段中选择'
         )
@@ -54,17 +95,24 @@ class NodeFieldRuleInline(admin.TabularInline):
     form = NodeFieldRuleForm
     extra = 0
 
+    def get_formset(self, request, obj=None, **kwargs):
+        choices = field_choices(obj.template) if obj else []
+        kwargs['form'] = type('NodeFieldRuleForm', (self.form,), {'field_name_choices': choices})
+        return super().get_formset(request, obj, **kwargs)
+
 
 @admin.register(FlowNode)
 class FlowNodeAdmin(admin.ModelAdmin):
     list_display = ('id', 'template', 'code', 'name', 'type', 'allow_claim')
     list_filter = ('type', 'template')
     search_fields = ('code', 'name', 'template__code', 'template__name')
+    list_select_related = ('template',)
     filter_horizontal = ('assigned_users', 'assigned_departments')
 
     fieldsets = (
         (None, {'fields': (('template', 'code', 'name', 'type'), 'allow_claim',
                            ('assigned_users', 'assigned_departments'))}),
+        ('处理时限（SLA）', {'fields': (('sla_minutes', 'overdue_action', 'escalate_to'),)}),
         ('兼容旧 JSON（不用再维护）', {'classes': ('collapse',),
                            'fields': ('assignees', 'form_overrides')}),
     )
@@ -85,25 +133,91 @@ class FlowTemplateAdmin(admin.ModelAdmin):
 class TransitionAdmin(admin.ModelAdmin):
     list_display = ('id', 'template', 'source', 'target', 'name', 'priority')
     list_filter = ('template',)
+    list_select_related = ('template', 'source__template', 'target__template')
     search_fields = ('name', 'template__code', 'template__name')
 
 
 @admin.register(FlowInstance)
-class FlowInstanceAdmin(admin.ModelAdmin):
+class FlowInstanceAdmin(LargeTableAdmin):
     list_display = ('id', 'template', 'title', 'status', 'starter', 'current_node', 'updated_at')
     list_filter = ('status', 'template')
+    list_select_related = ('template', 'starter', 'current_node__template')
     search_fields = ('title',)
+    autocomplete_fields = ('template', 'starter', 'current_node')
+    actions = ['terminate']
+
+    @admin.action(description='终止所选运行中的实例')
+    def terminate(self, request, queryset):
+        n = terminate_instances(queryset.values_list('id', flat=True), request.user)
+        self.message_user(request, f'已终止 {n} 个实例')
+
+
+class ReassignActionForm(ActionForm):
+    target = forms.CharField(label='改派给（工号或用户名）', required=False)
 
 
 @admin.register(WorkItem)
-class WorkItemAdmin(admin.ModelAdmin):
+class WorkItemAdmin(LargeTableAdmin):
     list_display = ('id', 'instance', 'node', 'status', 'owner', 'updated_at')
     list_filter = ('status', 'node__template')
+    list_select_related = ('instance', 'node__template', 'owner')
     search_fields = ('instance__title',)
+    autocomplete_fields = ('instance', 'node', 'owner')
+    action_form = ReassignActionForm
+    actions = ['reassign']
+
+    @admin.action(description='改派所选未完成工作项')
+    def reassign(self, request, queryset):
+        key = (request.POST.get('target') or '').strip()
+        target = get_user_model().objects.filter(Q(emp_id=key) | Q(username=key)).first() if key else None
+        if target is None:
+            self.message_user(request, f'找不到改派对象“{key}”', level='error')
+            return
+        n = reassign_work_items(queryset.values_list('id', flat=True), target, request.user)
+        self.message_user(request, f'已改派 {n} 个工作项给 {target}')
 
 
 @admin.register(ActionLog)
-class ActionLogAdmin(admin.ModelAdmin):
+class ActionLogAdmin(LargeTableAdmin):
     list_display = ('id', 'instance', 'node', 'user', 'action', 'created_at')
     list_filter = ('action', 'node__template')
+    list_select_related = ('instance', 'node__template', 'user')
     search_fields = ('remark',)
+    autocomplete_fields = ('instance', 'node', 'user')
+
+
+@admin.register(ArchivedInstance)
+class ArchivedInstanceAdmin(admin.ModelAdmin):
+    """归档只读：不允许新增/修改，删除仅超级管理员"""
+    list_display = ('id', 'template', 'title', 'status', 'starter', 'finished_at', 'archived_at')
+    list_filter = ('status', 'template')
+    search_fields = ('title',)
+    exclude = ('payload',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return request.user.is_superuser
+
+
+@admin.register(OutboxEvent)
+class OutboxEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'topic', 'key', 'status', 'attempts', 'available_at', 'processed_at')
+    list_filter = ('status', 'topic')
+    search_fields = ('key',)
+    readonly_fields = ('topic', 'key', 'payload', 'attempts', 'last_error', 'created_at', 'processed_at')
+    actions = ['requeue']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='重新投递所选事件')
+    def requeue(self, request, queryset):
+        n = queryset.exclude(status=OutboxStatus.DONE).update(
+            status=OutboxStatus.PENDING, attempts=0, available_at=timezone.now(),
+        )
+        self.message_user(request, f'已重新排队 {n} 个事件')
@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class FlowConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'flow'
-    verbose_name = '流程引擎（Flow）'
\ No newline at end of file
+    verbose_name = '流程引擎（Flow）'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,105 @@
+# flow/archive.py
+"""
+冷热分离：把结束超过 N 天的实例连同工作项、操作日志、表单历史压缩进 ArchivedInstance，再从热表删除。
+按 id 分块、每块一个短事务；中断后重跑即从剩余部分继续（已归档的实例已不在热表中）。
+"""
+from __future__ import annotations
+import logging
+from typing import Iterator
+
+from django.db import transaction
+
+from .models import ArchivedInstance, FlowInstance, InstanceStatus
+from .utils import pack_archive
+
+logger = logging.getLogger(__name__)
+
+FINISHED = (InstanceStatus.COMPLETED, InstanceStatus.TERMINATED)
+
+
+def archivable(before):
+    return FlowInstance.objects.filter(status__in=FINISHED, updated_at__lt=before)
+
+
+def _dt(v):
+    return v.isoformat() if v else None
+
+
+def _snapshot(ins: FlowInstance) -> dict:
+    return {
+        'instance': {
+            'id': ins.id, 'template_id': ins.template_id, 'title': ins.title, 'status': ins.status,
+            'starter_id': ins.starter_id, 'current_node_id': ins.current_node_id, 'batch_key': ins.batch_key,
+            'form_data': ins.form_data, 'created_at': _dt(ins.created_at), 'updated_at': _dt(ins.updated_at),
+        },
+        'work_items': [
+            {
+                'id': w.id, 'node_id': w.node_id, 'node_name': w.node.name if w.node_id else '',
+                'assignees': w.assignees, 'owner_id': w.owner_id, 'status': w.status,
+                'due_at': _dt(w.due_at), 'action': w.action, 'comment': w.comment, 'sla_state': w.sla_state,
+                'created_at': _dt(w.created_at), 'updated_at': _dt(w.updated_at),
+            }
+            for w in ins.work_items.all()
+        ],
+        'logs': [
+            {
+                'id': log.id, 'node_id': log.node_id, 'node_name': log.node.name if log.node_id else '',
+                'user_id': log.user_id, 'user_name': str(log.user) if log.user_id else '',
+                'action': log.action, 'payload': log.payload, 'remark': log.remark,
+                'created_at': _dt(log.created_at),
+            }
+            for log in ins.action_logs.all()
+        ],
+        'form_revisions': [
+            {
+                'seq': r.seq, 'node_id': r.node_id, 'user_id': r.user_id, 'action': r.action,
+                'patch': r.patch, 'snapshot': r.snapshot, 'created_at': _dt(r.created_at),
+            }
+            for r in ins.form_revisions.all()
+        ],
+    }
+
+
+@transaction.atomic
+def archive_chunk(ids) -> int:
+    """
+    归档一块实例：写归档行 + 删除热数据（级联删除工作项、候选人、日志）。
+    归档表里已有同 id 的行（例如 MySQL 重启后自增值回退、新实例复用了已归档的 id）时跳过该实例、保留其热数据，
+    只删除本次确实写入了归档行的实例。
+    """
+    instances = list(
+        FlowInstance.objects.select_for_update().filter(pk__in=ids, status__in=FINISHED)
+        .prefetch_related('work_items__node', 'action_logs__node', 'action_logs__user', 'form_revisions')
+    )
+    if not instances:
+        return 0
+    taken = set(ArchivedInstance.objects.filter(pk__in=[i.id for i in instances]).values_list('pk', flat=True))
+    if taken:
+        logger.warning('归档表已存在实例 %s，跳过且不删除热数据', sorted(taken))
+        instances = [i for i in instances if i.id not in taken]
+    # 不用 ignore_conflicts：并发写入同 id 时宁可整块回滚，也不能在未写入归档的情况下删除热数据
+    ArchivedInstance.objects.bulk_create([
+        ArchivedInstance(
+            id=ins.id, template_id=ins.template_id, title=ins.title, status=ins.status,
+            starter_id=ins.starter_id, started_at=ins.created_at, finished_at=ins.updated_at,
+            payload=pack_archive(_snapshot(ins)),
+        )
+        for ins in instances
+    ])
+    FlowInstance.objects.filter(pk__in=[i.id for i in instances]).delete()
+    return len(instances)
+
+
+def archive_finished_instances(before, chunk_size: int = 200, limit: int | None = None) -> Iterator[int]:
+    """逐块归档，每块完成后 yield 本块数量；limit 限制本次最多归档多少个实例"""
+    done = 0
+    last_id = 0
+    while limit is None or done < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - done)
+        ids = list(archivable(before).filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:size])
+        if not ids:
+            return
+        last_id = ids[-1]
+        n = archive_chunk(ids)
+        done += n
+        yield n
@@ -0,0 +1,295 @@
+# flow/compiled.py
+"""
+FlowTemplate 的内存编译版本：节点、有序出边、字段表、节点覆盖一次性装载，
+提交路径不再逐次查询 Transition / FormField / NodeFieldRule / 指派关系。
+
+缓存按 (template_id, version, updated_at) 命中；后台改动节点/连线/字段规则/表单字段时，
+signals 会顺带刷新模板的 updated_at，各进程下次读到模板行时自然重建。
+
+FormDef 同理编译为 CompiledForm（按 (form_id, FormDef.version) 缓存）：选项预先切好、
+类型转换函数预先选好，视图渲染与服务层校验共用同一份。
+"""
+from __future__ import annotations
+import math
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.db.models import F
+from django.utils import timezone
+
+from .models import FlowTemplate, FormDef, FormField, FieldType, Transition, NodeType
+from .utils import transition_code, eval_compiled, overrides_from_rules
+
+
+# ---- 表单 ----
+def _to_bool(v):
+    if isinstance(v, bool):
+        return v
+    s = str(v).lower()
+    if s in ('true', '1', 'yes', 'on'):
+        return True
+    if s in ('false', '0', 'no', 'off'):
+        return False
+    return v  # 无法识别时保留原值（与旧逻辑一致）
+
+
+def _to_float(v):
+    f = float(v)
+    if not math.isfinite(f):
+        raise ValueError('inf/nan')  # JSON 列存不了 Infinity/NaN
+    return f
+
+
+_COERCERS: Dict[str, Callable[[Any], Any]] = {
+    FieldType.INTEGER: int,
+    FieldType.NUMBER: _to_float,
+    FieldType.BOOLEAN: _to_bool,
+}
+
+_HTML_TYPES = {
+    FieldType.SELECT: 'select',
+    FieldType.BOOLEAN: 'checkbox',
+    FieldType.INTEGER: 'number',
+    FieldType.NUMBER: 'number',
+    FieldType.TEXT: 'textarea',
+    FieldType.DATE: 'date',
+    FieldType.DATETIME: 'datetime',
+}
+
+def _to_date(v):
+    return v if isinstance(v, date) and not isinstance(v, datetime) else date.fromisoformat(str(v)[:10])
+
+
+def _to_datetime(v):
+    dt = v if isinstance(v, datetime) else datetime.fromisoformat(str(v))
+    return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+
+# 建索引字段：FormFieldValue 上的列与取值转换
+_INDEX_COLUMNS: Dict[str, Tuple[str, Callable[[Any], Any]]] = {
+    FieldType.INTEGER: ('int_value', int),
+    FieldType.BOOLEAN: ('int_value', lambda v: int(_to_bool(v) is True)),
+    FieldType.NUMBER: ('num_value', _to_float),
+    FieldType.DATE: ('date_value', _to_date),
+    FieldType.DATETIME: ('datetime_value', _to_datetime),
+}
+_STR_COLUMN = ('str_value', lambda v: str(v)[:255])
+_BIGINT_MIN, _BIGINT_MAX = -2 ** 63, 2 ** 63 - 1
+
+_NO_OVERRIDES = {"hidden": frozenset(), "readonly": frozenset(), "required": frozenset()}
+
+
+class CompiledField:
+    __slots__ = ('id', 'name', 'title', 'type', 'required', 'html_type', 'enum', 'enum_set', 'coerce',
+                 'indexed', 'column', 'to_column')
+
+    def __init__(self, f: FormField):
+        self.id = f.id
+        self.name = f.name
+        self.title = f.title or f.name
+        self.type = f.type
+        self.required = f.required
+        self.html_type = _HTML_TYPES.get(f.type, 'text')
+        self.enum = tuple(f.enum_list())
+        self.enum_set = frozenset(self.enum)
+        self.coerce = _COERCERS.get(f.type)
+        self.indexed = f.indexed
+        self.column, self.to_column = _INDEX_COLUMNS.get(f.type, _STR_COLUMN)
+
+    def project(self, v):
+        """表单值 -> 索引列的值；空值、无法转换或超出列范围时返回 None（不建索引行）"""
+        if v is None or v == '':
+            return None
+        try:
+            value = self.to_column(v)
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if self.column == 'int_value' and not _BIGINT_MIN <= value <= _BIGINT_MAX:
+            return None
+        return value
+
+    def in_options(self, v) -> bool:
+        try:
+            return v in self.enum_set
+        except TypeError:  # 不可哈希的值必然不在选项中
+            return False
+
+
+class CompiledForm:
+    def __init__(self, form_def: Optional[FormDef]):
+        self.form_id = form_def.id if form_def else None
+        self.version = form_def.version if form_def else 0
+        fields = FormField.objects.filter(form_id=self.form_id) if form_def else ()
+        self.fields: List[CompiledField] = [CompiledField(f) for f in fields]
+        self.fields_map: Dict[str, CompiledField] = {f.name: f for f in self.fields}
+        self.required = frozenset(f.name for f in self.fields if f.required)
+        self.indexed = [f for f in self.fields if f.indexed]
+        self._views: Dict[tuple, List[Dict[str, Any]]] = {}
+
+    def normalize(self, data: Dict[str, Any], required_extra=None) -> Tuple[Dict[str, Any], List[str]]:
+        """类型规范化 + 必填/选项校验；返回 (规范化后的 data, 错误列表)"""
+        errs: List[str] = []
+        out = dict(data)
+        req = self.required | set(required_extra) if required_extra else self.required
+        for f in self.fields:
+            v = out.get(f.name)
+            if v is None or v == '':
+                if f.name in req:
+                    errs.append(f'字段“{f.title}”为必填')
+                continue
+            if f.type == FieldType.SELECT:
+                if not f.in_options(v):
+                    errs.append(f'字段“{f.title}”必须是下拉选项之一')
+            elif f.coerce is not None:
+                try:
+                    out[f.name] = f.coerce(v)
+                except (TypeError, ValueError, OverflowError):
+                    errs.append(f'字段“{f.title}”类型不正确')
+            # TEXT/STRING/DATE/DATETIME 暂不强校验
+        return out, errs
+
+    def view(self, overrides=None) -> List[Dict[str, Any]]:
+        """某组节点覆盖下的字段描述（不含取值）；按覆盖内容缓存，同一节点反复渲染不再重算"""
+        ov = overrides or _NO_OVERRIDES
+        key = (frozenset(ov["hidden"]), frozenset(ov["readonly"]), frozenset(ov["required"]))
+        desc = self._views.get(key)
+        if desc is None:
+            hidden, readonly, required = key
+            desc = [
+                {
+                    "name": f.name,
+                    "title": f.title,
+                    "html_type": f.html_type,
+                    "enum": f.enum,
+                    "required": f.required or f.name in required,
+                    "readonly": f.name in readonly,
+                }
+                for f in self.fields if f.name not in hidden
+            ]
+            self._views[key] = desc
+        return desc
+
+    def render(self, current_data: Dict[str, Any] | None = None, overrides=None) -> List[Dict[str, Any]]:
+        """模板渲染用的字段列表：缓存的描述 + 当前取值"""
+        current_data = current_data or {}
+        return [
+            dict(d, value=current_data.get(d["name"], False if d["html_type"] == "checkbox" else ""))
+            for d in self.view(overrides)
+        ]
+
+
+# 进程级缓存：{form_id: CompiledForm}
+_FORM_CACHE: Dict[int, CompiledForm] = {}
+_EMPTY_FORM = CompiledForm(None)
+
+
+def get_compiled_form(form_def: Optional[FormDef]) -> CompiledForm:
+    if form_def is None:
+        return _EMPTY_FORM
+    cf = _FORM_CACHE.get(form_def.id)
+    if cf is None or cf.version != form_def.version:
+        cf = CompiledForm(form_def)
+        _FORM_CACHE[form_def.id] = cf
+    return cf
+
+
+def invalidate_form(form_id) -> None:
+    """字段变化：本进程丢弃缓存，并递增 FormDef.version 让其他进程重建"""
+    _FORM_CACHE.pop(form_id, None)
+    FormDef.objects.filter(pk=form_id).update(version=F('version') + 1)
+
+
+# ---- 模板 ----
+class CompiledNode:
+    __slots__ = (
+        'id', 'code', 'name', 'type', 'allow_claim', 'sla_minutes', 'obj',
+        'edges', 'overrides', 'assigned_user_ids', 'assigned_dept_ids', 'resolved_user_ids', 'legacy_assignees',
+    )
+
+    def __init__(self, node):
+        self.id = node.id
+        self.code = node.code
+        self.name = node.name
+        self.type = node.type
+        self.allow_claim = node.allow_claim
+        self.sla_minutes = node.sla_minutes
+        self.obj = node
+        self.edges: List[Tuple[Transition, 'CompiledNode']] = []
+        self.overrides = overrides_from_rules(node, None)
+        self.assigned_user_ids = [u.id for u in node.assigned_users.all()]
+        self.assigned_dept_ids = [d.id for d in node.assigned_departments.all()]
+        self.resolved_user_ids = tuple(node.resolved_assignees or ())
+        self.legacy_assignees = node.assignees or []
+
+    @property
+    def is_end(self) -> bool:
+        return self.type == NodeType.END
+
+    def due_at(self, now):
+        """按节点处理时限计算到期时间；未配置返回 None"""
+        return now + timedelta(minutes=self.sla_minutes) if self.sla_minutes else None
+
+    def __repr__(self):
+        return f'<CompiledNode {self.code}>'
+
+
+class CompiledTemplate:
+    def __init__(self, template: FlowTemplate):
+        self.template_id = template.id
+        self.stamp = _stamp(template)
+        self.nodes: Dict[int, CompiledNode] = {}
+        self.start: Optional[CompiledNode] = None
+
+        qs = template.nodes.prefetch_related('field_rules', 'assigned_users', 'assigned_departments')
+        for n in qs:
+            cn = CompiledNode(n)
+            self.nodes[n.id] = cn
+            if cn.type == NodeType.START and self.start is None:
+                self.start = cn
+
+        for t in template.transitions.order_by('priority', 'id'):
+            src, dst = self.nodes.get(t.source_id), self.nodes.get(t.target_id)
+            if src is None or dst is None:
+                continue
+            transition_code(t)  # 预热条件缓存
+            src.edges.append((t, dst))
+
+        self.form = get_compiled_form(
+            FormDef.objects.filter(pk=template.form_def_id).first() if template.form_def_id else None
+        )
+
+    def node(self, node_id) -> CompiledNode:
+        return self.nodes[node_id]
+
+    def route(self, node_id, form: Dict[str, Any], action: str | None = None) -> Optional[CompiledNode]:
+        """按优先级返回第一个条件满足的目标节点；无可达节点返回 None"""
+        ctx = {"form": form, "action": action}
+        for t, target in self.nodes[node_id].edges:
+            try:
+                if eval_compiled(transition_code(t), ctx):
+                    return target
+            except Exception:
+                continue
+        return None
+
+
+# 进程级缓存：{template_id: CompiledTemplate}
+_TEMPLATE_CACHE: Dict[int, CompiledTemplate] = {}
+
+
+def _stamp(template: FlowTemplate):
+    return (template.version, template.updated_at)
+
+
+def get_compiled_template(template: FlowTemplate) -> CompiledTemplate:
+    ct = _TEMPLATE_CACHE.get(template.id)
+    if ct is None or ct.stamp != _stamp(template):
+        ct = CompiledTemplate(template)
+        _TEMPLATE_CACHE[template.id] = ct
+    return ct
+
+
+def invalidate_template(template_id) -> None:
+    """丢弃本进程缓存，并刷新模板 updated_at，让其他进程在下次读模板时重建"""
+    _TEMPLATE_CACHE.pop(template_id, None)
+    FlowTemplate.objects.filter(pk=template_id).update(updated_at=timezone.now())
@@ -0,0 +1,133 @@
+# flow/live.py
+"""
+实时推送（SSE）：每个 ASGI 进程一个 LiveHub，用一个协程轮询发件箱表（按主键区间，约每秒一次），
+把事件分发给本进程内已连接的浏览器，N 个在线用户只对应一次轻量查询，不需要外部消息中间件。
+
+频道：
+- inbox：推给相关处理人——work_item.created（新待办）、work_item.claimed（被他人认领）；
+- outbound：广播——outbound.created（新出库单）、outbound.claimed（出库单已被承接）。
+
+MySQL 自增主键按分配顺序而非提交顺序可见，轮询时回看 SLACK 个主键并按 id 去重，避免漏掉晚提交的事件。
+"""
+from __future__ import annotations
+import asyncio
+import json
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+INBOX_TOPICS = ('work_item.created', 'work_item.claimed')
+OUTBOUND_TOPICS = ('outbound.created', 'outbound.claimed')
+LIVE_TOPICS = INBOX_TOPICS + OUTBOUND_TOPICS
+CHANNELS = {'inbox': INBOX_TOPICS, 'outbound': OUTBOUND_TOPICS}
+
+POLL_INTERVAL = 1.0
+SLACK = 200          # 回看的主键数
+SEEN_LIMIT = 5000    # 去重集合上限
+REPLAY_LIMIT = 1000  # 供断线重连（Last-Event-ID）补发的最近事件
+QUEUE_LIMIT = 200    # 单个连接积压上限，超出说明客户端太慢，丢弃最旧的
+
+
+def recipients(topic: str, payload: Dict[str, Any]) -> Optional[Set[int]]:
+    """事件应推给哪些用户；None 表示频道内广播"""
+    if topic == 'work_item.created':
+        return set(payload.get('assignees') or [])
+    if topic == 'work_item.claimed':
+        return set(payload.get('assignees') or []) - {payload.get('owner_id')}
+    return None
+
+
+def to_message(event_id: int, topic: str, payload: Dict[str, Any]) -> str:
+    """SSE 报文：event 名即 topic，浏览器按 topic 监听；id 用于断线重连"""
+    data = json.dumps(payload, ensure_ascii=False, default=str)
+    return f'id: {event_id}\nevent: {topic}\ndata: {data}\n\n'
+
+
+class Subscriber:
+    def __init__(self, user_id: int, channels: Tuple[str, ...]):
+        self.user_id = user_id
+        self.topics = {t for c in channels for t in CHANNELS.get(c, ())}
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_LIMIT)
+
+    def wants(self, topic: str, users: Optional[Set[int]]) -> bool:
+        return topic in self.topics and (users is None or self.user_id in users)
+
+    def put(self, message: str) -> None:
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+
+class LiveHub:
+    def __init__(self, poll: float = POLL_INTERVAL):
+        self.poll = poll
+        self.subscribers: Set[Subscriber] = set()
+        self.last_id: Optional[int] = None
+        self._seen: OrderedDict = OrderedDict()
+        self._recent: Deque[Tuple[int, str, Optional[Set[int]], str]] = deque(maxlen=REPLAY_LIMIT)
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- 订阅 ----
+    def subscribe(self, user_id: int, channels, last_event_id: Optional[int] = None) -> Subscriber:
+        sub = Subscriber(user_id, tuple(channels))
+        if last_event_id is not None:
+            for eid, topic, users, message in self._recent:
+                if eid > last_event_id and sub.wants(topic, users):
+                    sub.put(message)
+        self.subscribers.add(sub)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self.subscribers.discard(sub)
+
+    # ---- 轮询与分发 ----
+    def fetch(self) -> List[Tuple[int, str, Dict[str, Any]]]:
+        qs = OutboxEvent.objects.filter(topic__in=LIVE_TOPICS)
+        if self.last_id is None:
+            # 首次启动只记录当前位置，不补推历史事件
+            self.last_id = qs.order_by('-id').values_list('id', flat=True).first() or 0
+            return []
+        return list(qs.filter(id__gt=self.last_id - SLACK).order_by('id').values_list('id', 'topic', 'payload')[:1000])
+
+    def dispatch(self, rows) -> int:
+        sent = 0
+        for eid, topic, payload in rows:
+            if eid in self._seen:
+                continue
+            self._seen[eid] = None
+            if len(self._seen) > SEEN_LIMIT:
+                self._seen.popitem(last=False)
+            self.last_id = max(self.last_id or 0, eid)
+            users = recipients(topic, payload)
+            message = to_message(eid, topic, payload)
+            self._recent.append((eid, topic, users, message))
+            for sub in self.subscribers:
+                if sub.wants(topic, users):
+                    sub.put(message)
+                    sent += 1
+        return sent
+
+    def _poll(self):
+        close_old_connections()  # 轮询线程长期存活，按 CONN_MAX_AGE 回收失效连接
+        return self.fetch()
+
+    async def _run(self) -> None:
+        fetch = sync_to_async(self._poll, thread_sensitive=False)
+        while self.subscribers:
+            try:
+                self.dispatch(await fetch())
+            except Exception:
+                logger.exception('实时推送轮询失败')
+            await asyncio.sleep(self.poll)
+
+
+hub = LiveHub()
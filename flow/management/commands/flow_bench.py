@@ -0,0 +1,248 @@
+# flow/management/commands/flow_bench.py
+from __future__ import annotations
+import json
+import platform
+import random
+import time
+from datetime import datetime
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+from django.urls import reverse
+
+from flow.models import (
+    FormDef, FormField, FieldType, FlowTemplate, FlowNode, Transition, FlowInstance,
+    WorkItem, WorkItemStatus, WorkItemCandidate, ActionLog, InstanceStatus,
+)
+from flow.services import start_instance, submit_task
+
+BENCH_CODE = 'bench-flow'
+BENCH_FORM = 'bench-form'
+BENCH_USERS = 10
+CHUNK = 5000
+
+
+class Command(BaseCommand):
+    help = (
+        '流程引擎基准与扩容测试：生成合成表单/模板/历史数据，在不同数据规模下测量 '
+        'start_instance、submit_task、work_inbox、work_submit 的 p50/p95 延迟、每次查询数与吞吐，'
+        '结果写成 JSON 便于跨提交对比。会向当前数据库写入大量数据，请在测试库上运行。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='历史工作项规模（逗号分隔，逐级追加到该数量），最大建议 1000000')
+        parser.add_argument('--ops', type=int, default=100, help='每种操作在每个规模下执行的次数')
+        parser.add_argument('--nodes', type=int, default=12, help='模板审批节点数')
+        parser.add_argument('--edges', type=int, default=6, help='每个节点的条件出边数（含兜底边）')
+        parser.add_argument('--fields', type=int, default=20, help='表单字段数')
+        parser.add_argument('--output', default='bench_results.json', help='结果 JSON 路径')
+        parser.add_argument('--label', default='', help='结果标签，例如提交号')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--cleanup', action='store_true', help='只清理基准数据后退出')
+        parser.add_argument('--noinput', '--no-input', action='store_false', dest='interactive')
+
+    def handle(self, *args, **opts):
+        if opts['cleanup']:
+            self._cleanup()
+            self.stdout.write(self.style.SUCCESS('基准数据已清理'))
+            return
+        if opts['interactive']:
+            answer = input(f'将向数据库 {connection.settings_dict["NAME"]} 写入基准数据，继续？[y/N] ')
+            if answer.strip().lower() != 'y':
+                raise CommandError('已取消')
+
+        random.seed(opts['seed'])
+        setup_test_environment()  # 让测试客户端的 testserver 主机通过 ALLOWED_HOSTS
+        try:
+            sizes = sorted(int(x) for x in opts['sizes'].split(',') if x.strip())
+        except ValueError:
+            raise CommandError('--sizes 必须是逗号分隔的整数')
+
+        users, tpl = self._setup(opts['nodes'], opts['edges'], opts['fields'])
+        client = Client()
+        client.force_login(users[0])
+
+        results = []
+        for size in sizes:
+            self._grow_history(tpl, users, size)
+            for op, fn in (
+                ('start_instance', self._op_start),
+                ('submit_task', self._op_submit),
+                ('work_inbox', self._op_inbox),
+                ('work_submit', self._op_work_submit),
+            ):
+                row = self._measure(op, size, opts['ops'], lambda: fn(tpl, users, client))
+                results.append(row)
+                self.stdout.write(
+                    f"{size:>9}  {op:<15} p50={row['p50_ms']:8.2f}ms  p95={row['p95_ms']:8.2f}ms  "
+                    f"queries={row['queries_per_op']:6.1f}  {row['ops_per_sec']:8.1f} ops/s"
+                )
+
+        report = {
+            'label': opts['label'],
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'db_vendor': connection.vendor,
+            'config': {k: opts[k] for k in ('ops', 'nodes', 'edges', 'fields', 'seed')},
+            'results': results,
+        }
+        with open(opts['output'], 'w', encoding='utf-8') as fh:
+            json.dump(report, fh, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS(f'结果已写入 {opts["output"]}'))
+
+    # ----- 数据准备 -----
+    def _setup(self, n_nodes, n_edges, n_fields):
+        U = get_user_model()
+        users = []
+        for i in range(BENCH_USERS):
+            u, _ = U.objects.get_or_create(
+                username=f'bench-user-{i}', defaults={'emp_id': f'BENCH{i:04d}', 'full_name': f'基准用户{i}'},
+            )
+            users.append(u)
+
+        tpl = FlowTemplate.objects.filter(code=BENCH_CODE).first()
+        if tpl:
+            return users, tpl
+
+        with transaction.atomic():
+            form = FormDef.objects.create(name=BENCH_FORM, description='flow_bench 合成表单')
+            FormField.objects.create(form=form, name='score', title='评分', type=FieldType.INTEGER, required=True, order=0)
+            FormField.objects.create(form=form, name='kind', title='类别', type=FieldType.SELECT,
+                                     options='book\nphoto\nmanuscript\nother', order=1)
+            for i in range(max(n_fields - 2, 0)):
+                ftype = (FieldType.STRING, FieldType.INTEGER, FieldType.NUMBER, FieldType.BOOLEAN)[i % 4]
+                FormField.objects.create(form=form, name=f'f{i}', title=f'字段{i}', type=ftype, order=10 + i)
+
+            tpl = FlowTemplate.objects.create(code=BENCH_CODE, name='基准流程', status='active', form_def=form)
+            start = FlowNode.objects.create(template=tpl, code='start', name='开始', type='start')
+            nodes = [
+                FlowNode.objects.create(template=tpl, code=f'n{i}', name=f'审批{i}', type='approval')
+                for i in range(n_nodes)
+            ]
+            end = FlowNode.objects.create(template=tpl, code='end', name='结束', type='end')
+            for n in nodes:
+                n.assigned_users.add(*users)
+
+            Transition.objects.create(template=tpl, source=start, target=nodes[0])
+            chain = nodes + [end]
+            for i, n in enumerate(nodes):
+                # 前 n_edges-1 条条件边基本不命中，最后一条兜底到下一节点：每次提交都要把条件全部求值
+                for k in range(max(n_edges - 1, 0)):
+                    Transition.objects.create(
+                        template=tpl, source=n, target=end, priority=k,
+                        condition=f"form['score'] > {1000 + k} and action == 'reject_{k}'",
+                    )
+                Transition.objects.create(template=tpl, source=n, target=chain[i + 1], priority=1000)
+        tpl.refresh_from_db()
+        return users, tpl
+
+    def _grow_history(self, tpl, users, size):
+        """把基准模板下的工作项补足到 size 条：约 90% 已完成，10% 待办（其中一半属于测量用户）"""
+        have = WorkItem.objects.filter(instance__template=tpl).count()
+        nodes = list(tpl.nodes.filter(type='approval').values_list('id', flat=True))
+        user_ids = [u.id for u in users]
+        t0 = time.perf_counter()
+        while have < size:
+            n = min(CHUNK, size - have)
+            with transaction.atomic():
+                batch = f'bench{have}'
+                instances = FlowInstance.objects.bulk_create([
+                    FlowInstance(template=tpl, status=InstanceStatus.COMPLETED, starter_id=user_ids[0],
+                                 form_data={'score': random.randint(0, 100), 'kind': 'book'},
+                                 title=f'基准历史{have + i}', batch_key=f'{batch}:{i}')
+                    for i in range(n)
+                ])
+                ids = dict(FlowInstance.objects.filter(batch_key__startswith=f'{batch}:').values_list('batch_key', 'id'))
+                iids = [ins.pk or ids[ins.batch_key] for ins in instances]
+                items, logs = [], []
+                for iid in iids:
+                    is_open = random.random() < 0.1
+                    items.append(WorkItem(
+                        instance_id=iid, node_id=random.choice(nodes), assignees=user_ids,
+                        status=WorkItemStatus.OPEN if is_open else WorkItemStatus.DONE,
+                        owner_id=None if is_open else random.choice(user_ids),
+                    ))
+                    logs.append(ActionLog(instance_id=iid, node_id=items[-1].node_id,
+                                          user_id=user_ids[0], action='start', payload={}))
+                WorkItem.objects.bulk_create(items, batch_size=1000)
+                ActionLog.objects.bulk_create(logs, batch_size=1000)
+                wi_rows = WorkItem.objects.filter(instance_id__in=iids)
+                WorkItemCandidate.objects.bulk_create([
+                    WorkItemCandidate(work_item_id=wid, user_id=uid, status=st)
+                    for wid, st in wi_rows.values_list('id', 'status')
+                    for uid in (user_ids[:BENCH_USERS // 2] if st == WorkItemStatus.OPEN else user_ids[:1])
+                ], batch_size=2000, ignore_conflicts=True)
+            have += n
+        self.stdout.write(f'-- 规模 {size}：历史数据就绪（{time.perf_counter() - t0:.1f}s）')
+
+    # ----- 各项操作 -----
+    def _form(self):
+        return {'score': random.randint(0, 100), 'kind': random.choice(['book', 'photo']), 'f0': 'x'}
+
+    def _fresh_item(self, tpl, users):
+        ins = start_instance(tpl, users[0], self._form(), title='基准实例')
+        return ins.work_items.get(status=WorkItemStatus.OPEN)
+
+    def _op_start(self, tpl, users, client):
+        return lambda: start_instance(tpl, users[0], self._form(), title='基准实例')
+
+    def _op_submit(self, tpl, users, client):
+        wi = self._fresh_item(tpl, users)
+        wi = WorkItem.objects.select_related('instance__template').get(pk=wi.pk)
+        return lambda: submit_task(wi, users[0], 'approve', '基准', {})
+
+    def _op_inbox(self, tpl, users, client):
+        url = reverse('flow_work_inbox')
+        return lambda: _ok(client.get(url))
+
+    def _op_work_submit(self, tpl, users, client):
+        wi = self._fresh_item(tpl, users)
+        url = reverse('flow_work_submit', args=[wi.pk])
+        return lambda: _ok(client.post(url, {'action': 'approve', 'comment': '基准', 'score': '50'}))
+
+    def _measure(self, op, size, n_ops, prepare):
+        timings, queries = [], 0
+        for _ in range(n_ops):
+            run = prepare()  # 准备阶段（造待办等）不计入
+            with CaptureQueriesContext(connection) as ctx:
+                t0 = time.perf_counter()
+                run()
+                timings.append(time.perf_counter() - t0)
+            queries += len(ctx.captured_queries)
+        timings.sort()
+        total = sum(timings)
+        return {
+            'size': size,
+            'op': op,
+            'n': n_ops,
+            'p50_ms': _pct(timings, 50) * 1000,
+            'p95_ms': _pct(timings, 95) * 1000,
+            'queries_per_op': queries / n_ops,
+            'ops_per_sec': n_ops / total if total else 0.0,
+        }
+
+    def _cleanup(self):
+        tpl = FlowTemplate.objects.filter(code=BENCH_CODE).first()
+        if tpl:
+            with transaction.atomic():
+                FlowInstance.objects.filter(template=tpl).delete()
+                tpl.delete()
+        FormDef.objects.filter(name=BENCH_FORM).delete()
+        get_user_model().objects.filter(username__startswith='bench-user-').delete()
+
+
+def _pct(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    k = min(len(sorted_values) - 1, max(0, round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def _ok(response):
+    if response.status_code >= 400:
+        raise CommandError(f'请求失败：HTTP {response.status_code}')
+    return response
@@ -0,0 +1,56 @@
+# flow/management/commands/flow_bench_conditions.py
+from __future__ import annotations
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from flow.models import Transition
+from flow.utils import safe_eval, transition_code, eval_compiled
+
+
+class Command(BaseCommand):
+    help = '条件表达式微基准：对比“每次解析”与“预编译缓存”两种路径的每秒求值次数（不访问数据库）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--edges', type=int, default=50, help='每个节点的出边数量')
+        parser.add_argument('--rounds', type=int, default=2000, help='模拟提交次数')
+
+    def handle(self, *args, **opts):
+        edges, rounds = opts['edges'], opts['rounds']
+        now = timezone.now()
+        # 前 N-1 条边都不满足，最后一条无条件直通：即每次提交都要把所有条件求值一遍
+        transitions = [
+            Transition(
+                id=i + 1, priority=i, updated_at=now,
+                condition=f"form['ocr_score'] >= {1000 + i} and form['pages'] < 1000 or action == 'reject_{i}'",
+            )
+            for i in range(edges - 1)
+        ]
+        transitions.append(Transition(id=edges, priority=edges, updated_at=now, condition=''))
+        ctx = {'form': {'ocr_score': 90, 'pages': 120}, 'action': 'submit'}
+
+        def run_parse():
+            for _ in range(rounds):
+                for t in transitions:
+                    if safe_eval(t.condition, ctx):
+                        break
+
+        def run_cached():
+            for _ in range(rounds):
+                for t in transitions:
+                    if eval_compiled(transition_code(t), ctx):
+                        break
+
+        evals = edges * rounds
+        results = []
+        for label, fn in (('每次解析 safe_eval', run_parse), ('预编译缓存', run_cached)):
+            t0 = time.perf_counter()
+            fn()
+            cost = time.perf_counter() - t0
+            results.append(cost)
+            self.stdout.write(f'{label:<16} {cost:8.3f}s  {evals / cost:>12,.0f} 次/秒')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'边数={edges} 提交次数={rounds}，加速 {results[0] / results[1]:.1f}x'
+        ))
@@ -0,0 +1,87 @@
+# flow/management/commands/flow_node_stats.py
+from __future__ import annotations
+import time
+from collections import Counter, defaultdict
+from datetime import date, datetime, time as dtime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from flow.models import FlowNode, FlowTemplate, NodeDailyStat, NodeDwellBucket, WorkItem, WorkItemStatus
+from flow.stats import bucket_of
+
+
+class Command(BaseCommand):
+    help = (
+        '按历史工作项重算节点日统计（进入数、完成数、停留时长与分桶）。'
+        '注意：已归档实例的工作项不在热表中，重算早于归档时间点的日期会丢失这部分统计。'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', help='只重算指定模板编码')
+        parser.add_argument('--since', type=date.fromisoformat, help='起始日期 YYYY-MM-DD（含），缺省为全部历史')
+        parser.add_argument('--until', type=date.fromisoformat, help='截止日期 YYYY-MM-DD（含）')
+
+    def handle(self, *args, **opts):
+        nodes = FlowNode.objects.all()
+        if opts['template']:
+            tpl = FlowTemplate.objects.filter(code=opts['template']).first()
+            if tpl is None:
+                raise CommandError(f'模板不存在：{opts["template"]}')
+            nodes = nodes.filter(template=tpl)
+        node_ids = list(nodes.values_list('id', flat=True))
+        since, until = opts['since'], opts['until']
+
+        def in_range(field):
+            cond = {}
+            if since:
+                cond[f'{field}__gte'] = timezone.make_aware(datetime.combine(since, dtime.min))
+            if until:
+                cond[f'{field}__lte'] = timezone.make_aware(datetime.combine(until, dtime.max))
+            return cond
+
+        t0 = time.perf_counter()
+        entered: Counter = Counter()
+        for node_id, created_at in (WorkItem.objects.filter(node_id__in=node_ids, **in_range('created_at'))
+                                    .values_list('node_id', 'created_at').iterator(chunk_size=10000)):
+            entered[(node_id, timezone.localdate(created_at))] += 1
+
+        completed = defaultdict(lambda: [0, 0.0, 0.0, Counter()])  # 完成数, 时长合计, 最长, 分桶
+        for node_id, created_at, done_at in (
+            WorkItem.objects.filter(node_id__in=node_ids, status=WorkItemStatus.DONE, **in_range('updated_at'))
+            .values_list('node_id', 'created_at', 'updated_at').iterator(chunk_size=10000)
+        ):
+            dwell = max((done_at - created_at).total_seconds(), 0.0)
+            row = completed[(node_id, timezone.localdate(done_at))]
+            row[0] += 1
+            row[1] += dwell
+            row[2] = max(row[2], dwell)
+            row[3][bucket_of(dwell)] += 1
+
+        keys = set(entered) | set(completed)
+        with transaction.atomic():
+            old = NodeDailyStat.objects.filter(node_id__in=node_ids)
+            if since:
+                old = old.filter(day__gte=since)
+            if until:
+                old = old.filter(day__lte=until)
+            old.delete()
+            empty = (0, 0.0, 0.0, None)
+            NodeDailyStat.objects.bulk_create([
+                NodeDailyStat(node_id=n, day=d, entered=entered.get((n, d), 0),
+                              completed=done, dwell_sum=total, dwell_max=longest)
+                for n, d in keys
+                for done, total, longest, _ in [completed.get((n, d), empty)]
+            ], batch_size=1000)
+            ids = {
+                (n, d): pk for pk, n, d in
+                NodeDailyStat.objects.filter(node_id__in=node_ids).values_list('pk', 'node_id', 'day')
+            }
+            NodeDwellBucket.objects.bulk_create([
+                NodeDwellBucket(stat_id=ids[key], bucket=b, count=c)
+                for key, row in completed.items() for b, c in row[3].items()
+            ], batch_size=2000)
+        self.stdout.write(self.style.SUCCESS(
+            f'已重算 {len(node_ids)} 个节点、{len(keys)} 个节点日，用时 {time.perf_counter() - t0:.1f}s'
+        ))
@@ -0,0 +1,47 @@
+# flow/management/commands/flow_outbox_worker.py
+from __future__ import annotations
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from flow.outbox import drain, purge
+
+
+class Command(BaseCommand):
+    help = '发件箱投递进程：批量投递流程事件（通知/回调等），失败按指数退避重试；本地常驻运行，无需消息中间件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100, help='每批领取的事件数')
+        parser.add_argument('--poll', type=float, default=2.0, help='空闲时的轮询间隔（秒）')
+        parser.add_argument('--keep-days', type=int, default=7, help='已投递事件保留天数')
+        parser.add_argument('--once', action='store_true', help='投递完当前所有到期事件后退出（可配合 cron）')
+
+    def handle(self, *args, **opts):
+        batch, keep = opts['batch_size'], timedelta(days=opts['keep_days'])
+        if opts['once']:
+            total_ok = total_failed = 0
+            while True:
+                ok, failed = drain(batch)
+                total_ok, total_failed = total_ok + ok, total_failed + failed
+                if ok + failed < batch:
+                    break
+            purged = purge(timezone.now() - keep)
+            self.stdout.write(self.style.SUCCESS(f'投递成功 {total_ok}，失败 {total_failed}，清理 {purged}'))
+            return
+
+        self.stdout.write('发件箱 worker 已启动，Ctrl+C 退出')
+        last_purge = 0.0
+        try:
+            while True:
+                close_old_connections()
+                ok, failed = drain(batch)
+                if time.monotonic() - last_purge > 3600:
+                    purge(timezone.now() - keep)
+                    last_purge = time.monotonic()
+                if ok + failed < batch:  # 没有积压才休眠
+                    time.sleep(opts['poll'])
+        except KeyboardInterrupt:
+            self.stdout.write('已退出')
@@ -0,0 +1,32 @@
+# flow/management/commands/flow_sla_worker.py
+from __future__ import annotations
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from flow.sla import SlaScheduler
+
+
+class Command(BaseCommand):
+    help = 'SLA 调度进程：按到期时间处理超时工作项（提醒/升级/改派），本地常驻运行，无需消息中间件'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--horizon', type=int, default=600, help='预装载窗口（秒）')
+        parser.add_argument('--poll', type=float, default=30.0, help='最长睡眠/发现新工作项间隔（秒）')
+        parser.add_argument('--once', action='store_true', help='只处理一轮当前已到期的工作项后退出（可配合 cron）')
+
+    def handle(self, *args, **opts):
+        scheduler = SlaScheduler(horizon=timedelta(seconds=opts['horizon']), poll=opts['poll'])
+        if opts['once']:
+            scheduler.refill()
+            n = scheduler.run_due()
+            self.stdout.write(self.style.SUCCESS(f'已处理 {n} 个到期工作项'))
+            return
+        self.stdout.write('SLA 调度器已启动，Ctrl+C 退出')
+        try:
+            while True:
+                close_old_connections()  # 常驻进程：避免用到被数据库断开的连接
+                scheduler.sleep(scheduler.tick())
+        except KeyboardInterrupt:
+            self.stdout.write('已退出')
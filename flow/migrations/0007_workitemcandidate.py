@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:13
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_candidates(apps, schema_editor):
+    """把已有 WorkItem.assignees(JSON) 展开成候选人行；分块写入，忽略已不存在的用户"""
+    WorkItem = apps.get_model('flow', 'WorkItem')
+    WorkItemCandidate = apps.get_model('flow', 'WorkItemCandidate')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    valid_users = set(User.objects.values_list('id', flat=True))
+
+    batch = []
+    for wi in WorkItem.objects.only('id', 'status', 'assignees').iterator(chunk_size=2000):
+        for uid in set(wi.assignees or []):
+            if isinstance(uid, int) and uid in valid_users:
+                batch.append(WorkItemCandidate(work_item_id=wi.id, user_id=uid, status=wi.status))
+        if len(batch) >= 2000:
+            WorkItemCandidate.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        WorkItemCandidate.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0006_formdef_remove_flowtemplate_form_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkItemCandidate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('open', '待处理'), ('claimed', '已认领'), ('done', '已完成'), ('canceled', '已取消')], default='open', max_length=16, verbose_name='状态')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='flow_candidate_items', to=settings.AUTH_USER_MODEL, verbose_name='候选人')),
+                ('work_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='candidates', to='flow.workitem', verbose_name='工作项')),
+            ],
+            options={
+                'verbose_name': '工作项候选人',
+                'verbose_name_plural': '工作项候选人',
+                'indexes': [models.Index(fields=['user', 'status', 'work_item'], name='flow_cand_user_status_idx')],
+                'unique_together': {('work_item', 'user')},
+            },
+        ),
+        migrations.RunPython(backfill_candidates, migrations.RunPython.noop),
+    ]
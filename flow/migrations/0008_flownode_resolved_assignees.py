@@ -0,0 +1,32 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:14
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_resolved_assignees(apps, schema_editor):
+    FlowNode = apps.get_model('flow', 'FlowNode')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    for node in FlowNode.objects.prefetch_related('assigned_users', 'assigned_departments'):
+        ids = {u.id for u in node.assigned_users.all()}
+        dept_ids = [d.id for d in node.assigned_departments.all()]
+        if dept_ids:
+            ids.update(User.objects.filter(department_id__in=dept_ids).values_list('id', flat=True))
+        FlowNode.objects.filter(pk=node.pk).update(resolved_assignees=sorted(ids))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0007_workitemcandidate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flownode',
+            name='resolved_assignees',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='已解析候选人'),
+        ),
+        migrations.RunPython(fill_resolved_assignees, migrations.RunPython.noop),
+    ]
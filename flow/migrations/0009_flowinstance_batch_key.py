@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0008_flownode_resolved_assignees'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowinstance',
+            name='batch_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64, verbose_name='批量发起批次'),
+        ),
+    ]
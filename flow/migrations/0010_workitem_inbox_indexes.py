@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0009_flowinstance_batch_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='workitem',
+            index=models.Index(fields=['status', 'updated_at', 'id'], name='flow_wi_status_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workitem',
+            index=models.Index(fields=['node', 'status', 'updated_at', 'id'], name='flow_wi_node_status_upd_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workitem',
+            index=models.Index(fields=['owner', 'status', 'updated_at'], name='flow_wi_owner_status_upd_idx'),
+        ),
+    ]
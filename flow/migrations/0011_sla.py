@@ -0,0 +1,40 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0010_workitem_inbox_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flownode',
+            name='escalate_to',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='flow_escalation_nodes', to=settings.AUTH_USER_MODEL, verbose_name='超时升级/改派给'),
+        ),
+        migrations.AddField(
+            model_name='flownode',
+            name='overdue_action',
+            field=models.CharField(choices=[('remind', '提醒'), ('escalate', '升级（追加处理人）'), ('reassign', '改派')], default='remind', max_length=16, verbose_name='超时处理'),
+        ),
+        migrations.AddField(
+            model_name='flownode',
+            name='sla_minutes',
+            field=models.PositiveIntegerField(blank=True, help_text='为空表示不计时；创建工作项时据此设置到期时间', null=True, verbose_name='处理时限（分钟）'),
+        ),
+        migrations.AddField(
+            model_name='workitem',
+            name='sla_state',
+            field=models.CharField(blank=True, default='', max_length=16, verbose_name='超时处理状态'),
+        ),
+        migrations.AddIndex(
+            model_name='workitem',
+            index=models.Index(fields=['status', 'due_at'], name='flow_wi_status_due_idx'),
+        ),
+    ]
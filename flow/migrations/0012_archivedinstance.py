@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0011_sla'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedInstance',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='原实例ID')),
+                ('title', models.CharField(blank=True, max_length=255, verbose_name='实例标题')),
+                ('status', models.CharField(choices=[('running', '运行中'), ('completed', '已完成'), ('terminated', '已终止')], max_length=16, verbose_name='状态')),
+                ('started_at', models.DateTimeField(verbose_name='发起时间')),
+                ('finished_at', models.DateTimeField(verbose_name='结束时间')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='归档时间')),
+                ('payload', models.BinaryField(verbose_name='压缩数据')),
+            ],
+            options={
+                'verbose_name': '归档实例',
+                'verbose_name_plural': '归档实例',
+                'ordering': ['-finished_at', '-id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='flowinstance',
+            index=models.Index(fields=['status', 'updated_at'], name='flow_ins_status_upd_idx'),
+        ),
+        migrations.AddField(
+            model_name='archivedinstance',
+            name='starter',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_instances', to=settings.AUTH_USER_MODEL, verbose_name='发起人'),
+        ),
+        migrations.AddField(
+            model_name='archivedinstance',
+            name='template',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_instances', to='flow.flowtemplate', verbose_name='模板'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedinstance',
+            index=models.Index(fields=['starter', 'finished_at'], name='flow_arch_starter_fin_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedinstance',
+            index=models.Index(fields=['template', 'finished_at'], name='flow_arch_tpl_fin_idx'),
+        ),
+    ]
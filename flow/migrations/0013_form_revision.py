@@ -0,0 +1,41 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0012_archivedinstance'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowinstance',
+            name='form_rev',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='表单版本数'),
+        ),
+        migrations.CreateModel(
+            name='FormRevision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField(verbose_name='版本号')),
+                ('action', models.CharField(blank=True, max_length=64, verbose_name='动作')),
+                ('patch', models.JSONField(blank=True, default=list, verbose_name='增量')),
+                ('snapshot', models.JSONField(blank=True, null=True, verbose_name='全量快照')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='时间')),
+                ('instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='form_revisions', to='flow.flowinstance', verbose_name='实例')),
+                ('node', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='flow.flownode', verbose_name='节点')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='修改人')),
+            ],
+            options={
+                'verbose_name': '表单版本',
+                'verbose_name_plural': '表单版本',
+                'ordering': ('instance', 'seq'),
+                'unique_together': {('instance', 'seq')},
+            },
+        ),
+    ]
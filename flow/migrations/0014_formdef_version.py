@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0013_form_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formdef',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='字段版本'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0014_formdef_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='formfield',
+            name='indexed',
+            field=models.BooleanField(default=False, verbose_name='建索引（可按此字段查询实例）'),
+        ),
+        migrations.CreateModel(
+            name='FormFieldValue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('int_value', models.BigIntegerField(blank=True, null=True)),
+                ('num_value', models.FloatField(blank=True, null=True)),
+                ('str_value', models.CharField(blank=True, max_length=255, null=True)),
+                ('date_value', models.DateField(blank=True, null=True)),
+                ('datetime_value', models.DateTimeField(blank=True, null=True)),
+                ('field', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='values', to='flow.formfield', verbose_name='字段')),
+                ('instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='field_values', to='flow.flowinstance', verbose_name='实例')),
+            ],
+            options={
+                'verbose_name': '索引字段值',
+                'verbose_name_plural': '索引字段值',
+                'indexes': [models.Index(fields=['field', 'int_value'], name='flow_ffv_int_idx'), models.Index(fields=['field', 'num_value'], name='flow_ffv_num_idx'), models.Index(fields=['field', 'str_value'], name='flow_ffv_str_idx'), models.Index(fields=['field', 'date_value'], name='flow_ffv_date_idx'), models.Index(fields=['field', 'datetime_value'], name='flow_ffv_dt_idx')],
+                'unique_together': {('instance', 'field')},
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0015_formfieldvalue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('topic', models.CharField(max_length=64, verbose_name='事件类型')),
+                ('key', models.CharField(max_length=128, unique=True, verbose_name='幂等键')),
+                ('payload', models.JSONField(default=dict, verbose_name='内容')),
+                ('status', models.CharField(choices=[('pending', '待投递'), ('done', '已投递'), ('dead', '放弃')], default='pending', max_length=8, verbose_name='状态')),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='尝试次数')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='可投递时间')),
+                ('last_error', models.TextField(blank=True, verbose_name='最近错误')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='投递时间')),
+            ],
+            options={
+                'verbose_name': '发件箱事件',
+                'verbose_name_plural': '发件箱事件',
+                'indexes': [models.Index(fields=['status', 'available_at', 'id'], name='flow_outbox_pending_idx')],
+            },
+        ),
+    ]
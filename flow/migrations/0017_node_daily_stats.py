@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-16 23:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0016_outboxevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NodeDailyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='日期')),
+                ('entered', models.PositiveIntegerField(default=0, verbose_name='进入数')),
+                ('completed', models.PositiveIntegerField(default=0, verbose_name='完成数')),
+                ('dwell_sum', models.FloatField(default=0, verbose_name='停留时长合计（秒）')),
+                ('dwell_max', models.FloatField(default=0, verbose_name='最长停留（秒）')),
+                ('node', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='flow.flownode', verbose_name='节点')),
+            ],
+            options={
+                'verbose_name': '节点日统计',
+                'verbose_name_plural': '节点日统计',
+            },
+        ),
+        migrations.CreateModel(
+            name='NodeDwellBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.SmallIntegerField(verbose_name='桶号')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='数量')),
+                ('stat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='buckets', to='flow.nodedailystat', verbose_name='日统计')),
+            ],
+            options={
+                'verbose_name': '停留时长分桶',
+                'verbose_name_plural': '停留时长分桶',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='nodedailystat',
+            index=models.Index(fields=['day', 'node'], name='flow_nds_day_node_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='nodedailystat',
+            unique_together={('node', 'day')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='nodedwellbucket',
+            unique_together={('stat', 'bucket')},
+        ),
+    ]
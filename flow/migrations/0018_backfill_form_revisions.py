@@ -0,0 +1,40 @@
+from django.db import migrations
+
+CHUNK = 1000
+
+
+def backfill_seq0(apps, schema_editor):
+    """
+    存量实例补 0 号全量快照（迁移时的 form_data），form_rev 置 1；
+    否则旧实例下一次提交会把合并后的表单当作 0 号快照，提交前的内容无从还原。
+    """
+    FlowInstance = apps.get_model('flow', 'FlowInstance')
+    FormRevision = apps.get_model('flow', 'FormRevision')
+    last_id = 0
+    while True:
+        rows = list(
+            FlowInstance.objects.filter(pk__gt=last_id, form_rev=0)
+            .order_by('pk').values_list('pk', 'form_data')[:CHUNK]
+        )
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        ids = [pk for pk, _ in rows]
+        has_history = set(FormRevision.objects.filter(instance_id__in=ids).values_list('instance_id', flat=True))
+        new = [r for r in rows if r[0] not in has_history]
+        FormRevision.objects.bulk_create([
+            FormRevision(instance_id=pk, seq=0, action='backfill', patch=[], snapshot=form_data or {})
+            for pk, form_data in new
+        ], batch_size=CHUNK)
+        FlowInstance.objects.filter(pk__in=[r[0] for r in new]).update(form_rev=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flow', '0017_node_daily_stats'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_seq0, migrations.RunPython.noop),
+    ]
@@ -2,14 +2,18 @@ from __future__ import annotations
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
 
+from .utils import compile_condition, transition_code, forget_transition, unpack_archive
+
 User = settings.AUTH_USER_MODEL
 DEPT_MODEL_PATH = 'users.Department'
 
 class FormDef(models.Model):
     name = models.CharField(max_length=200, unique=True, verbose_name='表单名称')
     description = models.TextField(blank=True, verbose_name='说明')
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name='字段版本')
 
     class Meta:
         verbose_name = '表单定义'
@@ -36,6 +40,7 @@ class FormField(models.Model):
     required = models.BooleanField(default=False, verbose_name='必填')
     options = models.TextField(blank=True, verbose_name='下拉选项（每行一项，仅当类型=下拉单选）')
     order = models.PositiveIntegerField(default=100, verbose_name='显示顺序（小在前）')
+    indexed = models.BooleanField(default=False, verbose_name='建索引（可按此字段查询实例）')
 
     class Meta:
         unique_together = ('form', 'name')
@@ -107,6 +112,12 @@ class NodeType(models.TextChoices):
     GATEWAY = 'gateway', '网关'
     END = 'end', '结束'
 
+class OverdueAction(models.TextChoices):
+    REMIND = 'remind', '提醒'
+    ESCALATE = 'escalate', '升级（追加处理人）'
+    REASSIGN = 'reassign', '改派'
+
+
 class FlowNode(TimeStampedModel):
     template = models.ForeignKey(FlowTemplate, on_delete=models.CASCADE, related_name='nodes', verbose_name='所属模板')
     code = models.SlugField(max_length=64, verbose_name='节点编码')
@@ -118,6 +129,14 @@ class FlowNode(TimeStampedModel):
                                                   verbose_name='指派科室')
 
     allow_claim = models.BooleanField(default=False, verbose_name='是否抢单模式')
+    sla_minutes = models.PositiveIntegerField(null=True, blank=True, verbose_name='处理时限（分钟）',
+                                              help_text='为空表示不计时；创建工作项时据此设置到期时间')
+    overdue_action = models.CharField(max_length=16, choices=OverdueAction.choices, default=OverdueAction.REMIND,
+                                      verbose_name='超时处理')
+    escalate_to = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True,
+                                    related_name='flow_escalation_nodes', verbose_name='超时升级/改派给')
+    # 指派用户 ∪ 指派科室成员 的物化结果；仅在指派关系或用户科室变化时刷新（见 services.refresh_node_assignees）
+    resolved_assignees = models.JSONField(default=list, blank=True, editable=False, verbose_name='已解析候选人')
 
     # ↓ 旧 JSON 字段如仍在你仓库里，可保留但不再使用
     assignees = models.JSONField(default=list, blank=True, verbose_name='[废弃] 指派规则(JSON)')
@@ -166,6 +185,24 @@ class Transition(TimeStampedModel):
         verbose_name = '流转边'
         verbose_name_plural = '流转边'
 
+    def clean(self):
+        super().clean()
+        try:
+            compile_condition(self.condition)
+        except (ValueError, SyntaxError) as e:
+            raise ValidationError({'condition': f'条件表达式不合法：{e}'})
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # 保存即编译入缓存，提交路径只执行预编译的 code
+        transition_code(self)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        res = super().delete(*args, **kwargs)
+        forget_transition(pk)
+        return res
+
 
 class InstanceStatus(models.TextChoices):
     RUNNING = 'running', '运行中'
@@ -180,11 +217,18 @@ class FlowInstance(TimeStampedModel):
     current_node = models.ForeignKey(FlowNode, on_delete=models.SET_NULL, null=True, blank=True, related_name='current_instances', verbose_name='当前节点')
     form_data = models.JSONField(default=dict, verbose_name='表单数据')
     title = models.CharField(max_length=255, blank=True, verbose_name='实例标题')
+    # 批量发起时写入 "<批次>:<行号>"，用于回查主键（MySQL 的 bulk_create 不回填 id），也便于追溯来源
+    batch_key = models.CharField(max_length=64, blank=True, db_index=True, verbose_name='批量发起批次')
+    form_rev = models.PositiveIntegerField(default=0, editable=False, verbose_name='表单版本数')
 
 
     class Meta:
         verbose_name = '流程实例'
         verbose_name_plural = '流程实例'
+        indexes = [
+            # 归档任务按 (status, updated_at) 找出早已结束的实例
+            models.Index(fields=['status', 'updated_at'], name='flow_ins_status_upd_idx'),
+        ]
 
 
 class WorkItemStatus(models.TextChoices):
@@ -203,11 +247,35 @@ class WorkItem(TimeStampedModel):
     due_at = models.DateTimeField(null=True, blank=True, verbose_name='到期时间')
     action = models.CharField(max_length=64, blank=True, verbose_name='处理动作')
     comment = models.TextField(blank=True, verbose_name='处理意见')
+    # 超时已处理到哪一步（空=未处理），调度器据此保证每个工作项只升级一次
+    sla_state = models.CharField(max_length=16, blank=True, default='', verbose_name='超时处理状态')
 
 
     class Meta:
         verbose_name = '待办/工作项'
         verbose_name_plural = '待办/工作项'
+        indexes = [
+            # 收件箱按 (updated_at, id) 做键集分页；按节点过滤时走第二个索引
+            models.Index(fields=['status', 'updated_at', 'id'], name='flow_wi_status_upd_idx'),
+            models.Index(fields=['node', 'status', 'updated_at', 'id'], name='flow_wi_node_status_upd_idx'),
+            models.Index(fields=['owner', 'status', 'updated_at'], name='flow_wi_owner_status_upd_idx'),
+            models.Index(fields=['status', 'due_at'], name='flow_wi_status_due_idx'),
+        ]
+
+
+class WorkItemCandidate(models.Model):
+    """工作项候选人的规范化索引：收件箱与认领权限按 (user, status) 走索引，替代 JSON assignees__contains"""
+    work_item = models.ForeignKey(WorkItem, on_delete=models.CASCADE, related_name='candidates', verbose_name='工作项')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='flow_candidate_items', verbose_name='候选人')
+    status = models.CharField(max_length=16, choices=WorkItemStatus.choices, default=WorkItemStatus.OPEN, verbose_name='状态')
+
+    class Meta:
+        unique_together = ('work_item', 'user')
+        indexes = [
+            models.Index(fields=['user', 'status', 'work_item'], name='flow_cand_user_status_idx'),
+        ]
+        verbose_name = '工作项候选人'
+        verbose_name_plural = '工作项候选人'
 
 
 class ActionLog(TimeStampedModel):
@@ -221,4 +289,146 @@ class ActionLog(TimeStampedModel):
 
     class Meta:
         verbose_name = '操作日志'
-        verbose_name_plural = '操作日志'
\ No newline at end of file
+        verbose_name_plural = '操作日志'
+
+
+class FormRevision(models.Model):
+    """
+    表单历史：每步只存相对上一版的 JSON Patch（patch），每隔若干版存一次全量快照（snapshot），
+    重建任一历史版本 = 最近快照 + 其后的补丁。seq 从 0 开始，0 号必为快照。
+    """
+    instance = models.ForeignKey(FlowInstance, on_delete=models.CASCADE, related_name='form_revisions', verbose_name='实例')
+    seq = models.PositiveIntegerField(verbose_name='版本号')
+    node = models.ForeignKey(FlowNode, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='节点')
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, verbose_name='修改人')
+    action = models.CharField(max_length=64, blank=True, verbose_name='动作')
+    patch = models.JSONField(default=list, blank=True, verbose_name='增量')
+    snapshot = models.JSONField(null=True, blank=True, verbose_name='全量快照')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='时间')
+
+    class Meta:
+        verbose_name = '表单版本'
+        verbose_name_plural = '表单版本'
+        ordering = ('instance', 'seq')
+        unique_together = (('instance', 'seq'),)
+
+
+class FormFieldValue(models.Model):
+    """
+    建索引字段的取值投影：每次写表单时同步，按类型落到对应列上，便于按表单值筛选实例
+    （整数/布尔 -> int_value，小数 -> num_value，日期 -> date_value，日期时间 -> datetime_value，其余 -> str_value）。
+    """
+    instance = models.ForeignKey(FlowInstance, on_delete=models.CASCADE, related_name='field_values', verbose_name='实例')
+    field = models.ForeignKey(FormField, on_delete=models.CASCADE, related_name='values', verbose_name='字段')
+    int_value = models.BigIntegerField(null=True, blank=True)
+    num_value = models.FloatField(null=True, blank=True)
+    str_value = models.CharField(max_length=255, null=True, blank=True)
+    date_value = models.DateField(null=True, blank=True)
+    datetime_value = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = '索引字段值'
+        verbose_name_plural = '索引字段值'
+        unique_together = (('instance', 'field'),)
+        indexes = [
+            models.Index(fields=['field', 'int_value'], name='flow_ffv_int_idx'),
+            models.Index(fields=['field', 'num_value'], name='flow_ffv_num_idx'),
+            models.Index(fields=['field', 'str_value'], name='flow_ffv_str_idx'),
+            models.Index(fields=['field', 'date_value'], name='flow_ffv_date_idx'),
+            models.Index(fields=['field', 'datetime_value'], name='flow_ffv_dt_idx'),
+        ]
+
+
+class NodeDailyStat(models.Model):
+    """
+    节点按天的滚动统计：进入数（按工作项创建日）、完成数与停留时长（按完成日）。
+    在工作项创建/完成时用原子累加增量维护，看板只读这些聚合；停留时长分布见 NodeDwellBucket。
+    """
+    node = models.ForeignKey(FlowNode, on_delete=models.CASCADE, related_name='daily_stats', verbose_name='节点')
+    day = models.DateField(verbose_name='日期')
+    entered = models.PositiveIntegerField(default=0, verbose_name='进入数')
+    completed = models.PositiveIntegerField(default=0, verbose_name='完成数')
+    dwell_sum = models.FloatField(default=0, verbose_name='停留时长合计（秒）')
+    dwell_max = models.FloatField(default=0, verbose_name='最长停留（秒）')
+
+    class Meta:
+        verbose_name = '节点日统计'
+        verbose_name_plural = '节点日统计'
+        unique_together = (('node', 'day'),)
+        indexes = [models.Index(fields=['day', 'node'], name='flow_nds_day_node_idx')]
+
+
+class NodeDwellBucket(models.Model):
+    """停留时长分位数草图：对数分桶（相邻桶上界相差 DWELL_GAMMA 倍）的计数，可跨天直接相加"""
+    stat = models.ForeignKey(NodeDailyStat, on_delete=models.CASCADE, related_name='buckets', verbose_name='日统计')
+    bucket = models.SmallIntegerField(verbose_name='桶号')
+    count = models.PositiveIntegerField(default=0, verbose_name='数量')
+
+    class Meta:
+        verbose_name = '停留时长分桶'
+        verbose_name_plural = '停留时长分桶'
+        unique_together = (('stat', 'bucket'),)
+
+
+class OutboxStatus(models.TextChoices):
+    PENDING = 'pending', '待投递'
+    DONE = 'done', '已投递'
+    DEAD = 'dead', '放弃'
+
+
+class OutboxEvent(models.Model):
+    """
+    事务外发件箱：流程事件与业务写入同一事务落库，由本地 worker 批量投递（通知、回调扫描工位等），
+    失败按指数退避重试；key 为幂等键，同一事件只会入箱一次，下游也可据此去重。
+    """
+    topic = models.CharField(max_length=64, verbose_name='事件类型')
+    key = models.CharField(max_length=128, unique=True, verbose_name='幂等键')
+    payload = models.JSONField(default=dict, verbose_name='内容')
+    status = models.CharField(max_length=8, choices=OutboxStatus.choices, default=OutboxStatus.PENDING, verbose_name='状态')
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='尝试次数')
+    available_at = models.DateTimeField(default=timezone.now, verbose_name='可投递时间')
+    last_error = models.TextField(blank=True, verbose_name='最近错误')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='创建时间')
+    processed_at = models.DateTimeField(null=True, blank=True, verbose_name='投递时间')
+
+    class Meta:
+        verbose_name = '发件箱事件'
+        verbose_name_plural = '发件箱事件'
+        indexes = [
+            models.Index(fields=['status', 'available_at', 'id'], name='flow_outbox_pending_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.topic} {self.key}'
+
+
+class ArchivedInstance(models.Model):
+    """
+    冷数据：结束已久的实例连同工作项、日志压缩成一行（zlib 压缩的 JSON），
+    热表只保留在办与近期数据。id 沿用原实例 id。
+    """
+    id = models.BigIntegerField(primary_key=True, verbose_name='原实例ID')
+    template = models.ForeignKey(FlowTemplate, on_delete=models.SET_NULL, null=True, related_name='archived_instances', verbose_name='模板')
+    title = models.CharField(max_length=255, blank=True, verbose_name='实例标题')
+    status = models.CharField(max_length=16, choices=InstanceStatus.choices, verbose_name='状态')
+    starter = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name='archived_instances', verbose_name='发起人')
+    started_at = models.DateTimeField(verbose_name='发起时间')
+    finished_at = models.DateTimeField(verbose_name='结束时间')
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name='归档时间')
+    payload = models.BinaryField(verbose_name='压缩数据')
+
+    class Meta:
+        ordering = ['-finished_at', '-id']
+        indexes = [
+            models.Index(fields=['starter', 'finished_at'], name='flow_arch_starter_fin_idx'),
+            models.Index(fields=['template', 'finished_at'], name='flow_arch_tpl_fin_idx'),
+        ]
+        verbose_name = '归档实例'
+        verbose_name_plural = '归档实例'
+
+    def __str__(self):
+        return f'#{self.id} {self.title}'
+
+    def data(self) -> dict:
+        """解压出 {instance, work_items, logs}"""
+        return unpack_archive(self.payload)
@@ -0,0 +1,153 @@
+# flow/outbox.py
+"""
+发件箱投递：worker 按 (status, available_at) 索引批量取到期事件，按 topic 分组交给处理函数。
+
+- 认领：短事务里把取到的事件 available_at 推后一个租期，多个 worker 并行也不会重复领取；
+  处理完成后标记 done，失败则按指数退避重排，超过 MAX_ATTEMPTS 标记 dead；
+- 批量：处理函数一次收到同一 topic 的一批事件；整批失败时逐条重试，只让真正出错的事件进入退避；
+- 幂等：事件 key 唯一，回调请求体里每个事件都带自己的 key，下游按它逐条去重（重试可能重复投递）；
+  Idempotency-Key 头是整批 key 的摘要，长度固定，只用于识别同一批请求的重放。
+
+处理函数用 @handler('topic', ...) 注册，签名为 fn(topic, events)；'*' 表示所有 topic。
+settings.FLOW_OUTBOX_WEBHOOKS = {'work_item.created': ['http://scan-station/hook'], '*': [...]} 配置回调地址。
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import urllib.request
+from collections import defaultdict
+from datetime import timedelta
+from typing import Callable, Dict, List, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEvent, OutboxStatus
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+BACKOFF_BASE = 30          # 秒：30s, 60s, 120s ... 封顶 BACKOFF_MAX
+BACKOFF_MAX = 3600
+LEASE = timedelta(minutes=5)
+WEBHOOK_TIMEOUT = 10
+
+_HANDLERS: Dict[str, List[Callable]] = defaultdict(list)
+
+
+def handler(*topics: str):
+    def deco(fn):
+        for t in topics:
+            _HANDLERS[t].append(fn)
+        return fn
+    return deco
+
+
+def handlers_for(topic: str) -> List[Callable]:
+    return _HANDLERS.get(topic, []) + _HANDLERS.get('*', [])
+
+
+@handler('*')
+def post_webhooks(topic: str, events: List[OutboxEvent]) -> None:
+    """把一批事件 POST 给该 topic 配置的回调地址（JSON 数组），每个事件带自己的幂等键，请求头带整批摘要"""
+    hooks = getattr(settings, 'FLOW_OUTBOX_WEBHOOKS', {}) or {}
+    urls = list(hooks.get(topic, [])) + list(hooks.get('*', []))
+    if not urls:
+        return
+    body = json.dumps(
+        [{'id': e.id, 'key': e.key, 'topic': e.topic, 'payload': e.payload} for e in events],
+        ensure_ascii=False, default=str,
+    ).encode('utf-8')
+    # 拼接全部 key 会让请求头随批量无限变长（常见上限 8KB）；取摘要作为批级幂等键
+    batch_key = hashlib.sha256('\n'.join(sorted(e.key for e in events)).encode('utf-8')).hexdigest()
+    for url in urls:
+        req = urllib.request.Request(url, data=body, method='POST', headers={
+            'Content-Type': 'application/json; charset=utf-8',
+            'Idempotency-Key': batch_key,
+        })
+        with urllib.request.urlopen(req, timeout=WEBHOOK_TIMEOUT) as resp:
+            if resp.status >= 300:
+                raise RuntimeError(f'{url} 返回 HTTP {resp.status}')
+
+
+def _claim(batch_size: int, now) -> List[OutboxEvent]:
+    with transaction.atomic():
+        events = list(
+            OutboxEvent.objects.select_for_update(skip_locked=True)
+            .filter(status=OutboxStatus.PENDING, available_at__lte=now)
+            .order_by('available_at', 'id')[:batch_size]
+        )
+        if events:
+            OutboxEvent.objects.filter(pk__in=[e.pk for e in events]).update(available_at=now + LEASE)
+    return events
+
+
+def _deliver(topic: str, events: List[OutboxEvent]) -> Dict[int, str]:
+    """投递一批同 topic 事件，返回 {event_id: 错误}；整批失败时逐条重试定位坏事件"""
+    failed: Dict[int, str] = {}
+    for fn in handlers_for(topic):
+        todo = [e for e in events if e.id not in failed]
+        if not todo:
+            break
+        try:
+            fn(topic, todo)
+            continue
+        except Exception as e:
+            if len(todo) == 1:
+                failed[todo[0].id] = f'{type(e).__name__}: {e}'
+                continue
+        for ev in todo:
+            try:
+                fn(topic, [ev])
+            except Exception as e:
+                failed[ev.id] = f'{type(e).__name__}: {e}'
+    return failed
+
+
+def backoff(attempts: int) -> timedelta:
+    return timedelta(seconds=min(BACKOFF_BASE * 2 ** max(attempts - 1, 0), BACKOFF_MAX))
+
+
+def drain(batch_size: int = 100, now=None) -> Tuple[int, int]:
+    """处理一批到期事件，返回 (成功数, 失败数)"""
+    now = now or timezone.now()
+    events = _claim(batch_size, now)
+    if not events:
+        return 0, 0
+
+    by_topic: Dict[str, List[OutboxEvent]] = defaultdict(list)
+    for e in events:
+        by_topic[e.topic].append(e)
+    failed: Dict[int, str] = {}
+    for topic, group in by_topic.items():
+        failed.update(_deliver(topic, group))
+
+    done_ids = [e.id for e in events if e.id not in failed]
+    finished = timezone.now()
+    if done_ids:
+        OutboxEvent.objects.filter(pk__in=done_ids).update(
+            status=OutboxStatus.DONE, processed_at=finished, attempts=F('attempts') + 1, last_error='',
+        )
+    retry = []
+    for e in events:
+        if e.id in failed:
+            e.attempts += 1
+            e.last_error = failed[e.id][:2000]
+            if e.attempts >= MAX_ATTEMPTS:
+                e.status = OutboxStatus.DEAD
+                logger.error('发件箱事件放弃投递: %s (%s)', e.key, e.last_error)
+            else:
+                e.available_at = finished + backoff(e.attempts)
+            retry.append(e)
+    if retry:
+        OutboxEvent.objects.bulk_update(retry, ['attempts', 'last_error', 'status', 'available_at'])
+    return len(done_ids), len(failed)
+
+
+def purge(before) -> int:
+    """清理已投递的旧事件"""
+    deleted, _ = OutboxEvent.objects.filter(status=OutboxStatus.DONE, processed_at__lt=before).delete()
+    return deleted
@@ -1,9 +1,16 @@
 from __future__ import annotations
+from collections import defaultdict
 from typing import Any, Dict, List
+from django.core.cache import cache
 from django.db import transaction
+from django.utils import timezone
 from django.contrib.auth import get_user_model
-from .models import (FlowTemplate, FlowNode, Transition, FlowInstance, WorkItem, WorkItemStatus, InstanceStatus, ActionLog)
-from .utils import safe_eval, merge_overrides, validate_form, schema_properties, normalize_types
+from .models import (FlowTemplate, FlowNode, Transition, FlowInstance, WorkItem, WorkItemStatus, InstanceStatus, ActionLog,
+                     WorkItemCandidate, OverdueAction, FormRevision, FormFieldValue, OutboxEvent)
+from .utils import merge_overrides, validate_form, schema_properties, normalize_types, form_diff, apply_form_patch, split_pointer
+from .utils import overrides_from_rules as _overrides_from_rules
+from .compiled import get_compiled_template, invalidate_template
+from .stats import record_completed, record_entered
 from django.db.models import Q
 from .models import FormField, FieldType
 
@@ -25,45 +32,6 @@ def _fields_dict(form_def) -> dict:
     """把 FormField 列表转成 {name: FormField} 的 dict"""
     return {f.name: f for f in form_def.fields.all()}
 
-def _normalize_and_validate(fields_map: dict, data: dict, required_extra: set[str]|None=None) -> tuple[dict, list[str]]:
-    """
-    根据字段定义做类型规范化+必填校验；返回 (规范化后的data, 错误列表)
-    required_extra: 节点层面的额外必填（来自 NodeFieldRule）
-    """
-    errs = []
-    out = dict(data)
-    req = set(name for name, f in fields_map.items() if f.required)
-    if required_extra:
-        req |= set(required_extra)
-
-    for name, f in fields_map.items():
-        v = out.get(name, None)
-        # 必填检查
-        if name in req and (v is None or v == ''):
-            errs.append(f'字段“{f.title or name}”为必填')
-            continue
-
-        # 规范化类型
-        if v in (None, ''):
-            continue
-        try:
-            if f.type == FieldType.INTEGER:
-                out[name] = int(v)
-            elif f.type == FieldType.NUMBER:
-                out[name] = float(v)
-            elif f.type == FieldType.BOOLEAN:
-                if isinstance(v, bool): pass
-                elif str(v).lower() in ('true','1','yes','on'):
-                    out[name] = True
-                elif str(v).lower() in ('false','0','no','off'):
-                    out[name] = False
-            elif f.type == FieldType.SELECT:
-                if v not in f.enum_list():
-                    errs.append(f'字段“{f.title or name}”必须是下拉选项之一')
-            # TEXT/STRING/DATE/DATETIME 暂不强校验，后续可加格式校验
-        except Exception:
-            errs.append(f'字段“{f.title or name}”类型不正确')
-    return out, errs
 # def _overrides_from_rules(node, schema):
 #     """
 #     返回 dict: {"hidden": set(), "readonly": set(), "required": set()}
@@ -90,54 +58,22 @@ def _normalize_and_validate(fields_map: dict, data: dict, required_extra: set[st
 #     except Exception:
 #         return False
 
-def _overrides_from_rules(node, schema=None):
-    """
-    优先使用 NodeFieldRule 生成 overrides；
-    如果该节点没有任何规则，则回落旧 JSON (node.form_overrides)。
-    返回结构: {"hidden": set(), "readonly": set(), "required": set()}
-    """
-    try:
-        rules = list(node.field_rules.all())
-    except Exception:
-        rules = []
-
-    if rules:
-        res = {"hidden": set(), "readonly": set(), "required": set()}
-        for r in rules:
-            if r.hidden:
-                res["hidden"].add(r.field_name)
-            if r.readonly:
-                res["readonly"].add(r.field_name)
-            if r.required:
-                res["required"].add(r.field_name)
-        return res
-
-    # 兼容旧 JSON；若你已弃用旧 JSON，可以直接 return {"hidden": set(), "readonly": set(), "required": set()}
-    return merge_overrides(schema or {}, getattr(node, "form_overrides", {}) or {})
-
 def _resolve_assignees(node, form):
     """
-    返回用户ID列表。优先使用新字段 assigned_users/assigned_departments；
-    若都为空，则回落到旧 JSON assignees（兼容期）。
+    返回用户ID列表。node 为 CompiledNode：指派用户/科室成员已物化在 FlowNode.resolved_assignees，
+    随编译模板一起装载，这里不再查询。
+    优先使用新字段 assigned_users/assigned_departments；若都为空，则回落到旧 JSON assignees（兼容期）。
     """
-    user_ids = set()
+    # ✅ 新：读物化结果
+    if node.assigned_user_ids or node.assigned_dept_ids:
+        return list(node.resolved_user_ids)
+    return _legacy_assignees(node.legacy_assignees, form)
+
 
-    # ✅ 新：直接读关系
-    if node.assigned_users.exists() or node.assigned_departments.exists():
-        if node.assigned_users.exists():
-            user_ids.update(node.assigned_users.values_list("id", flat=True))
-
-        if node.assigned_departments.exists():
-            # 假设用户模型有 department 外键
-            dept_ids = list(node.assigned_departments.values_list("id", flat=True))
-            user_ids.update(
-                U.objects.filter(department_id__in=dept_ids).values_list("id", flat=True)
-            )
-        return list(user_ids)
-
-    # ⬇️ 旧：回落 JSON（如还没迁移完）
-    rules = node.assignees or []
-    for r in rules:
+def _legacy_assignees(rules, form) -> List[int]:
+    """旧 JSON assignees 的解析（兼容期）；改派已有工作项时也用同一规则，保证新旧工作项处理人一致"""
+    user_ids = set()
+    for r in rules or []:
         rtype = r.get('type')
         val = r.get('value')
         if rtype == 'user_ids' and isinstance(val, list):
@@ -152,29 +88,285 @@ def _resolve_assignees(node, form):
         elif rtype in ('dept_ids','dept_names'):
             # 如果历史 JSON 里有科室信息，也做一次兼容性解析（可按需扩展）
             pass
-    return list(user_ids)
+    # 旧 JSON 里可能残留已删除的用户，候选人表有外键约束，这里过滤一次
+    if not user_ids:
+        return []
+    return list(U.objects.filter(id__in=user_ids).values_list('id', flat=True))
+
+
+INBOX_ACTIVE = (WorkItemStatus.OPEN, WorkItemStatus.CLAIMED)
+INBOX_COUNT_KEY = 'flow:inbox_count:{}'
+# 计数缓存以“变更即失效”为主；TTL 兜底多进程本地缓存之间的不一致（见 inbox_count）
+INBOX_COUNT_TTL = 60
+
+
+def inbox_queryset(user_id, template_id=None, node_id=None):
+    """收件箱：当前处理人或候选人（走 WorkItemCandidate 索引）的未完成工作项"""
+    candidate_ids = WorkItemCandidate.objects.filter(user_id=user_id, status__in=INBOX_ACTIVE).values('work_item_id')
+    qs = WorkItem.objects.filter(status__in=INBOX_ACTIVE).filter(Q(owner_id=user_id) | Q(id__in=candidate_ids))
+    if node_id:
+        qs = qs.filter(node_id=node_id)
+    elif template_id:
+        # 按节点 id 过滤，命中 (node, status, updated_at) 索引，不必 join 模板
+        qs = qs.filter(node_id__in=FlowNode.objects.filter(template_id=template_id).values('id'))
+    return qs
+
+
+def inbox_count(user_id) -> int:
+    """
+    收件箱角标数：按用户缓存，工作项变化时失效，而不是每次翻页都重新 COUNT。
+    失效只作用于执行变更的进程所连的缓存：未配置 CACHES 时为各进程独立的 LocMemCache，
+    其它 worker 里的角标最多滞后 INBOX_COUNT_TTL（60 秒）；配置 Redis/Memcached 等共享缓存后即时生效。
+    角标仅作提示，待办列表本身始终直接查库。
+    """
+    key = INBOX_COUNT_KEY.format(user_id)
+    n = cache.get(key)
+    if n is None:
+        n = inbox_queryset(user_id).count()
+        cache.set(key, n, INBOX_COUNT_TTL)
+    return n
+
+
+def _bust_inbox_counts(user_ids) -> None:
+    """提交后再删缓存：事务内删除会被并发请求用未提交前的旧计数重新填回"""
+    keys = [INBOX_COUNT_KEY.format(uid) for uid in set(user_ids) if uid]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+# ---- 发件箱：副作用（通知、回调、外部缓存）只在事务内写一行事件，由 flow_outbox_worker 投递 ----
+def _event(topic: str, key, payload: Dict[str, Any]) -> OutboxEvent:
+    return OutboxEvent(topic=topic, key=f'{topic}:{key}', payload=payload)
+
+
+def emit_events(events) -> None:
+    """随当前事务写入发件箱；幂等键冲突（重复事件）直接忽略"""
+    if events:
+        OutboxEvent.objects.bulk_create(events, batch_size=500, ignore_conflicts=True)
+
+
+def emit(topic: str, key, payload: Dict[str, Any]) -> None:
+    """写入单条事件（供其它应用使用，如出库单登记）"""
+    emit_events([_event(topic, key, payload)])
+
+
+def _work_item_created(wi_id, instance_id, node, assignees, due_at, key=None) -> OutboxEvent:
+    """key 缺省为工作项 id；同一工作项再次下发（如改派）时传入不同的 key，避免被幂等键去重"""
+    return _event('work_item.created', key or wi_id, {
+        'work_item_id': wi_id, 'instance_id': instance_id, 'node_id': node.id, 'node_code': node.code,
+        'node_name': node.name, 'assignees': list(assignees), 'due_at': due_at.isoformat() if due_at else None,
+    })
+
+
+def _instance_completed(ins: FlowInstance, user_id) -> OutboxEvent:
+    return _event('instance.completed', ins.id, {
+        'instance_id': ins.id, 'template_id': ins.template_id, 'title': ins.title,
+        'starter_id': ins.starter_id, 'completed_by': user_id,
+    })
+
+
+def _create_work_item(instance: FlowInstance, node, assignees: List[int]) -> WorkItem:
+    """创建工作项，同时写入候选人索引行与 work_item.created 事件"""
+    wi = WorkItem.objects.create(instance=instance, node_id=node.id, assignees=assignees,
+                                 due_at=node.due_at(timezone.now()))
+    WorkItemCandidate.objects.bulk_create(
+        [WorkItemCandidate(work_item=wi, user_id=uid, status=wi.status) for uid in assignees]
+    )
+    _bust_inbox_counts(assignees)
+    record_entered([(node.id, wi.created_at)])
+    emit_events([_work_item_created(wi.id, instance.id, node, assignees, wi.due_at)])
+    return wi
+
+
+def _sync_candidates(work_item: WorkItem) -> None:
+    """工作项状态变化后，同步候选人行的状态，并让相关用户的角标计数失效"""
+    WorkItemCandidate.objects.filter(work_item_id=work_item.id).update(status=work_item.status)
+    _bust_inbox_counts(list(work_item.assignees or []) + [work_item.owner_id])
+
+
+def _is_candidate(work_item: WorkItem, user) -> bool:
+    return WorkItemCandidate.objects.filter(work_item_id=work_item.id, user_id=user.id).exists()
+
+
+def refresh_node_assignees(node_ids) -> None:
+    """
+    重新物化节点的候选人（指派用户 ∪ 指派科室成员），并把这些节点上未完成的工作项批量改派。
+    由 signals 在指派关系或用户科室变化时调用；已认领的工作项保留当前处理人，只更新候选人。
+    """
+    nodes = list(FlowNode.objects.filter(pk__in=node_ids).prefetch_related('assigned_users', 'assigned_departments'))
+    if not nodes:
+        return
+    dept_ids = {d.id for n in nodes for d in n.assigned_departments.all()}
+    dept_members: Dict[int, set] = {}
+    for uid, did in U.objects.filter(department_id__in=dept_ids).values_list('id', 'department_id'):
+        dept_members.setdefault(did, set()).add(uid)
+
+    for node in nodes:
+        ids = {u.id for u in node.assigned_users.all()}
+        for d in node.assigned_departments.all():
+            ids |= dept_members.get(d.id, set())
+        resolved = sorted(ids)
+        if resolved == sorted(node.resolved_assignees or []):
+            continue
+        FlowNode.objects.filter(pk=node.pk).update(resolved_assignees=resolved)
+        if node.assigned_users.all() or node.assigned_departments.all():
+            _retarget_open_work_items(node.pk, resolved)
+        else:
+            # 指派关系被清空：与 _resolve_assignees 相同，回落到旧 JSON 规则，而不是让工作项从所有收件箱消失
+            _retarget_to_legacy(node)
+
+    # 编译模板里还缓存了“是否配置了指派关系”，即使候选人没变也要重建
+    for template_id in {n.template_id for n in nodes}:
+        invalidate_template(template_id)
+
+
+def _retarget_to_legacy(node) -> None:
+    """按旧 JSON 规则逐个实例计算处理人（by_field 依赖实例表单），同一结果的工作项一起改派"""
+    groups: Dict[tuple, List[int]] = {}
+    rows = WorkItem.objects.filter(node_id=node.pk, status__in=INBOX_ACTIVE).values_list('id', 'instance__form_data')
+    for wid, form in rows:
+        key = tuple(sorted(_legacy_assignees(node.assignees, form or {})))
+        groups.setdefault(key, []).append(wid)
+    for user_ids, wids in groups.items():
+        _retarget_open_work_items(node.pk, list(user_ids), wids)
+
+
+def _retarget_open_work_items(node_id, user_ids: List[int], work_item_ids=None) -> None:
+    active = (WorkItemStatus.OPEN, WorkItemStatus.CLAIMED)
+    items = WorkItem.objects.filter(node_id=node_id, status__in=active)
+    if work_item_ids is not None:
+        items = items.filter(pk__in=work_item_ids)
+    _bust_inbox_counts(
+        list(WorkItemCandidate.objects.filter(work_item__in=items).values_list('user_id', flat=True).distinct())
+        + list(user_ids)
+    )
+    items.update(assignees=user_ids)
+    WorkItemCandidate.objects.filter(work_item__in=items).exclude(user_id__in=user_ids).delete()
+    rows = [
+        WorkItemCandidate(work_item_id=wid, user_id=uid, status=st)
+        for wid, st in items.values_list('id', 'status')
+        for uid in user_ids
+    ]
+    WorkItemCandidate.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+# ---- 表单历史（增量 + 周期快照）----
+FORM_SNAPSHOT_EVERY = 20
+
+
+def _form_revision(ins: FlowInstance, old: Dict[str, Any] | None, new: Dict[str, Any],
+                   node_id, user_id, action: str) -> FormRevision | None:
+    """
+    生成下一条表单版本（不落库，调用方负责 save/bulk_create 与保存 ins.form_rev）。
+    0 号版本与每 FORM_SNAPSHOT_EVERY 版存全量快照；内容无变化时不产生版本。
+    """
+    seq = ins.form_rev or 0
+    patch = form_diff(old or {}, new) if seq else []
+    if seq and not patch:
+        return None
+    ins.form_rev = seq + 1
+    return FormRevision(
+        instance_id=ins.id, seq=seq, node_id=node_id, user_id=user_id, action=action or '',
+        patch=patch, snapshot=new if seq % FORM_SNAPSHOT_EVERY == 0 else None,
+    )
+
+
+def form_at_revision(instance: FlowInstance, seq: int | None = None) -> Dict[str, Any]:
+    """重建实例表单在第 seq 版（默认最新版）时的内容：最近快照 + 其后补丁，最多读 FORM_SNAPSHOT_EVERY 行"""
+    revs = FormRevision.objects.filter(instance=instance)
+    if seq is not None:
+        revs = revs.filter(seq__lte=seq)
+    base = revs.filter(snapshot__isnull=False).order_by('-seq').values_list('seq', 'snapshot').first()
+    if base is None:
+        if seq is None and not revs.exists():
+            return dict(instance.form_data or {})  # 尚无历史记录的旧实例
+        raise ValueError('找不到该版本的表单快照')
+    form = base[1]
+    for patch in revs.filter(seq__gt=base[0]).order_by('seq').values_list('patch', flat=True):
+        form = apply_form_patch(form, patch)
+    return form
+
+
+def form_change_log(instance: FlowInstance) -> List[Dict[str, Any]]:
+    """字段级审计：每个版本由谁在哪个节点改了哪些字段（只读补丁，不重建表单）"""
+    rows = []
+    for rev in instance.form_revisions.select_related('user', 'node').order_by('seq'):
+        ops = rev.patch if rev.seq else form_diff({}, rev.snapshot or {})
+        rows.append({'rev': rev, 'changes': [
+            {'field': '.'.join(split_pointer(op['path'])), 'op': op['op'], 'value': op.get('value')}
+            for op in ops
+        ]})
+    return rows
+
+
+# ---- 建索引字段：投影到 FormFieldValue，按表单值筛选实例 ----
+SEARCH_LOOKUPS = {'eq': 'exact', 'lt': 'lt', 'lte': 'lte', 'gt': 'gt', 'gte': 'gte', 'in': 'in', 'contains': 'icontains'}
+
+
+def _index_changed(form, old: Dict[str, Any], new: Dict[str, Any]) -> bool:
+    return any(old.get(f.name) != new.get(f.name) for f in form.indexed)
+
+
+def sync_field_values(form, items) -> int:
+    """items: [(instance_id, form_data), ...]；重写这些实例的索引字段值（先删后插），返回写入行数"""
+    if not items:
+        return 0
+    rows = []
+    for instance_id, data in items:
+        for f in form.indexed:
+            value = f.project((data or {}).get(f.name))
+            if value is not None:
+                rows.append(FormFieldValue(instance_id=instance_id, field_id=f.id, **{f.column: value}))
+    FormFieldValue.objects.filter(instance_id__in=[i for i, _ in items]).delete()
+    FormFieldValue.objects.bulk_create(rows, batch_size=1000)
+    return len(rows)
+
+
+def search_instances(template: FlowTemplate, filters: Dict[str, str]):
+    """
+    按建索引字段筛选模板下的实例。filters 形如 {"ocr_score__gte": "90", "kind": "book", "pages__in": "1,2"}，
+    运算符缺省为 eq；contains 仅用于文本类字段。字段未建索引或取值无法转换时抛 ValueError。
+    """
+    form = get_compiled_template(template).form
+    qs = FlowInstance.objects.filter(template=template)
+    for key, raw in filters.items():
+        name, sep, op = key.rpartition('__')
+        if not sep or op not in SEARCH_LOOKUPS:
+            name, op = key, 'eq'
+        f = form.fields_map.get(name)
+        if f is None or not f.indexed:
+            raise ValueError(f'字段“{name}”未建索引，不能筛选')
+        if op == 'contains':
+            if f.column != 'str_value':
+                raise ValueError(f'字段“{f.title}”不支持模糊匹配')
+            value = str(raw)
+        elif op == 'in':
+            value = [f.project(x.strip()) for x in str(raw).split(',') if x.strip()]
+            if not value or None in value:
+                raise ValueError(f'字段“{f.title}”的筛选值无效')
+        else:
+            value = f.project(raw)
+            if value is None:
+                raise ValueError(f'字段“{f.title}”的筛选值无效')
+        matched = FormFieldValue.objects.filter(field_id=f.id, **{f'{f.column}__{SEARCH_LOOKUPS[op]}': value})
+        qs = qs.filter(id__in=matched.values('instance_id'))
+    return qs
+
 
 @transaction.atomic
 def start_instance(template: FlowTemplate, starter: U, form_data: Dict[str, Any], title: str|None=None) -> FlowInstance:
-    start_node = template.nodes.filter(type='start').first()
+    ct = get_compiled_template(template)
+    start_node = ct.start
     if not start_node:
         raise ValueError('模板缺少开始节点')
 
     # 1) 基于模板主表单进行校验（开始节点不考虑 readonly/hidden，仅校验 schema.required）
-    form_def = template.form_def
-    fields_map = _fields_dict(form_def)
-
     # 先按“表单级”必填校验（发起阶段不套用节点覆盖）
-    form_data, errs = _normalize_and_validate(fields_map, form_data)
+    form_data, errs = ct.form.normalize(form_data)
     if errs:
         raise ValueError("表单校验失败: " + "；".join(errs))
 
     # 2) 决定下一节点
-    next_node = None
-    for t in template.transitions.filter(source=start_node).order_by('priority', 'id'):
-        if _eval_condition(t.condition, form_data, action="start"):
-            next_node = t.target
-            break
+    next_node = ct.route(start_node.id, form_data, action="start")
     if not next_node:
         raise ValueError('开始节点没有可达的后续节点')
 
@@ -182,14 +374,18 @@ def start_instance(template: FlowTemplate, starter: U, form_data: Dict[str, Any]
         template=template,
         status=InstanceStatus.RUNNING,
         starter=starter,
-        current_node=next_node,
+        current_node_id=next_node.id,
         form_data=form_data,
         title=title or f"{template.name}-{starter}",
+        form_rev=1,
     )
 
     assignees = _resolve_assignees(next_node, form_data)
-    WorkItem.objects.create(instance=ins, node=next_node, assignees=assignees)
-    ActionLog.objects.create(instance=ins, node=start_node, user=starter, action='start', payload={'form': form_data})
+    _create_work_item(ins, next_node, assignees)
+    FormRevision.objects.create(instance=ins, seq=0, node_id=start_node.id, user=starter, action='start', snapshot=form_data)
+    if ct.form.indexed:
+        sync_field_values(ct.form, [(ins.id, form_data)])
+    ActionLog.objects.create(instance=ins, node_id=start_node.id, user=starter, action='start', payload={'form_rev': 0})
     return ins
 
 @transaction.atomic
@@ -200,25 +396,27 @@ def submit_task(work_item: WorkItem, user: U, action: str, comment: str | None,
     - 字段权限：优先 NodeFieldRule（隐藏/只读/必填），无规则时回落旧 JSON（兼容）
     - 类型与必填校验：基于 FormField.type/required + 节点额外必填（overrides.required）
     """
-    # 0) 基本状态/权限检查
-    if work_item.status in (WorkItemStatus.DONE, WorkItemStatus.CANCELED):
+    # 0) 基本状态/权限检查：先锁住工作项行并以库中当前状态为准，
+    #    并发提交同一待办时后到者在锁上等待，随后看到“已完成”而失败，不会让实例流转两次
+    current = (WorkItem.objects.select_for_update().filter(pk=work_item.pk)
+               .values_list('status', 'owner_id').first())
+    if current is None or current[0] in (WorkItemStatus.DONE, WorkItemStatus.CANCELED):
         raise ValueError('工作项已完成或已取消')
+    work_item.status, work_item.owner_id = current
 
     uid = user.id
     if work_item.owner_id and work_item.owner_id != uid:
         raise PermissionError('非当前认领人')
-    if not work_item.owner_id and uid not in (work_item.assignees or []):
+    if not work_item.owner_id and not _is_candidate(work_item, user):
         raise PermissionError('不在候选人列表')
 
-    # 1) 取实例/模板/节点/表单定义
-    ins = work_item.instance
-    tpl = ins.template
-    node = work_item.node
-    form_def = tpl.form_def  # ✅ 新：使用结构化表单定义
-    fields_map = _fields_dict(form_def)  # {field_name: FormField}
+    # 1) 取实例/模板，节点与表单字段来自内存中的编译模板；实例在锁之后重新读取，表单不会基于旧值合并
+    ins = FlowInstance.objects.select_related('template').get(pk=work_item.instance_id)
+    ct = get_compiled_template(ins.template)
+    node = ct.node(work_item.node_id)
 
-    # 2) 计算字段覆盖（隐藏/只读/必填）
-    overrides = _overrides_from_rules(node, None)
+    # 2) 字段覆盖（隐藏/只读/必填）已随编译模板预先算好
+    overrides = node.overrides
     old_form = ins.form_data.copy()
     new_data = (new_form_data or {}).copy()
 
@@ -236,16 +434,12 @@ def submit_task(work_item: WorkItem, user: U, action: str, comment: str | None,
     merged.update(new_data)
 
     # 4) 规范化与校验（表单字段本身的 required + 节点覆盖的 required）
-    merged, errs = _normalize_and_validate(fields_map, merged, required_extra=overrides["required"])
+    merged, errs = ct.form.normalize(merged, required_extra=overrides["required"])
     if errs:
         raise ValueError("表单校验失败: " + "；".join(errs))
 
     # 5) 选择下一节点（条件可使用 form[...] 与 action）
-    next_node = None
-    for t in tpl.transitions.filter(source=node).order_by('priority', 'id'):
-        if _eval_condition(t.condition, merged, action=(action or 'submit')):
-            next_node = t.target
-            break
+    next_node = ct.route(node.id, merged, action=(action or 'submit'))
     if not next_node:
         raise ValueError('没有满足条件的后续节点')
 
@@ -255,49 +449,410 @@ def submit_task(work_item: WorkItem, user: U, action: str, comment: str | None,
     work_item.comment = comment or ''
     work_item.owner = user
     work_item.save(update_fields=['status', 'action', 'comment', 'owner', 'updated_at'])
+    _sync_candidates(work_item)
+    record_completed([(work_item.node_id, work_item.created_at, work_item.updated_at)])
 
     ActionLog.objects.create(
-        instance=ins, node=node, user=user,
+        instance=ins, node_id=node.id, user=user,
         action=work_item.action, payload={'comment': work_item.comment}
     )
 
+    # 6.1 表单历史只记增量
+    rev = _form_revision(ins, old_form, merged, node.id, uid, work_item.action)
+    if rev:
+        rev.save()
+    if _index_changed(ct.form, old_form, merged):
+        sync_field_values(ct.form, [(ins.id, merged)])
+
     # 7) 结束或流转
-    if next_node.type == 'end':
+    if next_node.is_end:
         ins.status = InstanceStatus.COMPLETED
         ins.current_node = None
         ins.form_data = merged
-        ins.save(update_fields=['status', 'current_node', 'form_data', 'updated_at'])
-        ActionLog.objects.create(instance=ins, node=next_node, user=user, action='complete', payload={})
+        ins.save(update_fields=['status', 'current_node', 'form_data', 'form_rev', 'updated_at'])
+        ActionLog.objects.create(instance=ins, node_id=next_node.id, user=user, action='complete', payload={})
+        emit_events([_instance_completed(ins, uid)])
         return ins
 
     # 正常流转到下一节点：更新实例、创建新的待办
-    ins.current_node = next_node
+    ins.current_node_id = next_node.id
     ins.form_data = merged
-    ins.save(update_fields=['current_node', 'form_data', 'updated_at'])
+    ins.save(update_fields=['current_node', 'form_data', 'form_rev', 'updated_at'])
 
     assignees = _resolve_assignees(next_node, merged)
-    WorkItem.objects.create(instance=ins, node=next_node, assignees=assignees)
+    _create_work_item(ins, next_node, assignees)
 
     return ins
 
+def _bulk_create_work_items(rows) -> None:
+    """
+    rows: [(instance_id, CompiledNode, assignees)]，批量创建工作项与候选人行。
+    MySQL 的 bulk_create 不回填主键；引擎是单令牌流转，每个实例此刻只有这一条 open 工作项，按实例回查即可。
+    """
+    if not rows:
+        return
+    now = timezone.now()
+    due = {node.id: node.due_at(now) for _, node, _ in rows}
+    WorkItem.objects.bulk_create(
+        [WorkItem(instance_id=iid, node_id=node.id, assignees=assignees, due_at=due[node.id])
+         for iid, node, assignees in rows],
+        batch_size=500,
+    )
+    new_ids = dict(
+        WorkItem.objects.filter(instance_id__in=[r[0] for r in rows], status=WorkItemStatus.OPEN)
+        .values_list('instance_id', 'id')
+    )
+    WorkItemCandidate.objects.bulk_create(
+        [WorkItemCandidate(work_item_id=new_ids[iid], user_id=uid) for iid, _, assignees in rows for uid in assignees],
+        batch_size=1000,
+    )
+    _bust_inbox_counts(uid for _, _, assignees in rows for uid in assignees)
+    record_entered((node.id, now) for _, node, _ in rows)
+    emit_events([_work_item_created(new_ids[iid], iid, node, assignees, due[node.id]) for iid, node, assignees in rows])
+
+
+@transaction.atomic
+def submit_tasks_bulk(work_item_ids, user: U, action: str, comment: str | None) -> Dict[int, str | None]:
+    """
+    批量提交：对选中的工作项执行同一动作/意见（不修改表单数据）。
+    行锁锁定工作项，按模板复用编译结果，WorkItem / ActionLog / FlowInstance 统一批量写入。
+    返回 {work_item_id: None 表示成功，否则为失败原因}；单项失败不影响其它项。
+    """
+    action = action or 'submit'
+    comment = comment or ''
+    ids = [int(x) for x in work_item_ids]
+    results: Dict[int, str | None] = {i: '工作项不存在' for i in ids}
+
+    items = list(
+        WorkItem.objects.select_for_update().filter(pk__in=ids)
+        .select_related('instance', 'instance__template').order_by('id')
+    )
+    candidate_of = set(
+        WorkItemCandidate.objects.filter(work_item_id__in=ids, user_id=user.id).values_list('work_item_id', flat=True)
+    )
+    compiled: Dict[int, Any] = {}
+    now = timezone.now()
+    done_items, touched_instances, logs, new_rows, revisions = [], [], [], [], []
+    reindex: Dict[int, tuple] = {}
+    events: List[OutboxEvent] = []
+
+    for wi in items:
+        if wi.status in (WorkItemStatus.DONE, WorkItemStatus.CANCELED):
+            results[wi.id] = '工作项已完成或已取消'
+            continue
+        if wi.owner_id and wi.owner_id != user.id:
+            results[wi.id] = '非当前认领人'
+            continue
+        if not wi.owner_id and wi.id not in candidate_of:
+            results[wi.id] = '不在候选人列表'
+            continue
+
+        ins = wi.instance
+        ct = compiled.get(ins.template_id)
+        if ct is None:
+            ct = compiled[ins.template_id] = get_compiled_template(ins.template)
+        node = ct.node(wi.node_id)
+        merged, errs = ct.form.normalize(ins.form_data or {}, required_extra=node.overrides["required"])
+        if errs:
+            results[wi.id] = "表单校验失败: " + "；".join(errs)
+            continue
+        next_node = ct.route(node.id, merged, action=action)
+        if not next_node:
+            results[wi.id] = '没有满足条件的后续节点'
+            continue
+
+        wi.status, wi.action, wi.comment, wi.owner_id, wi.updated_at = WorkItemStatus.DONE, action, comment, user.id, now
+        done_items.append(wi)
+        logs.append(ActionLog(instance_id=ins.id, node_id=node.id, user_id=user.id, action=action, payload={'comment': comment}))
+        rev = _form_revision(ins, ins.form_data, merged, node.id, user.id, action)
+        if rev:
+            revisions.append(rev)
+        if _index_changed(ct.form, ins.form_data or {}, merged):
+            reindex.setdefault(ins.template_id, (ct.form, []))[1].append((ins.id, merged))
+
+        ins.form_data = merged
+        ins.updated_at = now
+        if next_node.is_end:
+            ins.status = InstanceStatus.COMPLETED
+            ins.current_node_id = None
+            logs.append(ActionLog(instance_id=ins.id, node_id=next_node.id, user_id=user.id, action='complete', payload={}))
+            events.append(_instance_completed(ins, user.id))
+        else:
+            ins.current_node_id = next_node.id
+            new_rows.append((ins.id, next_node, _resolve_assignees(next_node, merged)))
+        touched_instances.append(ins)
+        results[wi.id] = None
+
+    if done_items:
+        WorkItem.objects.bulk_update(done_items, ['status', 'action', 'comment', 'owner', 'updated_at'], batch_size=500)
+        record_completed((w.node_id, w.created_at, now) for w in done_items)
+        WorkItemCandidate.objects.filter(work_item_id__in=[w.id for w in done_items]).update(status=WorkItemStatus.DONE)
+        _bust_inbox_counts(uid for w in done_items for uid in (w.assignees or []) + [w.owner_id])
+        ActionLog.objects.bulk_create(logs, batch_size=500)
+        FormRevision.objects.bulk_create(revisions, batch_size=500)
+        for form, items in reindex.values():
+            sync_field_values(form, items)
+        emit_events(events)
+        FlowInstance.objects.bulk_update(
+            touched_instances, ['status', 'current_node', 'form_data', 'form_rev', 'updated_at'], batch_size=500,
+        )
+        _bulk_create_work_items(new_rows)
+    return results
+
+def start_instances_bulk(template: FlowTemplate, starter: U, rows, chunk_size: int = 500,
+                         batch: str | None = None,
+                         lines: list[int] | None = None) -> tuple[int, list[tuple[int, str]]]:
+    """
+    批量发起：rows 为 [{"title": 可选, 其余为表单字段}, ...]，lines 为各行在源文件中的行号（read_numbered_rows）；
+    未给出 lines 时按 rows 中的位置从 1 编号。
+    全部行共用一份编译模板做校验与路由；合法行按 chunk 分块 bulk_create（每块一个事务），
+    非法行记录 (行号, 原因) 后跳过，不影响其它行。返回 (创建数量, 错误列表)。
+    """
+    ct = get_compiled_template(template)
+    start_node = ct.start
+    if not start_node:
+        raise ValueError('模板缺少开始节点')
+    batch = batch or timezone.now().strftime('%Y%m%d%H%M%S%f')
+    default_title = f"{template.name}-{starter}"
+
+    created = 0
+    errors: list[tuple[int, str]] = []
+    pending: list[tuple[int, str, dict, Any]] = []
+
+    def flush():
+        nonlocal created
+        if pending:
+            created += _launch_chunk(template, starter, start_node, batch, pending, ct.form)
+            pending.clear()
+
+    for i, row in enumerate(rows):
+        no = lines[i] if lines else i + 1
+        if not isinstance(row, dict):
+            errors.append((no, '行数据不是对象'))
+            continue
+        data = dict(row)
+        title = str(data.pop('title', '') or '') or default_title
+        form_data, errs = ct.form.normalize(data)
+        if errs:
+            errors.append((no, "；".join(errs)))
+            continue
+        next_node = ct.route(start_node.id, form_data, action="start")
+        if not next_node:
+            errors.append((no, '开始节点没有可达的后续节点'))
+            continue
+        pending.append((no, title, form_data, next_node))
+        if len(pending) >= chunk_size:
+            flush()
+    flush()
+    return created, errors
+
+
+@transaction.atomic
+def _launch_chunk(template, starter, start_node, batch, pending, form) -> int:
+    instances = FlowInstance.objects.bulk_create([
+        FlowInstance(
+            template=template, status=InstanceStatus.RUNNING, starter=starter,
+            current_node_id=node.id, form_data=form_data, title=title[:255], batch_key=f"{batch}:{no}", form_rev=1,
+        )
+        for no, title, form_data, node in pending
+    ])
+    if instances and instances[0].pk is None:
+        ids = dict(FlowInstance.objects.filter(batch_key__in=[i.batch_key for i in instances]).values_list('batch_key', 'id'))
+        for ins in instances:
+            ins.pk = ids[ins.batch_key]
+
+    work_rows, logs, revisions = [], [], []
+    for ins, (no, title, form_data, node) in zip(instances, pending):
+        work_rows.append((ins.pk, node, _resolve_assignees(node, form_data)))
+        logs.append(ActionLog(instance_id=ins.pk, node_id=start_node.id, user=starter, action='start', payload={'form_rev': 0}))
+        revisions.append(FormRevision(instance_id=ins.pk, seq=0, node_id=start_node.id, user=starter,
+                                      action='start', snapshot=form_data))
+    _bulk_create_work_items(work_rows)
+    ActionLog.objects.bulk_create(logs)
+    FormRevision.objects.bulk_create(revisions)
+    if form.indexed:
+        sync_field_values(form, [(ins.pk, p[2]) for ins, p in zip(instances, pending)])
+    return len(instances)
+
+
 @transaction.atomic
 def claim_work_item(work_item: WorkItem, user: U) -> WorkItem:
+    """
+    认领：单条条件 UPDATE（WHERE status='open'），受影响行数即胜负，
+    并发点击“认领”时只有一人成功，失败方不会覆盖胜者。
+    """
     if work_item.status != WorkItemStatus.OPEN:
         raise ValueError('工作项非可认领状态')
-    if user.id not in (work_item.assignees or []):
+    if not _is_candidate(work_item, user):
         raise PermissionError('不在候选人列表')
+    now = timezone.now()
+    won = WorkItem.objects.filter(pk=work_item.pk, status=WorkItemStatus.OPEN).update(
+        owner=user, status=WorkItemStatus.CLAIMED, updated_at=now,
+    )
+    if not won:
+        raise ValueError('工作项已被他人认领或已处理')
     work_item.owner = user
     work_item.status = WorkItemStatus.CLAIMED
-    work_item.save(update_fields=['owner','status','updated_at'])
+    work_item.updated_at = now
+    _sync_candidates(work_item)
+    emit('work_item.claimed', f'{work_item.pk}:{now.timestamp()}', {
+        'work_item_id': work_item.pk, 'instance_id': work_item.instance_id,
+        'owner_id': user.id, 'owner_name': str(user), 'assignees': list(work_item.assignees or []),
+    })
     return work_item
 
 @transaction.atomic
 def release_work_item(work_item: WorkItem, user: U) -> WorkItem:
+    """释放：同样以 WHERE owner=当前用户 的条件 UPDATE 完成，避免覆盖并发的提交/改派"""
     if work_item.owner_id != user.id:
         raise PermissionError('只有当前认领人可以释放')
     if work_item.status not in (WorkItemStatus.CLAIMED, WorkItemStatus.OPEN):
         raise ValueError('当前状态不可释放')
+    now = timezone.now()
+    done = WorkItem.objects.filter(
+        pk=work_item.pk, owner_id=user.id, status__in=(WorkItemStatus.CLAIMED, WorkItemStatus.OPEN),
+    ).update(owner=None, status=WorkItemStatus.OPEN, updated_at=now)
+    if not done:
+        raise ValueError('工作项状态已变化，请刷新后重试')
     work_item.owner = None
     work_item.status = WorkItemStatus.OPEN
-    work_item.save(update_fields=['owner','status','updated_at'])
-    return work_item
\ No newline at end of file
+    work_item.updated_at = now
+    _sync_candidates(work_item)
+    return work_item
+
+
+def _affected_users(work_item_ids) -> List[int]:
+    """这些工作项的候选人与处理人（用于让角标计数失效）"""
+    ids = set(WorkItemCandidate.objects.filter(work_item_id__in=work_item_ids).values_list('user_id', flat=True))
+    ids |= set(WorkItem.objects.filter(pk__in=work_item_ids, owner__isnull=False).values_list('owner_id', flat=True))
+    return list(ids)
+
+
+@transaction.atomic
+def terminate_instances(instance_ids, user: U) -> int:
+    """
+    批量终止运行中的实例（后台动作）：实例、工作项、候选人各一条 UPDATE，日志一次批量插入；
+    随同一事务为每个实例写 instance.terminated、每个被取消的工作项写 work_item.canceled 事件。
+    返回实际终止的实例数。
+    """
+    instances = list(FlowInstance.objects.select_for_update()
+                     .filter(pk__in=list(instance_ids), status=InstanceStatus.RUNNING)
+                     .values_list('id', 'template_id', 'title', 'starter_id'))
+    if not instances:
+        return 0
+    ids = [r[0] for r in instances]
+    now = timezone.now()
+    FlowInstance.objects.filter(pk__in=ids).update(status=InstanceStatus.TERMINATED, updated_at=now)
+    items = list(WorkItem.objects.filter(instance_id__in=ids, status__in=INBOX_ACTIVE)
+                 .values_list('id', 'instance_id', 'node_id', 'assignees', 'owner_id'))
+    wi_ids = [r[0] for r in items]
+    if wi_ids:
+        _bust_inbox_counts(_affected_users(wi_ids))
+        WorkItem.objects.filter(pk__in=wi_ids).update(status=WorkItemStatus.CANCELED, updated_at=now)
+        WorkItemCandidate.objects.filter(work_item_id__in=wi_ids).update(status=WorkItemStatus.CANCELED)
+    ActionLog.objects.bulk_create(
+        [ActionLog(instance_id=iid, user=user, action='terminate', payload={}) for iid in ids], batch_size=1000,
+    )
+    emit_events([
+        _event('work_item.canceled', wid, {
+            'work_item_id': wid, 'instance_id': iid, 'node_id': nid,
+            'assignees': list(assignees or []), 'owner_id': owner_id,
+        })
+        for wid, iid, nid, assignees, owner_id in items
+    ] + [
+        _event('instance.terminated', iid, {
+            'instance_id': iid, 'template_id': tid, 'title': title,
+            'starter_id': starter_id, 'terminated_by': user.id,
+        })
+        for iid, tid, title, starter_id in instances
+    ])
+    return len(ids)
+
+
+@transaction.atomic
+def reassign_work_items(work_item_ids, target: U, user: U) -> int:
+    """
+    批量改派未完成的工作项给 target（后台动作）：清空处理人、回到待处理，候选人仅保留 target。
+    与新建工作项一致：按节点时限从改派时刻重新计算 due_at（并清空 SLA 状态），为每项写 work_item.created 事件。
+    工作项按节点分组 UPDATE，候选人先删后批量插入；返回改派的工作项数。
+    """
+    rows = list(WorkItem.objects.select_for_update()
+                .filter(pk__in=list(work_item_ids), status__in=INBOX_ACTIVE)
+                .values_list('id', 'instance_id', 'node_id', 'instance__template_id'))
+    if not rows:
+        return 0
+    ids = [r[0] for r in rows]
+    _bust_inbox_counts(_affected_users(ids) + [target.id])
+
+    now = timezone.now()
+    templates = FlowTemplate.objects.in_bulk({r[3] for r in rows})
+    nodes = {nid: get_compiled_template(templates[tid]).node(nid) for _, _, nid, tid in rows}
+    by_node: Dict[int, List[int]] = defaultdict(list)
+    for wid, _, nid, _ in rows:
+        by_node[nid].append(wid)
+    for nid, wids in by_node.items():
+        WorkItem.objects.filter(pk__in=wids).update(
+            assignees=[target.id], owner=None, status=WorkItemStatus.OPEN, updated_at=now,
+            due_at=nodes[nid].due_at(now), sla_state='',
+        )
+    WorkItemCandidate.objects.filter(work_item_id__in=ids).delete()
+    WorkItemCandidate.objects.bulk_create(
+        [WorkItemCandidate(work_item_id=wid, user_id=target.id, status=WorkItemStatus.OPEN) for wid in ids],
+        batch_size=1000,
+    )
+    ActionLog.objects.bulk_create([
+        ActionLog(instance_id=iid, node_id=nid, user=user, action='reassign',
+                  payload={'work_item': wid, 'target': target.id})
+        for wid, iid, nid, _ in rows
+    ], batch_size=1000)
+    emit_events([
+        _work_item_created(wid, iid, nodes[nid], [target.id], nodes[nid].due_at(now),
+                           key=f'{wid}:reassign:{now.timestamp()}')
+        for wid, iid, nid, _ in rows
+    ])
+    return len(ids)
+
+
+@transaction.atomic
+def handle_overdue_work_item(work_item_id, now=None) -> str | None:
+    """
+    处理一个到期工作项（由 SLA 调度器调用）：按节点配置提醒 / 升级（追加处理人）/ 改派。
+    行锁 + sla_state 保证同一工作项只处理一次；返回执行的动作，未处理返回 None。
+    """
+    now = now or timezone.now()
+    wi = (WorkItem.objects.select_for_update().select_related('node')
+          .filter(pk=work_item_id, status__in=INBOX_ACTIVE, sla_state='', due_at__lte=now).first())
+    if wi is None:
+        return None
+    node = wi.node
+    action = node.overdue_action
+    target = node.escalate_to_id
+    if action in (OverdueAction.ESCALATE, OverdueAction.REASSIGN) and not target:
+        action = OverdueAction.REMIND
+
+    before = list(wi.assignees or []) + [wi.owner_id]
+    if action == OverdueAction.ESCALATE:
+        if target not in (wi.assignees or []):
+            wi.assignees = list(wi.assignees or []) + [target]
+            WorkItemCandidate.objects.get_or_create(work_item=wi, user_id=target, defaults={'status': wi.status})
+    elif action == OverdueAction.REASSIGN:
+        wi.assignees = [target]
+        wi.owner_id = None
+        wi.status = WorkItemStatus.OPEN
+        WorkItemCandidate.objects.filter(work_item=wi).delete()
+        WorkItemCandidate.objects.create(work_item=wi, user_id=target, status=wi.status)
+
+    wi.sla_state = {
+        OverdueAction.REMIND: 'reminded', OverdueAction.ESCALATE: 'escalated', OverdueAction.REASSIGN: 'reassigned',
+    }[action]
+    wi.save(update_fields=['assignees', 'owner', 'status', 'sla_state', 'updated_at'])
+    ActionLog.objects.create(
+        instance_id=wi.instance_id, node_id=wi.node_id, user=None, action=f'sla_{action}',
+        payload={'work_item': wi.id, 'due_at': wi.due_at.isoformat(), 'target': target},
+    )
+    _bust_inbox_counts(before + list(wi.assignees))
+    emit_events([_event('work_item.overdue', f'{wi.id}:{wi.due_at.isoformat()}', {
+        'work_item_id': wi.id, 'instance_id': wi.instance_id, 'node_id': wi.node_id, 'action': action,
+        'assignees': list(wi.assignees), 'target': target, 'due_at': wi.due_at.isoformat(),
+    })])
+    return action
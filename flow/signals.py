@@ -0,0 +1,93 @@
+# flow/signals.py
+from __future__ import annotations
+
+from django.contrib.auth import get_user_model
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from .compiled import invalidate_form, invalidate_template
+from .models import FlowNode, Transition, NodeFieldRule, FormField, FormFieldValue, FlowTemplate
+from .services import refresh_node_assignees
+
+U = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=FlowNode)
+@receiver([post_save, post_delete], sender=Transition)
+def _template_part_changed(sender, instance, **kwargs):
+    invalidate_template(instance.template_id)
+
+
+@receiver([post_save, post_delete], sender=NodeFieldRule)
+def _field_rule_changed(sender, instance, **kwargs):
+    template_id = FlowNode.objects.filter(pk=instance.node_id).values_list('template_id', flat=True).first()
+    if template_id:
+        invalidate_template(template_id)
+
+
+@receiver([post_save, post_delete], sender=FormField)
+def _form_field_changed(sender, instance, signal, **kwargs):
+    invalidate_form(instance.form_id)
+    if signal is post_save and not instance.indexed:
+        # 取消索引：清掉投影值；新标记为索引的字段需运行 flow_index_fields 回填历史实例
+        FormFieldValue.objects.filter(field=instance).delete()
+    for template_id in FlowTemplate.objects.filter(form_def_id=instance.form_id).values_list('id', flat=True):
+        invalidate_template(template_id)
+
+
+@receiver(m2m_changed, sender=FlowNode.assigned_users.through)
+@receiver(m2m_changed, sender=FlowNode.assigned_departments.through)
+def _node_assignment_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # post_clear 拿不到节点 id：清空前先记下该用户/科室关联的节点
+        fk = next(f.attname for f in sender._meta.fields if f.related_model is type(instance))
+        instance._flow_cleared_nodes = list(sender.objects.filter(**{fk: instance.pk}).values_list('flownode_id', flat=True))
+        return
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        refresh_node_assignees([instance.pk])
+        return
+    # 从用户/科室一侧修改关系：instance 是 User/Department，pk_set 是节点 id
+    if pk_set is None:
+        pk_set = getattr(instance, '_flow_cleared_nodes', [])
+    if pk_set:
+        refresh_node_assignees(list(pk_set))
+
+
+# ----- 用户调岗：刷新涉及新旧科室的节点 -----
+@receiver(pre_save, sender=U)
+def _remember_department(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and 'department' not in update_fields and 'department_id' not in update_fields:
+        # 例如登录时只更新 last_login，不必查旧科室
+        instance._flow_old_department_id = instance.department_id
+        return
+    old = None
+    if instance.pk:
+        old = U.objects.filter(pk=instance.pk).values_list('department_id', flat=True).first()
+    instance._flow_old_department_id = old
+
+
+@receiver(post_save, sender=U)
+def _department_changed(sender, instance, created, **kwargs):
+    old = getattr(instance, '_flow_old_department_id', None)
+    new = instance.department_id
+    if not created and old == new:
+        return
+    _refresh_nodes_for_departments({old, new} - {None})
+
+
+@receiver(post_delete, sender=U)
+def _user_deleted(sender, instance, **kwargs):
+    if instance.department_id:
+        _refresh_nodes_for_departments({instance.department_id})
+
+
+def _refresh_nodes_for_departments(dept_ids) -> None:
+    if not dept_ids:
+        return
+    node_ids = list(
+        FlowNode.objects.filter(assigned_departments__in=dept_ids).values_list('id', flat=True).distinct()
+    )
+    if node_ids:
+        refresh_node_assignees(node_ids)
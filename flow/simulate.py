@@ -0,0 +1,165 @@
+# flow/simulate.py
+"""
+模板试运行：把一批样例表单（文件或历史实例的 form_data）按编译后的连线图逐条走一遍，不写数据库。
+统计路径分布、卡死节点（没有满足条件的出边）、循环、不可达节点以及各节点预计产生的工作项数。
+
+同一份“路由相关字段”的取值只会真正求值一次：先从所有条件里找出被引用的 form 字段，
+按这些字段的取值组合缓存整条路径，几十万条样例通常只有几百种组合。
+"""
+from __future__ import annotations
+import time
+from collections import Counter, deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .compiled import CompiledTemplate
+from .utils import condition_form_keys, eval_compiled, transition_code
+
+COMPLETED, DEAD_END, LOOP = 'completed', 'dead_end', 'loop'
+_MISSING = object()  # 区分“缺字段”和“值为 None”：form['x'] 对两者的求值结果不同
+
+
+def _route_keys(ct: CompiledTemplate) -> Optional[Tuple[str, ...]]:
+    keys = set()
+    for node in ct.nodes.values():
+        for t, _ in node.edges:
+            used = condition_form_keys(t.condition)
+            if used is None:
+                return None
+            keys |= used
+    return tuple(sorted(keys))
+
+
+def _reachable(ct: CompiledTemplate) -> set:
+    seen = set()
+    todo = deque([ct.start.id] if ct.start else [])
+    while todo:
+        nid = todo.popleft()
+        if nid in seen:
+            continue
+        seen.add(nid)
+        todo.extend(dst.id for _, dst in ct.nodes[nid].edges)
+    return seen
+
+
+class Simulator:
+    def __init__(self, ct: CompiledTemplate, action: str = 'approve',
+                 node_actions: Dict[str, str] | None = None, max_steps: int = 100):
+        if ct.start is None:
+            raise ValueError('模板缺少开始节点')
+        self.ct = ct
+        self.action = action
+        self.node_actions = node_actions or {}
+        self.max_steps = max_steps
+        self.keys = _route_keys(ct)
+        self.condition_errors: Counter = Counter()
+        self._paths: Dict[Any, Tuple[Tuple[int, ...], str]] = {}
+
+    def _next(self, node, form, action):
+        ctx = {"form": form, "action": action}
+        for t, target in node.edges:
+            try:
+                if eval_compiled(transition_code(t), ctx):
+                    return target
+            except Exception:
+                self.condition_errors[t.id] += 1
+        return None
+
+    def _walk(self, form) -> Tuple[Tuple[int, ...], str]:
+        node = self.ct.start
+        path = [node.id]
+        action = 'start'
+        for _ in range(self.max_steps):
+            nxt = self._next(node, form, action)
+            if nxt is None:
+                return tuple(path), DEAD_END
+            path.append(nxt.id)
+            if nxt.is_end:
+                return tuple(path), COMPLETED
+            node = nxt
+            action = self.node_actions.get(node.code, self.action)
+        return tuple(path), LOOP
+
+    def route(self, form) -> Tuple[Tuple[int, ...], str]:
+        if self.keys is None:
+            return self._walk(form)
+        key = tuple(form.get(k, _MISSING) for k in self.keys)
+        try:
+            hit = self._paths.get(key)
+        except TypeError:  # 取值不可哈希（如 list），不走缓存
+            return self._walk(form)
+        if hit is None:
+            hit = self._paths[key] = self._walk(form)
+        return hit
+
+    def run(self, payloads: Iterable[Dict[str, Any]], top: int = 20) -> Dict[str, Any]:
+        t0 = time.perf_counter()
+        normalize = self.ct.form.normalize
+        outcomes: Counter = Counter()
+        invalid: Counter = Counter()
+        total = 0
+        for data in payloads:
+            total += 1
+            form, errs = normalize(data or {})
+            if errs:
+                invalid[errs[0]] += 1
+                continue
+            outcomes[self.route(form)] += 1
+        return self._report(total, outcomes, invalid, top, time.perf_counter() - t0)
+
+    def _report(self, total, outcomes: Counter, invalid: Counter, top: int, seconds: float) -> Dict[str, Any]:
+        nodes = self.ct.nodes
+        valid = sum(outcomes.values())
+        visits: Counter = Counter()
+        ends: Counter = Counter()
+        dead_ends: Counter = Counter()
+        paths: Counter = Counter()
+        for (path, state), n in outcomes.items():
+            ends[state] += n
+            paths[(path, state)] += n
+            for nid in path[1:]:
+                if not nodes[nid].is_end:
+                    visits[nid] += n
+            if state == DEAD_END:
+                dead_ends[nodes[path[-1]].code] += n
+
+        reachable = _reachable(self.ct)
+        visited = {nid for path, _ in outcomes for nid in path}
+        return {
+            'template': self.ct.template_id,
+            'payloads': total,
+            'invalid': total - valid,
+            'invalid_reasons': invalid.most_common(top),
+            'completed': ends[COMPLETED],
+            'dead_end': ends[DEAD_END],
+            'loop': ends[LOOP],
+            'dead_end_nodes': dead_ends.most_common(),
+            'paths': [
+                {
+                    'path': ' → '.join(nodes[nid].name for nid in path),
+                    'state': state,
+                    'count': n,
+                    'ratio': n / valid if valid else 0.0,
+                }
+                for (path, state), n in paths.most_common(top)
+            ],
+            'node_load': [
+                {
+                    'code': n.code, 'name': n.name, 'work_items': visits[n.id],
+                    'per_instance': visits[n.id] / valid if valid else 0.0,
+                }
+                for n in sorted(nodes.values(), key=lambda n: -visits[n.id])
+                if n.type not in ('start', 'end')
+            ],
+            'unreachable': [n.code for n in nodes.values() if n.id not in reachable],
+            'never_visited': [n.code for n in nodes.values() if n.id in reachable and n.id not in visited],
+            'no_outgoing': [n.code for n in nodes.values() if not n.is_end and not n.edges],
+            'condition_errors': dict(self.condition_errors),  # 按不同取值组合计数
+            'distinct_routes': len(self._paths) if self.keys is not None else None,
+            'route_keys': list(self.keys) if self.keys is not None else None,
+            'seconds': seconds,
+        }
+
+
+def simulate(ct: CompiledTemplate, payloads: Iterable[Dict[str, Any]], action: str = 'approve',
+             node_actions: Dict[str, str] | None = None, top: int = 20) -> Dict[str, Any]:
+    return Simulator(ct, action=action, node_actions=node_actions).run(payloads, top=top)
@@ -0,0 +1,91 @@
+# flow/sla.py
+"""
+SLA 调度器：把即将到期的工作项按 due_at 放进内存小顶堆，睡到最近的到期时间再处理，
+不做周期性全表扫描。
+
+- 窗口补充：每次只用 (status, due_at) 索引取 [已装载上界, now + horizon] 区间内的工作项；
+- 新建/改动的工作项：用 (status, updated_at) 索引取上次补充之后更新过、且落在已装载窗口内的；
+  堆按 (due_at, pk) 去重，时限被改动的工作项会以新时限重新入堆；
+- 时钟与睡眠函数可注入，测试时用假时钟推进。
+"""
+from __future__ import annotations
+import heapq
+import logging
+import time
+from datetime import timedelta
+from typing import Callable, List, Optional, Set, Tuple
+
+from django.utils import timezone
+
+from .models import WorkItem
+from .services import INBOX_ACTIVE, handle_overdue_work_item
+
+logger = logging.getLogger(__name__)
+
+
+class SlaScheduler:
+    def __init__(self, clock: Callable = timezone.now, sleep: Callable[[float], None] = time.sleep,
+                 horizon: timedelta = timedelta(minutes=10), poll: float = 30.0):
+        self.clock = clock
+        self.sleep = sleep
+        self.horizon = horizon
+        self.poll = poll  # 最长睡眠秒数，兼作发现新工作项的间隔
+        self._heap: List[Tuple] = []
+        # 按 (due_at, pk) 去重：时限改动（如改派重算 due_at）后新时限照常入堆；
+        # 旧条目留在堆里，出堆时 handle_overdue_work_item 发现未到期或已处理会直接忽略
+        self._queued: Set[Tuple] = set()
+        self._loaded_until = None
+        self._last_refill = None
+
+    def _push(self, rows) -> None:
+        for pk, due_at in rows:
+            entry = (due_at, pk)
+            if entry not in self._queued:
+                self._queued.add(entry)
+                heapq.heappush(self._heap, entry)
+
+    def refill(self) -> None:
+        now = self.clock()
+        until = now + self.horizon
+        pending = WorkItem.objects.filter(status__in=INBOX_ACTIVE, sla_state='', due_at__isnull=False)
+        if self._loaded_until is None:
+            # 首次装载：包含所有已超时的
+            self._push(pending.filter(due_at__lte=until).values_list('id', 'due_at'))
+        else:
+            self._push(pending.filter(due_at__gt=self._loaded_until, due_at__lte=until).values_list('id', 'due_at'))
+            # 上次补充之后新建的工作项，时限可能短于窗口
+            self._push(pending.filter(updated_at__gte=self._last_refill, due_at__lte=self._loaded_until)
+                       .values_list('id', 'due_at'))
+        self._loaded_until = until
+        self._last_refill = now
+
+    def run_due(self) -> int:
+        """处理所有已到期的工作项，返回实际执行的数量"""
+        now = self.clock()
+        handled = 0
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            self._queued.discard(entry)
+            pk = entry[1]
+            try:
+                if handle_overdue_work_item(pk, now=now):
+                    handled += 1
+            except Exception:
+                logger.exception('SLA 处理失败: work_item=%s', pk)
+        return handled
+
+    def tick(self) -> float:
+        """补充窗口并处理到期项；返回距下一次需要醒来的秒数"""
+        self.refill()
+        self.run_due()
+        now = self.clock()
+        wait = self.poll
+        if self._heap:
+            wait = min(wait, max((self._heap[0][0] - now).total_seconds(), 0.0))
+        return wait
+
+    def run_forever(self, max_ticks: Optional[int] = None) -> None:
+        ticks = 0
+        while max_ticks is None or ticks < max_ticks:
+            self.sleep(self.tick())
+            ticks += 1
@@ -1,3 +1,959 @@
-from django.test import TestCase
+import io
+import json
+import math
+import threading
+from collections import Counter
+from importlib import import_module
+from unittest import mock
+from datetime import date, timedelta
 
-# Create your tests here.
+from django.apps import apps as django_apps
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from users.models import User, Department
+from .models import (
+    FormDef, FlowTemplate, FlowNode, Transition, WorkItem, WorkItemStatus, WorkItemCandidate, OverdueAction,
+    FieldType, OutboxEvent, OutboxStatus, ActionLog, FormField, FlowInstance, InstanceStatus, FormRevision,
+    ArchivedInstance, FormFieldValue, NodeDailyStat,
+)
+from .services import start_instance, submit_task, claim_work_item, release_work_item, emit
+from .services import terminate_instances, reassign_work_items, inbox_count
+from .services import start_instances_bulk, submit_tasks_bulk, form_at_revision, FORM_SNAPSHOT_EVERY
+from .services import search_instances
+from . import archive, outbox, live, stats
+from .compiled import get_compiled_form, get_compiled_template
+from .simulate import simulate
+from .utils import read_numbered_rows
+from .version_migration import InstanceMigrator
+from .sla import SlaScheduler
+
+
+class LiveHubTests(TestCase):
+    def setUp(self):
+        self.a = User.objects.create(username='live-a', emp_id='L1', full_name='甲')
+        self.b = User.objects.create(username='live-b', emp_id='L2', full_name='乙')
+        self.tpl = _make_template([self.a, self.b])
+
+    def test_events_fan_out_by_channel_and_recipient(self):
+        hub = live.LiveHub()
+        subs = {
+            'a': live.Subscriber(self.a.id, ('inbox',)),
+            'b': live.Subscriber(self.b.id, ('inbox', 'outbound')),
+        }
+        hub.subscribers.update(subs.values())
+        self.assertEqual(hub.fetch(), [])  # 首次只定位，不推历史
+
+        ins = start_instance(self.tpl, self.a, {})
+        claim_work_item(ins.work_items.get(), self.a)
+        emit('outbound.created', 1, {'id': 1})
+        hub.dispatch(hub.fetch())
+        hub.dispatch(hub.fetch())  # 回看窗口内的重复行按 id 去重
+
+        def topics(sub):
+            out = []
+            while not sub.queue.empty():
+                out.append(sub.queue.get_nowait().split('\n')[1])
+            return out
+        self.assertEqual(topics(subs['a']), ['event: work_item.created'])
+        self.assertEqual(topics(subs['b']), ['event: work_item.created', 'event: work_item.claimed',
+                                             'event: outbound.created'])
+
+    def test_wsgi_request_gets_no_stream(self):
+        self.client.force_login(self.a)
+        self.assertEqual(self.client.get('/flow/live/').status_code, 204)
+
+
+class BulkAdminActionTests(TestCase):
+    def setUp(self):
+        self.a = User.objects.create(username='bulk-a', emp_id='B1', full_name='甲')
+        self.b = User.objects.create(username='bulk-b', emp_id='B2', full_name='乙')
+        self.tpl = _make_template([self.a])
+
+    def test_reassign_then_terminate(self):
+        ins = [start_instance(self.tpl, self.a, {}) for _ in range(3)]
+        claim_work_item(ins[0].work_items.get(), self.a)
+        wi_ids = [i.work_items.get().id for i in ins]
+        self.assertEqual(inbox_count(self.a.id), 3)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reassign_work_items(wi_ids[:2], self.b, self.a), 2)
+            self.assertEqual(inbox_count(self.a.id), 3)  # 提交前仍是旧缓存，提交后才失效
+        self.assertEqual((inbox_count(self.a.id), inbox_count(self.b.id)), (1, 2))
+        moved = WorkItem.objects.get(pk=wi_ids[0])
+        self.assertEqual((moved.owner_id, moved.status, moved.assignees), (None, WorkItemStatus.OPEN, [self.b.id]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(terminate_instances([i.id for i in ins], self.a), 3)
+        self.assertEqual(terminate_instances([i.id for i in ins], self.a), 0)
+        terminated = OutboxEvent.objects.filter(topic='instance.terminated')
+        self.assertEqual(sorted(e.payload['instance_id'] for e in terminated), sorted(i.id for i in ins))
+        canceled = {e.payload['work_item_id']: e.payload
+                    for e in OutboxEvent.objects.filter(topic='work_item.canceled')}
+        self.assertEqual(sorted(canceled), sorted(wi_ids))
+        self.assertEqual(canceled[wi_ids[0]]['assignees'], [self.b.id])
+        self.assertEqual(canceled[wi_ids[2]]['owner_id'], None)
+        self.assertEqual((inbox_count(self.a.id), inbox_count(self.b.id)), (0, 0))
+        self.assertFalse(WorkItem.objects.filter(pk__in=wi_ids).exclude(status=WorkItemStatus.CANCELED).exists())
+
+    def test_reassign_restarts_sla_and_announces_the_item(self):
+        node = self.tpl.nodes.get(code='approve')
+        node.sla_minutes = 30
+        node.save()
+        self.tpl.refresh_from_db()
+        wi = start_instance(self.tpl, self.a, {}).work_items.get()
+        WorkItem.objects.filter(pk=wi.pk).update(due_at=timezone.now() - timedelta(hours=1), sla_state='reminded')
+
+        before = timezone.now()
+        reassign_work_items([wi.pk], self.b, self.a)
+        wi.refresh_from_db()
+        self.assertEqual(wi.sla_state, '')
+        self.assertTrue(before + timedelta(minutes=30) <= wi.due_at <= timezone.now() + timedelta(minutes=30))
+        events = OutboxEvent.objects.filter(topic='work_item.created', payload__work_item_id=wi.pk).order_by('id')
+        self.assertEqual([e.payload['assignees'] for e in events], [[self.a.id], [self.b.id]])
+        self.assertEqual(events.last().payload['due_at'], wi.due_at.isoformat())
+
+
+class AssignmentRetargetTests(TestCase):
+    def setUp(self):
+        self.dept = Department.objects.create(name='数字化室')
+        self.a = User.objects.create(username='as-a', emp_id='AS1', full_name='甲', department=self.dept)
+        self.b = User.objects.create(username='as-b', emp_id='AS2', full_name='乙')
+        self.legacy = User.objects.create(username='as-l', emp_id='AS3', full_name='旧规则')
+        self.tpl = _make_template([])
+        self.node = self.tpl.nodes.get(code='approve')
+        self.node.assignees = [{'type': 'user_ids', 'value': [self.legacy.id]}]
+        self.node.save()
+        self.node.assigned_departments.add(self.dept)
+        self.item = start_instance(self.tpl, self.a, {}).work_items.get()
+
+    def _candidates(self):
+        return sorted(WorkItemCandidate.objects.filter(work_item=self.item).values_list('user_id', flat=True))
+
+    def test_department_and_user_changes_retarget_open_items(self):
+        self.assertEqual(self._candidates(), [self.a.id])
+        self.b.department = self.dept
+        self.b.save()
+        self.assertEqual(self._candidates(), [self.a.id, self.b.id])
+
+        self.node.assigned_departments.remove(self.dept)
+        self.node.assigned_users.add(self.b)
+        self.assertEqual(self._candidates(), [self.b.id])
+        self.assertEqual(WorkItem.objects.get(pk=self.item.pk).assignees, [self.b.id])
+
+    def test_emptied_assignment_falls_back_like_new_items(self):
+        self.node.assigned_departments.clear()
+        self.assertEqual(self._candidates(), [self.legacy.id])
+        fresh = start_instance(self.tpl, self.a, {}).work_items.get()
+        self.assertEqual(fresh.assignees, [self.legacy.id])
+
+    def test_reverse_clear_refreshes_only_linked_nodes(self):
+        other = FlowNode.objects.create(template=self.tpl, code='other', name='其它', type='approval')
+        other.assigned_users.add(self.b)  # 与该科室无关的节点不应被重算
+        with mock.patch('flow.signals.refresh_node_assignees') as refresh:
+            self.dept.flow_assigned_nodes.clear()
+        refresh.assert_called_once_with([self.node.pk])
+
+
+def _make_template(approvers):
+    form = FormDef.objects.create(name='并发测试表单')
+    tpl = FlowTemplate.objects.create(code='claim-race', name='认领竞争', status='active', form_def=form)
+    start = FlowNode.objects.create(template=tpl, code='start', name='开始', type='start')
+    approve = FlowNode.objects.create(template=tpl, code='approve', name='审批', type='approval', allow_claim=True)
+    end = FlowNode.objects.create(template=tpl, code='end', name='结束', type='end')
+    approve.assigned_users.add(*approvers)
+    Transition.objects.create(template=tpl, source=start, target=approve)
+    Transition.objects.create(template=tpl, source=approve, target=end)
+    tpl.refresh_from_db()
+    return tpl
+
+
+class SubmitTaskTests(TestCase):
+    def setUp(self):
+        self.a = User.objects.create(username='a', emp_id='A1', full_name='甲')
+        self.b = User.objects.create(username='b', emp_id='B1', full_name='乙')
+        self.ins = start_instance(_make_template([self.a, self.b]), self.a, {})
+
+    def test_stale_work_item_cannot_advance_twice(self):
+        wi = self.ins.work_items.get()
+        stale = WorkItem.objects.get(pk=wi.pk)
+        submit_task(wi, self.a, 'approve', '')
+        with self.assertRaises(ValueError):
+            submit_task(stale, self.b, 'approve', '')
+        self.assertEqual(ActionLog.objects.filter(instance=self.ins, action='approve').count(), 1)
+        self.assertEqual(WorkItem.objects.get(pk=wi.pk).owner_id, self.a.id)
+
+    def test_stale_owner_is_rechecked(self):
+        wi = self.ins.work_items.get()
+        stale = WorkItem.objects.get(pk=wi.pk)
+        claim_work_item(wi, self.a)
+        with self.assertRaises(PermissionError):
+            submit_task(stale, self.b, 'approve', '')
+
+
+class BulkServiceTests(TestCase):
+    def setUp(self):
+        self.a = User.objects.create(username='a', emp_id='A1', full_name='甲')
+        self.b = User.objects.create(username='b', emp_id='B1', full_name='乙')
+        self.tpl = _make_template([self.a, self.b])
+        FormField.objects.create(form=self.tpl.form_def, name='pages', title='页数', type='integer', required=True)
+
+    def test_start_bulk_skips_bad_rows_across_chunks(self):
+        # 空行不算数据行但占行号，错误按源文件行号报告
+        text = '{"pages": 1}\n\n["not", "a", "dict"]\n{"pages": 3, "title": "三"}\n{"pages": "x"}\n{"pages": 5}\n'
+        numbered = read_numbered_rows(io.StringIO(text), 'jsonl')
+        created, errors = start_instances_bulk(self.tpl, self.a, [r for _, r in numbered], chunk_size=2,
+                                               lines=[no for no, _ in numbered])
+        self.assertEqual(created, 3)
+        self.assertEqual([no for no, _ in errors], [3, 5])
+
+        instances = FlowInstance.objects.filter(template=self.tpl).order_by('id')
+        self.assertEqual([i.form_data['pages'] for i in instances], [1, 3, 5])
+        self.assertEqual(instances[1].title, '三')
+        for ins in instances:
+            wi = ins.work_items.get()
+            self.assertEqual(sorted(wi.candidates.values_list('user_id', flat=True)), [self.a.id, self.b.id])
+            self.assertEqual(ActionLog.objects.filter(instance=ins, action='start').count(), 1)
+            self.assertTrue(FormRevision.objects.filter(instance=ins, seq=0, snapshot__isnull=False).exists())
+
+    def test_bulk_start_view_reports_file_line_numbers(self):
+        self.a.is_staff = True
+        self.a.save(update_fields=['is_staff'])
+        self.client.force_login(self.a)
+        upload = SimpleUploadedFile('rows.csv', '\ufeffpages,title\n1,一\n"x",二\n3,"多行\n标题"\nx,四\n'.encode())
+        r = self.client.post(reverse('flow_instance_bulk_start', args=[self.tpl.code]), {'file': upload})
+        self.assertEqual(r.status_code, 200)
+        report = r.json()
+        self.assertEqual((report['total'], report['created']), (4, 2))
+        self.assertEqual([e['row'] for e in report['errors']], [3, 6])
+
+    def test_submit_bulk_reports_each_failure(self):
+        start_instances_bulk(self.tpl, self.a, [{'pages': i} for i in range(1, 5)])
+        w1, w2, w3, w4 = WorkItem.objects.filter(instance__template=self.tpl).order_by('id')
+        claim_work_item(w2, self.b)
+        submit_task(w3, self.a, 'approve', '')
+
+        results = submit_tasks_bulk([w1.pk, w2.pk, w3.pk, w4.pk, 999999], self.a, 'approve', '批量')
+        self.assertIsNone(results[w1.pk])
+        self.assertIsNone(results[w4.pk])
+        self.assertEqual(results[w2.pk], '非当前认领人')
+        self.assertEqual(results[w3.pk], '工作项已完成或已取消')
+        self.assertEqual(results[999999], '工作项不存在')
+
+        self.assertEqual(WorkItem.objects.get(pk=w2.pk).status, WorkItemStatus.CLAIMED)
+        for wi in (w1, w4):
+            self.assertEqual(FlowInstance.objects.get(pk=wi.instance_id).status, InstanceStatus.COMPLETED)
+            self.assertFalse(WorkItemCandidate.objects.filter(work_item=wi).exclude(status=WorkItemStatus.DONE).exists())
+            self.assertEqual(ActionLog.objects.filter(instance_id=wi.instance_id, action='approve', payload__comment='批量').count(), 1)
+
+
+def _legacy_normalize(fields, data, required_extra=None):
+    """重构前 services._normalize_and_validate 的逐字移植，作为对照"""
+    errs = []
+    out = dict(data)
+    req = set(f.name for f in fields if f.required) | set(required_extra or ())
+    for f in fields:
+        name, v = f.name, out.get(f.name, None)
+        if name in req and (v is None or v == ''):
+            errs.append(f'字段“{f.title or name}”为必填')
+            continue
+        if v in (None, ''):
+            continue
+        try:
+            if f.type == FieldType.INTEGER:
+                out[name] = int(v)
+            elif f.type == FieldType.NUMBER:
+                out[name] = float(v)
+            elif f.type == FieldType.BOOLEAN:
+                if isinstance(v, bool):
+                    pass
+                elif str(v).lower() in ('true', '1', 'yes', 'on'):
+                    out[name] = True
+                elif str(v).lower() in ('false', '0', 'no', 'off'):
+                    out[name] = False
+            elif f.type == FieldType.SELECT:
+                if v not in f.enum_list():
+                    errs.append(f'字段“{f.title or name}”必须是下拉选项之一')
+        except Exception:
+            errs.append(f'字段“{f.title or name}”类型不正确')
+    return out, errs
+
+
+def _legacy_render(fields, current_data, ov):
+    """重构前 views.build_fields_from_formdef 的结果（html 类型映射与 CompiledField 相同，逐项比较其余内容）"""
+    html = {'select': 'select', 'boolean': 'checkbox', 'integer': 'number', 'number': 'number',
+            'text': 'textarea', 'date': 'date', 'datetime': 'datetime'}
+    rows = []
+    for f in fields:
+        if f.name in ov['hidden']:
+            continue
+        h = html.get(f.type, 'text')
+        rows.append({
+            'name': f.name, 'title': f.title or f.name, 'html_type': h, 'enum': f.enum_list(),
+            'value': current_data.get(f.name, '' if h != 'checkbox' else False),
+            'required': f.required or f.name in ov['required'], 'readonly': f.name in ov['readonly'],
+        })
+    return rows
+
+
+class CompiledFormTests(TestCase):
+    def setUp(self):
+        self.form = FormDef.objects.create(name='对照表单')
+        for name, type_, required, options in [
+            ('pages', 'integer', True, ''), ('score', 'number', False, ''), ('ok', 'boolean', False, ''),
+            ('kind', 'select', False, '图书\n 期刊 \n\n报纸'), ('note', 'string', False, ''),
+            ('body', 'text', False, ''), ('day', 'date', False, ''), ('at', 'datetime', False, ''),
+        ]:
+            FormField.objects.create(form=self.form, name=name, title=name.upper(), type=type_,
+                                     required=required, options=options)
+        self.form.refresh_from_db()
+
+    def test_field_edit_bumps_version_and_recompiles(self):
+        v0 = self.form.version
+        compiled = get_compiled_form(self.form)
+        self.assertIs(get_compiled_form(self.form), compiled)
+
+        field = FormField.objects.get(form=self.form, name='note')
+        field.title, field.required = '备注', True
+        field.save()
+        self.form.refresh_from_db()
+        self.assertEqual(self.form.version, v0 + 1)
+        fresh = get_compiled_form(self.form)
+        self.assertIsNot(fresh, compiled)
+        self.assertEqual(fresh.fields_map['note'].title, '备注')
+        self.assertIn('note', fresh.required)
+
+        field.delete()
+        self.form.refresh_from_db()
+        self.assertEqual(self.form.version, v0 + 2)
+        self.assertNotIn('note', get_compiled_form(self.form).fields_map)
+
+    def test_normalize_and_render_match_legacy(self):
+        fields = list(FormField.objects.filter(form=self.form))
+        compiled = get_compiled_form(self.form)
+        payloads = [
+            {},
+            {'pages': '12', 'score': '3.5', 'ok': 'on', 'kind': '期刊', 'note': 'x', 'day': '2025-01-02'},
+            {'pages': 'abc', 'score': [], 'ok': 'maybe', 'kind': '杂志'},
+            {'pages': '', 'ok': 'False', 'kind': ['图书'], 'extra': 1},
+            {'pages': 3.9, 'score': True, 'ok': 0, 'kind': '图书'},
+            {'pages': None, 'note': '', 'at': '2025-01-02T03:04'},
+            {'pages': float('inf')},  # JSON 里的 Infinity 解析后 int() 抛 OverflowError
+        ]
+        for data in payloads:
+            for extra in (None, {'note'}, {'kind', 'score'}):
+                self.assertEqual(compiled.normalize(data, required_extra=extra),
+                                 _legacy_normalize(fields, data, extra), (data, extra))
+        # 唯一有意的差异：小数为 inf/nan 时旧逻辑照单全收，写 JSON 列会失败，现按类型错误拒绝
+        self.assertEqual(compiled.normalize({'pages': 1, 'score': '1e400'})[1], ['字段“SCORE”类型不正确'])
+
+        overrides = [
+            None,
+            {'hidden': {'body'}, 'readonly': {'pages'}, 'required': {'note'}},
+            {'hidden': set(), 'readonly': {'kind', 'ok'}, 'required': set()},
+        ]
+        for ov in overrides:
+            for data in payloads:
+                got = [dict(r, enum=list(r['enum'])) for r in compiled.render(data, ov)]
+                legacy_ov = ov or {'hidden': set(), 'readonly': set(), 'required': set()}
+                self.assertEqual(got, _legacy_render(fields, data, legacy_ov), (ov, data))
+
+
+class IndexedFieldTests(TestCase):
+    def setUp(self):
+        self.a = User.objects.create(username='a', emp_id='A1', full_name='甲')
+        self.tpl = _make_template([self.a])
+        self.fields = {
+            name: FormField.objects.create(form=self.tpl.form_def, name=name, title=name, type=type_, indexed=True)
+            for name, type_ in [('pages', 'integer'), ('score', 'number'), ('day', 'date'),
+                                ('ok', 'boolean'), ('kind', 'string')]
+        }
+        self.tpl.refresh_from_db()
+
+    def _start(self, **data):
+        return start_instance(self.tpl, self.a, data)
+
+    def _values(self, ins):
+        return {v.field.name: v for v in FormFieldValue.objects.filter(instance=ins).select_related('field')}
+
+    def test_values_land_in_typed_columns(self):
+        ins = self._start(pages='12', score='3.5', day='2025-03-01', ok='on', kind='图书')
+        v = self._values(ins)
+        self.assertEqual(v['pages'].int_value, 12)
+        self.assertEqual(v['score'].num_value, 3.5)
+        self.assertEqual(v['day'].date_value, date(2025, 3, 1))
+        self.assertEqual(v['ok'].int_value, 1)
+        self.assertEqual(v['kind'].str_value, '图书')
+        self.assertIsNone(v['pages'].str_value)
+
+        # 无法投影的值（超出 BIGINT、非法日期）不建索引行，也不让写入失败
+        ins = self._start(pages=2 ** 70, day='not-a-date', ok=False, kind='')
+        self.assertEqual({k: x.int_value for k, x in self._values(ins).items()}, {'ok': 0})
+
+    def test_submit_resyncs_changed_values(self):
+        ins = self._start(pages=1)
+        submit_task(ins.work_items.get(), self.a, 'approve', '', {'pages': 9, 'kind': '期刊'})
+        v = self._values(ins)
+        self.assertEqual((v['pages'].int_value, v['kind'].str_value), (9, '期刊'))
+
+    def test_search_operators(self):
+        ins = [self._start(pages=p, score=p / 2, day=f'2025-03-0{p}', kind=k)
+               for p, k in [(1, '图书'), (2, '期刊'), (3, '图书馆藏'), (4, '报纸')]]
+
+        def found(**filters):
+            return sorted(search_instances(self.tpl, filters).values_list('id', flat=True))
+
+        ids = [i.id for i in ins]
+        self.assertEqual(found(pages='2'), [ids[1]])
+        self.assertEqual(found(pages__lt='2'), [ids[0]])
+        self.assertEqual(found(pages__lte='2'), ids[:2])
+        self.assertEqual(found(score__gt='1.5'), ids[3:])
+        self.assertEqual(found(day__gte='2025-03-03'), ids[2:])
+        self.assertEqual(found(pages__in='1, 4'), [ids[0], ids[3]])
+        self.assertEqual(found(kind__contains='图书'), [ids[0], ids[2]])
+        self.assertEqual(found(pages__gte='2', kind__contains='图书'), [ids[2]])
+
+        for bad in ({'title': 'x'}, {'pages__contains': '1'}, {'pages': 'abc'}, {'pages__in': '1,x'}, {'day': '03/01'}):
+            with self.assertRaises(ValueError, msg=bad):
+                found(**bad)
+
+    def test_backfill_command_and_unindexing(self):
+        field = self.fields['pages']
+        field.indexed = False
+        field.save()
+        legacy = [self._start(pages=p) for p in (5, 6)]
+        self.assertFalse(FormFieldValue.objects.filter(field=field).exists())
+
+        field.indexed = True
+        field.save()
+        out = io.StringIO()
+        call_command('flow_index_fields', template=self.tpl.code, stdout=out)
+        call_command('flow_index_fields', stdout=io.StringIO())  # 可重复执行
+        self.assertEqual(
+            sorted(FormFieldValue.objects.filter(field=field).values_list('instance_id', 'int_value')),
+            [(legacy[0].id, 5), (legacy[1].id, 6)],
+        )
+        self.assertIn('2 个实例', out.getvalue())
+
+        field.indexed = False
+        field.save()
+        self.assertFalse(FormFieldValue.objects.filter(field=field).exists())
+        with self.assertRaises(ValueError):
+            search_instances(self.tpl, {'pages': '5'})
+
+
+class SimulatorTests(TestCase):
+    def setUp(self):
+        form = FormDef.objects.create(name='试运行表单')
+        FormField.objects.create(form=form, name='pages', title='页数', type='integer', required=True)
+        self.tpl = FlowTemplate.objects.create(code='sim', name='试运行', status='active', form_def=form)
+
+        def node(code, name, type_='approval'):
+            return FlowNode.objects.create(template=self.tpl, code=code, name=name, type=type_)
+
+        start, check, big, end = node('start', '开始', 'start'), node('check', '初审'), node('big', '复核'), node('end', '结束', 'end')
+        orphan = node('orphan', '孤立')
+        Transition.objects.create(template=self.tpl, source=start, target=check)
+        self.broken = Transition.objects.create(template=self.tpl, source=check, target=end,
+                                                condition="form['kind'] == 'z'", priority=0)
+        Transition.objects.create(template=self.tpl, source=check, target=big, condition="form['pages'] >= 100", priority=1)
+        Transition.objects.create(template=self.tpl, source=check, target=end, condition="form['pages'] < 10", priority=2)
+        Transition.objects.create(template=self.tpl, source=big, target=end)
+        Transition.objects.create(template=self.tpl, source=orphan, target=end)
+        self.tpl.refresh_from_db()
+
+    def test_paths_invalid_payloads_and_unreachable_nodes(self):
+        payloads = [{'pages': 200}] * 5 + [{'pages': '5'}] * 3 + [{'pages': 50}] * 2 + [{}, {'pages': 'abc'}]
+        report = simulate(get_compiled_template(self.tpl), payloads)
+
+        self.assertEqual((report['payloads'], report['invalid']), (12, 2))
+        self.assertEqual(sorted(report['invalid_reasons']), [('字段“页数”为必填', 1), ('字段“页数”类型不正确', 1)])
+        self.assertEqual((report['completed'], report['dead_end'], report['loop']), (8, 2, 0))
+        self.assertEqual(report['dead_end_nodes'], [('check', 2)])
+        self.assertEqual(
+            [(p['path'], p['state'], p['count']) for p in report['paths']],
+            [('开始 → 初审 → 复核 → 结束', 'completed', 5), ('开始 → 初审 → 结束', 'completed', 3),
+             ('开始 → 初审', 'dead_end', 2)],
+        )
+        self.assertEqual({r['code']: r['work_items'] for r in report['node_load']}, {'check': 10, 'big': 5, 'orphan': 0})
+        self.assertEqual(report['unreachable'], ['orphan'])
+        self.assertEqual(report['never_visited'], [])
+        # 同一取值组合只求值一次：3 种页数 -> 3 条缓存路径，缺 kind 的条件各报错一次
+        self.assertEqual((report['distinct_routes'], report['route_keys']), (3, ['kind', 'pages']))
+        self.assertEqual(report['condition_errors'], {self.broken.id: 3})
+
+
+class InstanceMigratorTests(TestCase):
+    def setUp(self):
+        self.a = User.objects.create(username='a', emp_id='A1', full_name='甲')
+        self.src = self._template('mig-v1', ['review', 'check', 'legacy'], [('start', 'review', ''), ('review', 'end', '')])
+        self.dst = self._template('mig-v2', ['review', 'review2', 'gate', 'heavy'], [
+            ('start', 'gate', ''), ('gate', 'heavy', "form['pages'] >= 100"), ('gate', 'end', ''),
+            ('review', 'end', ''), ('review2', 'end', ''), ('heavy', 'end', ''),
+        ])
+        self.src_field = FormField.objects.get(form=self.src.form_def)
+        self.dst_field = FormField.objects.get(form=self.dst.form_def)
+
+    def _template(self, code, middle, edges):
+        form = FormDef.objects.create(name=code)
+        FormField.objects.create(form=form, name='pages', title='页数', type='integer', indexed=True)
+        tpl = FlowTemplate.objects.create(code=code, name=code, status='active', form_def=form)
+        nodes = {'start': FlowNode.objects.create(template=tpl, code='start', name='开始', type='start'),
+                 'end': FlowNode.objects.create(template=tpl, code='end', name='结束', type='end')}
+        for c in middle:
+            nodes[c] = FlowNode.objects.create(template=tpl, code=c, name=c, type='gateway' if c == 'gate' else 'approval')
+            nodes[c].assigned_users.add(self.a)
+        for src, dst, cond in edges:
+            Transition.objects.create(template=tpl, source=nodes[src], target=nodes[dst], condition=cond)
+        tpl.refresh_from_db()
+        return tpl
+
+    def _at(self, code, pages):
+        ins = start_instance(self.src, self.a, {'pages': pages})
+        node = self.src.nodes.get(code=code)
+        FlowInstance.objects.filter(pk=ins.pk).update(current_node=node)
+        WorkItem.objects.filter(instance=ins).update(node=node)
+        return ins
+
+    def test_dry_run_then_apply(self):
+        by_code, mapped = self._at('review', 1), self._at('check', 1)
+        completed, heavy = self._at('legacy', 5), self._at('legacy', 500)  # 旧节点在新模板中不存在，从开始节点重新路由
+        old_items = list(WorkItem.objects.filter(status=WorkItemStatus.OPEN).values_list('id', flat=True))
+        migrator = InstanceMigrator(self.src, self.dst, node_map={'check': 'review2'}, user=self.a)
+
+        def snapshot():
+            return (list(FlowInstance.objects.order_by('pk').values_list('template_id', 'current_node_id', 'status')),
+                    WorkItem.objects.count(), ActionLog.objects.count(), FormFieldValue.objects.count())
+
+        before = snapshot()
+        planned = {r['instance'].id: (r['kind'], r['how'], r['to']) for rows in migrator.run(dry_run=True) for r in rows}
+        self.assertEqual(snapshot(), before)
+        expected = {
+            by_code.id: ('move', 'map', 'review'),
+            mapped.id: ('move', 'map', 'review2'),
+            completed.id: ('complete', 'reroute', 'end'),
+            heavy.id: ('move', 'reroute', 'heavy'),
+        }
+        self.assertEqual(planned, expected)
+
+        applied = {r['instance'].id: (r['kind'], r['how'], r['to']) for rows in migrator.run(chunk_size=3) for r in rows}
+        self.assertEqual(applied, expected)
+        self.assertFalse(WorkItem.objects.filter(pk__in=old_items).exclude(status=WorkItemStatus.CANCELED).exists())
+        for ins_id, (kind, _, code) in expected.items():
+            ins = FlowInstance.objects.select_related('current_node').get(pk=ins_id)
+            self.assertEqual(ins.template_id, self.dst.id)
+            if kind == 'complete':
+                self.assertEqual((ins.status, ins.current_node), (InstanceStatus.COMPLETED, None))
+                self.assertFalse(ins.work_items.filter(status=WorkItemStatus.OPEN).exists())
+            else:
+                self.assertEqual(ins.current_node.code, code)
+                self.assertEqual(ins.work_items.get(status=WorkItemStatus.OPEN).node_id, ins.current_node_id)
+            log = ActionLog.objects.get(instance_id=ins_id, action='migrate')
+            self.assertEqual(log.payload['to_node'], code)
+
+        # 表单定义不同：索引值改挂到新表单的字段上
+        self.assertFalse(FormFieldValue.objects.filter(field=self.src_field).exists())
+        self.assertEqual(
+            dict(FormFieldValue.objects.filter(field=self.dst_field).values_list('instance_id', 'int_value')),
+            {by_code.id: 1, mapped.id: 1, completed.id: 5, heavy.id: 500},
+        )
+
+        # 再在新模板内“迁移”一次：节点未变的实例全部跳过，不产生任何写入
+        before = snapshot()
+        rows = [r for chunk in InstanceMigrator(self.dst, self.dst).run() for r in chunk]
+        self.assertEqual(sorted(r['kind'] for r in rows), ['skip'] * 3)
+        self.assertEqual(snapshot(), before)
+
+
+class NodeStatsTests(TestCase):
+    def test_buckets_bound_each_dwell_and_estimate_percentiles(self):
+        self.assertEqual((stats.bucket_of(0), stats.bucket_of(1), stats.bucket_of(1.05)), (0, 0, 1))
+        dwells = [1.5 ** i for i in range(1, 40)] + [3600.0] * 10
+        for d in dwells:
+            b = stats.bucket_of(d)
+            self.assertLess(stats.DWELL_GAMMA ** (b - 1), d * (1 + 1e-9))
+            self.assertLessEqual(d, stats.DWELL_GAMMA ** b * (1 + 1e-9))
+            self.assertLess(abs(stats.bucket_value(b) / d - 1), 0.05)
+
+        self.assertIsNone(stats.percentile({}, 50))
+        counts = Counter(stats.bucket_of(d) for d in dwells)
+        ranked = sorted(dwells)
+        for q in (10, 50, 90, 99, 100):
+            exact = ranked[max(math.ceil(q / 100 * len(ranked)) - 1, 0)]
+            self.assertLess(abs(stats.percentile(counts, q) / exact - 1), 0.05, q)
+
+    def test_live_increments_match_rebuild(self):
+        a = User.objects.create(username='a', emp_id='A1', full_name='甲')
+        tpl = _make_template([a])
+        approve = tpl.nodes.get(code='approve')
+        with self.captureOnCommitCallbacks(execute=True):
+            ins = [start_instance(tpl, a, {}) for _ in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            submit_task(ins[0].work_items.get(), a, 'approve', '')
+            # 计数在提交后才写：事务内不持有统计行的锁
+            self.assertEqual(NodeDailyStat.objects.get(node=approve).completed, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            submit_tasks_bulk([i.work_items.get().id for i in ins[1:]], a, 'approve', '')
+
+        def snapshot():
+            return [
+                (s.node_id, s.day, s.entered, s.completed, round(s.dwell_sum, 3), round(s.dwell_max, 3),
+                 sorted(s.buckets.values_list('bucket', 'count')))
+                for s in NodeDailyStat.objects.order_by('node_id', 'day')
+            ]
+
+        live = snapshot()
+        self.assertEqual([(row[0], row[2], row[3]) for row in live], [(approve.id, 3, 3)])
+        self.assertEqual(sum(c for _, c in live[0][6]), 3)
+
+        NodeDailyStat.objects.all().delete()
+        call_command('flow_node_stats', stdout=io.StringIO())
+        self.assertEqual(snapshot(), live)
+
+
+class FormRevisionTests(TestCase):
+    def setUp(self):
+        self.a = User.objects.create(username='a', emp_id='A1', full_name='甲')
+        self.tpl = _make_template([self.a])
+        FormField.objects.create(form=self.tpl.form_def, name='pages', title='页数', type='integer')
+        FormField.objects.create(form=self.tpl.form_def, name='note', title='备注', type='string')
+        approve = self.tpl.nodes.get(code='approve')
+        Transition.objects.create(template=self.tpl, source=approve, target=approve, condition="action == 'again'", priority=1)
+        self.tpl.refresh_from_db()
+
+    def test_every_revision_replays_across_snapshots(self):
+        ins = start_instance(self.tpl, self.a, {'pages': 0})
+        history = [form_at_revision(ins, 0)]
+        total = FORM_SNAPSHOT_EVERY * 2 + 5
+        for i in range(1, total + 1):
+            data = {'pages': i // 3}  # 每三次里有两次内容不变，不应产生新版本
+            if i % 7 == 0:
+                data['note'] = f'第{i}次'
+            elif i % 11 == 0:
+                data['note'] = None
+            ins = submit_task(ins.work_items.get(status=WorkItemStatus.OPEN), self.a, 'again', '', data)
+            if ins.form_rev > len(history):
+                history.append(dict(ins.form_data))
+        self.assertGreater(len(history), FORM_SNAPSHOT_EVERY + 1)
+        self.assertEqual(ins.form_rev, len(history))
+        self.assertEqual(
+            list(FormRevision.objects.filter(instance=ins, snapshot__isnull=False).values_list('seq', flat=True)),
+            list(range(0, len(history), FORM_SNAPSHOT_EVERY)),
+        )
+        for seq, expected in enumerate(history):
+            self.assertEqual(form_at_revision(ins, seq), expected, f'seq={seq}')
+        self.assertEqual(form_at_revision(ins), ins.form_data)
+
+    def test_backfill_gives_legacy_instances_a_base_snapshot(self):
+        legacy = FlowInstance.objects.create(template=self.tpl, starter=self.a, form_data={'pages': 7}, status='running')
+        fresh = start_instance(self.tpl, self.a, {'pages': 1})
+        import_module('flow.migrations.0018_backfill_form_revisions').backfill_seq0(django_apps, None)
+
+        legacy.refresh_from_db()
+        self.assertEqual(legacy.form_rev, 1)
+        self.assertEqual(form_at_revision(legacy, 0), {'pages': 7})
+        self.assertEqual(FormRevision.objects.filter(instance=fresh).count(), 1)  # 已有历史的不重复补
+        legacy.current_node = self.tpl.nodes.get(code='approve')
+        legacy.save()
+        wi = WorkItem.objects.create(instance=legacy, node=legacy.current_node, assignees=[self.a.id])
+        WorkItemCandidate.objects.create(work_item=wi, user=self.a)
+        submit_task(wi, self.a, 'approve', '', {'pages': 8})
+        self.assertEqual((form_at_revision(legacy, 0), form_at_revision(legacy, 1)), ({'pages': 7}, {'pages': 8}))
+
+
+class ArchiveTests(TestCase):
+    def setUp(self):
+        self.a = User.objects.create(username='a', emp_id='A1', full_name='甲')
+        self.tpl = _make_template([self.a])
+        FormField.objects.create(form=self.tpl.form_def, name='pages', title='页数', type='integer')
+        self.before = timezone.now() + timedelta(seconds=1)
+
+    def _finished(self, pages):
+        ins = start_instance(self.tpl, self.a, {'pages': pages}, title=f'归档{pages}')
+        submit_task(ins.work_items.get(), self.a, 'approve', '同意', {'pages': pages + 1})
+        return FlowInstance.objects.get(pk=ins.pk)
+
+    def test_round_trip_matches_hot_data(self):
+        ins = self._finished(3)
+        expected = archive._snapshot(
+            FlowInstance.objects.prefetch_related('work_items__node', 'action_logs__node', 'action_logs__user',
+                                                  'form_revisions').get(pk=ins.pk)
+        )
+        self.assertEqual(list(archive.archive_finished_instances(self.before)), [1])
+        self.assertFalse(FlowInstance.objects.filter(pk=ins.pk).exists())
+
+        arc = ArchivedInstance.objects.get(pk=ins.pk)
+        self.assertEqual(arc.data(), json.loads(json.dumps(expected)))
+        self.assertEqual((arc.title, arc.status, arc.starter_id), ('归档3', InstanceStatus.COMPLETED, self.a.id))
+        self.assertEqual([r['seq'] for r in arc.data()['form_revisions']], [0, 1])
+
+        self.client.force_login(self.a)
+        r = self.client.get(reverse('flow_archive_detail', args=[ins.pk]))
+        self.assertEqual(r.context['form_data'], {'pages': 4})
+        self.assertEqual([w['comment'] for w in r.context['work_items']], ['同意'])
+        self.assertEqual([log['action'] for log in r.context['logs']], ['start', 'approve', 'complete'])
+
+    def test_running_instances_are_left_alone(self):
+        done = self._finished(1)
+        running = start_instance(self.tpl, self.a, {'pages': 2})
+        self.assertEqual(archive.archive_chunk([done.pk, running.pk]), 1)
+        self.assertTrue(FlowInstance.objects.filter(pk=running.pk).exists())
+        self.assertEqual(running.work_items.count(), 1)
+        self.assertFalse(ArchivedInstance.objects.filter(pk=running.pk).exists())
+
+    def test_existing_archive_row_keeps_hot_data(self):
+        reused, other = self._finished(1), self._finished(2)
+        old = ArchivedInstance.objects.create(
+            id=reused.pk, status=InstanceStatus.COMPLETED, started_at=timezone.now(), finished_at=timezone.now(),
+            payload=b'older',
+        )
+        with self.assertLogs('flow.archive', 'WARNING'):
+            self.assertEqual(archive.archive_chunk([reused.pk, other.pk]), 1)
+        self.assertTrue(FlowInstance.objects.filter(pk=reused.pk).exists())
+        self.assertEqual(ActionLog.objects.filter(instance_id=reused.pk).count(), 3)
+        self.assertEqual(bytes(ArchivedInstance.objects.get(pk=old.pk).payload), b'older')
+        self.assertFalse(FlowInstance.objects.filter(pk=other.pk).exists())
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class SubmitContentionTests(TransactionTestCase):
+    THREADS = 6
+
+    def test_concurrent_submits_advance_once(self):
+        users = [User.objects.create(username=f'u{i}', emp_id=f'E{i}', full_name=f'审批人{i}')
+                 for i in range(self.THREADS)]
+        ins = start_instance(_make_template(users), users[0], {})
+        item_id = ins.work_items.get().pk
+        barrier = threading.Barrier(self.THREADS)
+        winners, errors = [], []
+
+        def worker(user):
+            try:
+                wi = WorkItem.objects.get(pk=item_id)
+                barrier.wait()
+                try:
+                    submit_task(wi, user, 'approve', '')
+                    winners.append(user.id)
+                except ValueError:
+                    pass
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(u,)) for u in users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual((len(winners), errors), (1, []))
+        self.assertEqual(ActionLog.objects.filter(instance=ins, action='approve').count(), 1)
+        self.assertEqual(ActionLog.objects.filter(instance=ins, action='complete').count(), 1)
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+class ClaimContentionTests(TransactionTestCase):
+    THREADS = 8
+    ITEMS = 20
+
+    def setUp(self):
+        self.users = [
+            User.objects.create(username=f'u{i}', emp_id=f'E{i}', full_name=f'审批人{i}')
+            for i in range(self.THREADS)
+        ]
+        tpl = _make_template(self.users)
+        for i in range(self.ITEMS):
+            start_instance(tpl, self.users[0], {}, title=f'实例{i}')
+        self.item_ids = list(WorkItem.objects.values_list('id', flat=True))
+
+    def _race(self, item_id):
+        barrier = threading.Barrier(self.THREADS)
+        winners, errors = [], []
+
+        def worker(user):
+            try:
+                wi = WorkItem.objects.get(pk=item_id)
+                barrier.wait()
+                try:
+                    claim_work_item(wi, user)
+                    winners.append(user.id)
+                except ValueError:
+                    pass
+            except Exception as e:  # 其它异常说明并发处理有问题
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(u,)) for u in self.users]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return winners, errors
+
+    def test_exactly_one_owner_under_load(self):
+        for item_id in self.item_ids:
+            winners, errors = self._race(item_id)
+            self.assertEqual(errors, [])
+            self.assertEqual(len(winners), 1)
+            wi = WorkItem.objects.get(pk=item_id)
+            self.assertEqual(wi.status, WorkItemStatus.CLAIMED)
+            self.assertEqual(wi.owner_id, winners[0])
+            self.assertFalse(wi.candidates.exclude(status=WorkItemStatus.CLAIMED).exists())
+
+    def test_release_then_reclaim(self):
+        wi = WorkItem.objects.get(pk=self.item_ids[0])
+        claim_work_item(wi, self.users[1])
+        with self.assertRaises(PermissionError):
+            release_work_item(WorkItem.objects.get(pk=wi.pk), self.users[2])
+        release_work_item(WorkItem.objects.get(pk=wi.pk), self.users[1])
+        winners, errors = self._race(wi.pk)
+        self.assertEqual((len(winners), errors), (1, []))
+        self.assertEqual(
+            set(WorkItemCandidate.objects.filter(work_item_id=wi.pk).values_list('status', flat=True)),
+            {WorkItemStatus.CLAIMED},
+        )
+
+
+class FakeClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+
+class SlaSchedulerTests(TestCase):
+    def setUp(self):
+        self.approver = User.objects.create(username='approver', emp_id='A1', full_name='审批人')
+        self.boss = User.objects.create(username='boss', emp_id='B1', full_name='科长')
+        self.tpl = _make_template([self.approver])
+        node = FlowNode.objects.get(template=self.tpl, code='approve')
+        node.sla_minutes, node.overdue_action, node.escalate_to = 30, OverdueAction.REASSIGN, self.boss
+        node.save()  # 走模型保存，由信号使编译模板失效（queryset.update 不触发信号，会读到旧的编译结果）
+        self.tpl.refresh_from_db()
+
+    def test_due_at_set_and_reassigned_only_after_deadline(self):
+        ins = start_instance(self.tpl, self.approver, {})
+        wi = ins.work_items.get()
+        self.assertIsNotNone(wi.due_at)
+
+        clock = FakeClock(wi.due_at - timedelta(minutes=5))
+        scheduler = SlaScheduler(clock=clock, sleep=clock.sleep, poll=60)
+        scheduler.run_forever(max_ticks=3)  # 走到到期前 2 分钟
+        wi.refresh_from_db()
+        self.assertEqual(wi.sla_state, '')
+
+        scheduler.run_forever(max_ticks=5)
+        wi.refresh_from_db()
+        self.assertEqual(wi.sla_state, 'reassigned')
+        self.assertEqual(wi.assignees, [self.boss.id])
+        self.assertEqual(list(wi.candidates.values_list('user_id', flat=True)), [self.boss.id])
+        self.assertEqual(ins.action_logs.filter(action='sla_reassign').count(), 1)
+
+        # 再跑也不会重复处理
+        scheduler.run_forever(max_ticks=3)
+        self.assertEqual(ins.action_logs.filter(action='sla_reassign').count(), 1)
+
+    def test_reassigned_item_already_queued_is_handled_at_new_deadline(self):
+        ins = start_instance(self.tpl, self.approver, {})
+        wi = ins.work_items.get()
+        start = wi.due_at - timedelta(minutes=30)
+
+        clock = FakeClock(start)
+        scheduler = SlaScheduler(clock=clock, sleep=clock.sleep, horizon=timedelta(hours=1), poll=60)
+        scheduler.run_forever(max_ticks=1)  # 首次装载，工作项已按原时限入堆
+
+        # 到期前改派：按改派时刻重算时限，原时限 +20 分钟
+        clock.now = start + timedelta(minutes=20)
+        with mock.patch('flow.services.timezone.now', return_value=clock.now):
+            reassign_work_items([wi.id], self.boss, self.approver)
+        wi.refresh_from_db()
+        self.assertEqual(wi.due_at, start + timedelta(minutes=50))
+
+        scheduler.run_forever(max_ticks=20)  # 越过原时限，走到新时限前
+        self.assertLess(clock.now, wi.due_at)
+        wi.refresh_from_db()
+        self.assertEqual(wi.sla_state, '')
+
+        scheduler.run_forever(max_ticks=12)
+        self.assertGreaterEqual(clock.now, wi.due_at)
+        wi.refresh_from_db()
+        self.assertEqual(wi.sla_state, 'reassigned')
+        self.assertEqual(ins.action_logs.filter(action='sla_reassign').count(), 1)
+
+    def test_item_created_after_window_loaded_is_picked_up(self):
+        clock = FakeClock(timezone.now())
+        scheduler = SlaScheduler(clock=clock, sleep=clock.sleep, horizon=timedelta(hours=2), poll=60)
+        scheduler.tick()
+        ins = start_instance(self.tpl, self.approver, {})
+        clock.now = ins.work_items.get().due_at + timedelta(seconds=1)
+        scheduler.tick()
+        self.assertEqual(ins.work_items.get().sla_state, 'reassigned')
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.approver = User.objects.create(username='approver', emp_id='A1', full_name='审批人')
+        self.tpl = _make_template([self.approver])
+        self.calls = []
+        self._saved = dict(outbox._HANDLERS)
+        outbox._HANDLERS.clear()
+        outbox.handler('work_item.created', 'instance.completed')(self._record)
+
+    def tearDown(self):
+        outbox._HANDLERS.clear()
+        outbox._HANDLERS.update(self._saved)
+
+    def _record(self, topic, events):
+        if any(e.payload.get('instance_id') == getattr(self, 'bad_instance', None) for e in events):
+            raise RuntimeError('下游不可用')
+        self.calls.append((topic, [e.key for e in events]))
+
+    def test_submit_writes_one_event_and_worker_batches_by_topic(self):
+        ins = start_instance(self.tpl, self.approver, {})
+        before = OutboxEvent.objects.count()
+        submit_task(ins.work_items.get(), self.approver, 'approve', '', {})
+        self.assertEqual(OutboxEvent.objects.count() - before, 1)
+
+        start_instance(self.tpl, self.approver, {})
+        self.assertEqual(outbox.drain(batch_size=10), (3, 0))
+        self.assertEqual(sorted(t for t, _ in self.calls), ['instance.completed', 'work_item.created'])
+        self.assertEqual(len(dict(self.calls)['work_item.created']), 2)
+        self.assertEqual(outbox.drain(batch_size=10), (0, 0))
+
+    def test_failed_event_is_isolated_and_retried_with_backoff(self):
+        good = start_instance(self.tpl, self.approver, {})
+        bad = start_instance(self.tpl, self.approver, {})
+        self.bad_instance = bad.id
+        now = timezone.now()
+        self.assertEqual(outbox.drain(now=now), (1, 1))
+        ev = OutboxEvent.objects.get(payload__instance_id=bad.id)
+        self.assertEqual((ev.status, ev.attempts), (OutboxStatus.PENDING, 1))
+        self.assertGreater(ev.available_at, now)
+        self.assertEqual(OutboxEvent.objects.get(payload__instance_id=good.id).status, OutboxStatus.DONE)
+
+        self.bad_instance = None
+        self.assertEqual(outbox.drain(now=ev.available_at), (1, 0))
+        self.assertEqual(OutboxEvent.objects.get(pk=ev.pk).status, OutboxStatus.DONE)
+
+    def test_webhook_sends_keys_in_body_and_a_bounded_batch_header(self):
+        events = [OutboxEvent(id=i, topic='work_item.created', key=f'work_item.created:{i:0200d}', payload={'n': i})
+                  for i in range(300)]
+        resp = mock.MagicMock(status=200)
+        resp.__enter__.return_value = resp
+        with self.settings(FLOW_OUTBOX_WEBHOOKS={'*': ['http://hook.test/a']}), \
+                mock.patch('urllib.request.urlopen', return_value=resp) as urlopen:
+            outbox.post_webhooks('work_item.created', events)
+            outbox.post_webhooks('work_item.created', events[::-1])
+        first, again = (c.args[0] for c in urlopen.call_args_list)
+        self.assertEqual([e['key'] for e in json.loads(first.data)], [e.key for e in events])
+        self.assertEqual(len(first.get_header('Idempotency-key')), 64)
+        self.assertEqual(first.get_header('Idempotency-key'), again.get_header('Idempotency-key'))
@@ -5,8 +5,16 @@ urlpatterns = [
     path('templates/', views.template_list, name='flow_template_list'),
     path('templates/new/', views.template_create, name='flow_template_create'),
     path('instances/start/<slug:template_code>/', views.instance_start, name='flow_instance_start'),
+    path('instances/bulk-start/<slug:template_code>/', views.instance_bulk_start, name='flow_instance_bulk_start'),
+    path('instances/search/<slug:template_code>/', views.instance_search, name='flow_instance_search'),
+    path('instances/<int:pk>/history/', views.instance_history, name='flow_instance_history'),
     path('work/inbox/', views.work_inbox, name='flow_work_inbox'),
     path('work/<int:pk>/submit/', views.work_submit, name='flow_work_submit'),
+    path('work/batch-submit/', views.work_batch_submit, name='flow_work_batch_submit'),
     path('work/<int:pk>/claim/', views.work_claim, name='flow_work_claim'),
     path('work/<int:pk>/release/', views.work_release, name='flow_work_release'),
+    path('live/', views.live_events, name='flow_live_events'),
+    path('stats/nodes/', views.node_stats, name='flow_node_stats'),
+    path('archive/', views.archive_list, name='flow_archive_list'),
+    path('archive/<int:pk>/', views.archive_detail, name='flow_archive_detail'),
 ]
\ No newline at end of file
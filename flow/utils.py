@@ -2,35 +2,111 @@
 from __future__ import annotations
 from typing import Any, Dict, Tuple, List
 import ast
+import base64
+import csv
+import io
+import json
+import zlib
+from datetime import datetime
 
 ALLOWED_NODES = (
     ast.Expression, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.IfExp,
-    ast.Compare, ast.Call, ast.Load, ast.Name, ast.Constant,
+    ast.Compare, ast.Call, ast.Load, ast.Name, ast.Constant, ast.Subscript,
     ast.And, ast.Or, ast.Not, ast.Eq, ast.NotEq, ast.Lt, ast.LtE,
     ast.Gt, ast.GtE, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod,
 )
 
 ALLOWED_NAMES = {"True": True, "False": False, "None": None}
 
-def safe_eval(expr: str, ctx: Dict[str, Any]) -> bool:
+# 非法条件（历史数据绕过了校验）统一按“不满足”处理，避免每次重新编译
+NEVER_MATCH = compile("False", "<cond>", "eval")
+
+# 进程级缓存：{transition_id: (updated_at, code)}；updated_at 变化即视为失效
+_CONDITION_CACHE: Dict[int, Tuple[Any, Any]] = {}
+
+
+def compile_condition(expr: str):
     """
-    仅允许白名单 AST 的简单表达式；上下文仅通过 ctx（如 form、action）。
+    校验并编译条件表达式，返回 code 对象；空表达式返回 None（代表无条件直通）。
+    校验失败抛 ValueError / SyntaxError。
     """
-    if not expr:
-        return True
-    tree = ast.parse(expr, mode="eval")
+    if not expr or not expr.strip():
+        return None
+    tree = ast.parse(expr.strip(), mode="eval")
     for node in ast.walk(tree):
         if not isinstance(node, ALLOWED_NODES):
             raise ValueError(f"不允许的表达式节点: {type(node).__name__}")
         if isinstance(node, ast.Call):
             # 禁止函数调用（如 len()），需要的话可在此白名单函数名并自定义实现
             raise ValueError("不允许在条件中调用函数")
-    code = compile(tree, "<cond>", "eval")
+    return compile(tree, "<cond>", "eval")
+
+
+def eval_compiled(code, ctx: Dict[str, Any]) -> bool:
+    """执行 compile_condition 的结果；code 为 None 时恒为真"""
+    if code is None:
+        return True
     env = dict(ALLOWED_NAMES)
     env.update(ctx or {})
     return bool(eval(code, {"__builtins__": {}}, env))
 
 
+def safe_eval(expr: str, ctx: Dict[str, Any]) -> bool:
+    """
+    仅允许白名单 AST 的简单表达式；上下文仅通过 ctx（如 form、action）。
+    每次调用都会重新解析，热路径请用 transition_code() + eval_compiled()。
+    """
+    return eval_compiled(compile_condition(expr), ctx)
+
+
+def transition_code(transition):
+    """
+    取 Transition 条件的预编译结果，按 (id, updated_at) 缓存在进程内。
+    未保存的对象（无 pk）不进缓存。
+    """
+    key = transition.pk
+    stamp = getattr(transition, "updated_at", None)
+    if key is not None:
+        hit = _CONDITION_CACHE.get(key)
+        if hit is not None and hit[0] == stamp:
+            return hit[1]
+    try:
+        code = compile_condition(transition.condition)
+    except (ValueError, SyntaxError):
+        code = NEVER_MATCH
+    if key is not None:
+        _CONDITION_CACHE[key] = (stamp, code)
+    return code
+
+
+def forget_transition(transition_id) -> None:
+    _CONDITION_CACHE.pop(transition_id, None)
+
+
+def condition_form_keys(expr: str):
+    """
+    条件读取了哪些表单字段：只出现 form['常量'] 形式时返回字段名集合；
+    若以其它方式使用 form（整体比较、变量下标等）返回 None，表示结果依赖整张表单。
+    """
+    if not expr or not expr.strip():
+        return set()
+    try:
+        tree = ast.parse(expr.strip(), mode="eval")
+    except SyntaxError:
+        return set()
+    keys, direct = set(), set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == "form":
+            if not (isinstance(node.slice, ast.Constant) and isinstance(node.slice.value, str)):
+                return None
+            keys.add(node.slice.value)
+            direct.add(id(node.value))
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "form" and id(node) not in direct:
+            return None
+    return keys
+
+
 def merge_overrides(json_schema: Dict[str, Any], overrides: Dict[str, Any]|None) -> Dict[str, Any]:
     """
     将节点 form_overrides 合并为易用的权限集：
@@ -43,6 +119,32 @@ def merge_overrides(json_schema: Dict[str, Any], overrides: Dict[str, Any]|None)
         "required": set(o.get("required") or []),
     }
 
+def overrides_from_rules(node, schema=None):
+    """
+    优先使用 NodeFieldRule 生成 overrides；
+    如果该节点没有任何规则，则回落旧 JSON (node.form_overrides)。
+    返回结构: {"hidden": set(), "readonly": set(), "required": set()}
+    """
+    try:
+        rules = list(node.field_rules.all())
+    except Exception:
+        rules = []
+
+    if rules:
+        res = {"hidden": set(), "readonly": set(), "required": set()}
+        for r in rules:
+            if r.hidden:
+                res["hidden"].add(r.field_name)
+            if r.readonly:
+                res["readonly"].add(r.field_name)
+            if r.required:
+                res["required"].add(r.field_name)
+        return res
+
+    # 兼容旧 JSON；若你已弃用旧 JSON，可以直接 return {"hidden": set(), "readonly": set(), "required": set()}
+    return merge_overrides(schema or {}, getattr(node, "form_overrides", {}) or {})
+
+
 def schema_required(schema: Dict[str, Any]) -> set[str]:
     req = schema.get("required") or []
     return set(req if isinstance(req, list) else [])
@@ -109,3 +211,120 @@ def validate_form(
                 errors.append(f"字段“{k}”必须是枚举值之一：{meta['enum']}")
 
     return (len(errors) == 0, errors)
+
+
+def read_rows(stream, fmt: str) -> List[Dict[str, Any]]:
+    """
+    读取批量数据文件：fmt 为 csv（首行表头）、jsonl（每行一个对象）或 xlsx（第一个工作表，首行表头）。
+    stream 可以是文本或二进制流（含上传文件）；CSV 兼容 Excel 导出的 BOM。
+    """
+    return [row for _, row in read_numbered_rows(stream, fmt)]
+
+
+def read_numbered_rows(stream, fmt: str) -> List[Tuple[int, Dict[str, Any]]]:
+    """同 read_rows，但每行带上它在源文件中的行号（表头为第 1 行；跳过的空行仍占行号），便于错误报告对照原表"""
+    if fmt == "xlsx":
+        return _read_xlsx(stream)
+    raw = stream.read()
+    text = raw.decode("utf-8-sig") if isinstance(raw, bytes) else raw.lstrip("\ufeff")
+    if fmt == "csv":
+        reader = csv.DictReader(io.StringIO(text))
+        return [(reader.line_num, dict(r)) for r in reader]
+    if fmt == "jsonl":
+        rows = []
+        for no, line in enumerate(text.splitlines(), start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rows.append((no, json.loads(line)))
+            except ValueError as e:
+                raise ValueError(f"第 {no} 行不是合法 JSON: {e}")
+        return rows
+    raise ValueError(f"不支持的文件格式: {fmt}")
+
+
+def _read_xlsx(stream) -> List[Tuple[int, Dict[str, Any]]]:
+    """xlsx 依赖 openpyxl（可选依赖，按需导入）；整行为空的行跳过，但保留其余行在表中的行号"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("读取 xlsx 需要安装 openpyxl，或先另存为 CSV")
+    try:
+        wb = load_workbook(stream, read_only=True, data_only=True)
+    except Exception as e:  # 损坏或非 xlsx 文件
+        raise ValueError(f"无法读取 xlsx 文件: {e}")
+    rows = wb.worksheets[0].iter_rows(min_row=1, values_only=True)
+    header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+    out = [
+        (no, {k: v for k, v in zip(header, r) if k})
+        for no, r in enumerate(rows, start=2) if any(v not in (None, "") for v in r)
+    ]
+    wb.close()
+    return out
+
+
+def encode_cursor(updated_at, pk) -> str:
+    """键集分页游标：(updated_at, id) 编成 URL 安全的字符串"""
+    raw = f"{updated_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """解析游标，非法游标返回 None（当作第一页）"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        ts, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(ts), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def pack_archive(obj: Dict[str, Any]) -> bytes:
+    """归档数据：紧凑 JSON + zlib 压缩"""
+    raw = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=str)
+    return zlib.compress(raw.encode("utf-8"), 6)
+
+
+def unpack_archive(blob) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(bytes(blob)).decode("utf-8"))
+
+
+# ---- 表单增量（JSON Patch 子集：add / replace / remove，路径按 RFC 6902 转义）----
+def _ptr(parts) -> str:
+    return "".join("/" + str(p).replace("~", "~0").replace("/", "~1") for p in parts)
+
+
+def split_pointer(path: str) -> List[str]:
+    return [p.replace("~1", "/").replace("~0", "~") for p in path.split("/")[1:]]
+
+
+def form_diff(old: Dict[str, Any], new: Dict[str, Any], _prefix=()) -> List[Dict[str, Any]]:
+    """计算 old -> new 的补丁；嵌套 dict 逐键下钻，其余类型（含 list）整体替换"""
+    ops: List[Dict[str, Any]] = []
+    for k, v in old.items():
+        if k not in new:
+            ops.append({"op": "remove", "path": _ptr(_prefix + (k,))})
+    for k, v in new.items():
+        if k not in old:
+            ops.append({"op": "add", "path": _ptr(_prefix + (k,)), "value": v})
+        elif isinstance(v, dict) and isinstance(old[k], dict):
+            ops.extend(form_diff(old[k], v, _prefix + (k,)))
+        elif old[k] != v or type(old[k]) is not type(v):
+            ops.append({"op": "replace", "path": _ptr(_prefix + (k,)), "value": v})
+    return ops
+
+
+def apply_form_patch(doc: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """把补丁应用到 doc 的副本上并返回"""
+    doc = json.loads(json.dumps(doc))
+    for op in ops:
+        *parents, key = split_pointer(op["path"])
+        target = doc
+        for p in parents:
+            target = target.setdefault(p, {})
+        if op["op"] == "remove":
+            target.pop(key, None)
+        else:
+            target[key] = op["value"]
+    return doc
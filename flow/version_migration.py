@@ -0,0 +1,162 @@
+# flow/version_migration.py
+"""
+运行中实例迁移到新版模板：旧节点按编码（或显式映射）对应到新模板节点，
+落到开始/网关节点时按新连线重新路由，映射不到的实例从新模板开始节点重新路由。
+
+每块实例一个事务：取消旧的在办工作项、批量生成新工作项、批量更新实例，
+每个实例写一条汇总 ActionLog（action='migrate'）。dry_run 只计算方案不写库。
+"""
+from __future__ import annotations
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from django.db import transaction
+from django.utils import timezone
+
+from .compiled import CompiledTemplate, get_compiled_template
+from .models import (
+    ActionLog, FlowInstance, FlowTemplate, InstanceStatus, NodeType, WorkItem, WorkItemCandidate, WorkItemStatus,
+)
+from .services import (
+    INBOX_ACTIVE, _bulk_create_work_items, _bust_inbox_counts, _instance_completed, _resolve_assignees,
+    emit_events, sync_field_values,
+)
+
+MOVE, COMPLETE, SKIP, ERROR = 'move', 'complete', 'skip', 'error'
+PASS_THROUGH = (NodeType.START, NodeType.GATEWAY)
+MAX_HOPS = 50
+
+
+class InstanceMigrator:
+    def __init__(self, source: FlowTemplate, target: FlowTemplate, node_map: Dict[str, str] | None = None, user=None):
+        self.source = source
+        self.target = target
+        self.ct: CompiledTemplate = get_compiled_template(target)
+        if self.ct.start is None:
+            raise ValueError('目标模板缺少开始节点')
+        self.by_code = {n.code: n for n in self.ct.nodes.values()}
+        missing = [new for new in (node_map or {}).values() if new not in self.by_code]
+        if missing:
+            raise ValueError('目标模板没有这些节点：' + '、'.join(missing))
+        self.node_map = node_map or {}
+        self.user = user
+
+    def running(self):
+        return FlowInstance.objects.filter(template=self.source, status=InstanceStatus.RUNNING)
+
+    # ---- 计算方案 ----
+    def _resolve(self, old_code: Optional[str], form: Dict[str, Any]):
+        """返回 (新节点, 方式, 错误)；新节点为结束节点表示实例直接完成"""
+        node = self.by_code.get(self.node_map.get(old_code, old_code)) if old_code else None
+        how = 'map'
+        if node is None:
+            node, how = self.ct.start, 'reroute'
+        for _ in range(MAX_HOPS):
+            if node.type not in PASS_THROUGH:
+                return node, how, None
+            nxt = self.ct.route(node.id, form, action='start' if node.type == NodeType.START else 'migrate')
+            if nxt is None:
+                return None, how, f'节点“{node.name}”没有满足条件的后续节点'
+            node, how = nxt, ('reroute' if how == 'reroute' else 'map+route')
+        return None, how, '重新路由超过最大步数，疑似循环'
+
+    def plan(self, instances) -> List[Dict[str, Any]]:
+        rows = []
+        for ins in instances:
+            old = ins.current_node
+            node, how, error = self._resolve(old.code if old else None, ins.form_data or {})
+            if error:
+                kind = ERROR
+            elif node.is_end:
+                kind = COMPLETE
+            elif ins.template_id == self.target.id and ins.current_node_id == node.id:
+                kind = SKIP
+            else:
+                kind = MOVE
+            rows.append({
+                'instance': ins, 'kind': kind, 'how': how, 'error': error,
+                'from': old.code if old else None, 'to': node.code if node else None, 'node': node,
+            })
+        return rows
+
+    # ---- 执行 ----
+    @transaction.atomic
+    def apply_chunk(self, ids) -> List[Dict[str, Any]]:
+        instances = list(
+            FlowInstance.objects.select_for_update().select_related('current_node')
+            .filter(pk__in=ids, template=self.source, status=InstanceStatus.RUNNING)
+        )
+        rows = self.plan(instances)
+        todo = [r for r in rows if r['kind'] in (MOVE, COMPLETE)]
+        if not todo:
+            return rows
+
+        ins_ids = [r['instance'].id for r in todo]
+        old_items = list(WorkItem.objects.filter(instance_id__in=ins_ids, status__in=INBOX_ACTIVE)
+                         .values_list('id', 'instance_id', 'assignees', 'owner_id'))
+        canceled: Dict[int, List[int]] = {}
+        for wid, iid, _, _ in old_items:
+            canceled.setdefault(iid, []).append(wid)
+        if old_items:
+            old_ids = [w[0] for w in old_items]
+            now = timezone.now()
+            WorkItem.objects.filter(pk__in=old_ids).update(status=WorkItemStatus.CANCELED, updated_at=now)
+            WorkItemCandidate.objects.filter(work_item_id__in=old_ids).update(status=WorkItemStatus.CANCELED)
+            _bust_inbox_counts(uid for _, _, assignees, owner in old_items for uid in list(assignees or []) + [owner])
+
+        now = timezone.now()
+        new_rows, logs, events = [], [], []
+        for r in todo:
+            ins, node = r['instance'], r['node']
+            from_version = self.source.version
+            ins.template_id = self.target.id
+            ins.updated_at = now
+            if r['kind'] == COMPLETE:
+                ins.status = InstanceStatus.COMPLETED
+                ins.current_node_id = None
+                events.append(_instance_completed(ins, getattr(self.user, 'id', None)))
+            else:
+                ins.current_node_id = node.id
+                new_rows.append((ins.id, node, _resolve_assignees(node, ins.form_data or {})))
+            logs.append(ActionLog(
+                instance_id=ins.id, node_id=node.id, user=self.user, action='migrate',
+                payload={
+                    'from_template': self.source.id, 'from_version': from_version, 'from_node': r['from'],
+                    'to_template': self.target.id, 'to_version': self.target.version, 'to_node': r['to'],
+                    'how': r['how'], 'canceled_work_items': canceled.get(ins.id, []),
+                },
+                remark=f'模板迁移：{r["from"] or "-"} → {r["to"]}',
+            ))
+        FlowInstance.objects.bulk_update([r['instance'] for r in todo],
+                                         ['template', 'current_node', 'status', 'updated_at'], batch_size=500)
+        _bulk_create_work_items(new_rows)
+        ActionLog.objects.bulk_create(logs, batch_size=500)
+        emit_events(events)
+        if self.target.form_def_id != self.source.form_def_id:
+            sync_field_values(self.ct.form, [(r['instance'].id, r['instance'].form_data) for r in todo])
+        return rows
+
+    def run(self, chunk_size: int = 200, dry_run: bool = False, limit: int | None = None) -> Iterator[List[Dict[str, Any]]]:
+        """逐块迁移（或预览），每块 yield 该块的方案行"""
+        last_id, seen = 0, 0
+        while limit is None or seen < limit:
+            size = chunk_size if limit is None else min(chunk_size, limit - seen)
+            ids = list(self.running().filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:size])
+            if not ids:
+                return
+            last_id = ids[-1]
+            seen += len(ids)
+            if dry_run:
+                yield self.plan(self.running().select_related('current_node').filter(pk__in=ids).order_by('pk'))
+            else:
+                yield self.apply_chunk(ids)
+
+
+def summarize(rows) -> Tuple[Counter, Counter]:
+    """(按结果计数, 按 旧节点→新节点 计数)"""
+    kinds, moves = Counter(), Counter()
+    for r in rows:
+        kinds[r['kind']] += 1
+        if r['kind'] in (MOVE, COMPLETE):
+            moves[(r['from'] or '-', r['to'])] += 1
+    return kinds, moves
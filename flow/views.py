@@ -1,65 +1,37 @@
 # flow/views.py
 from __future__ import annotations
+import asyncio
+from datetime import timedelta
 from typing import Any, Dict, List
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q
-from django.http import HttpRequest, HttpResponse
+from django.db.models import Max, Q, Sum
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.utils import timezone
 from django.views.decorators.http import require_http_methods
 
 from .forms import FlowTemplateForm
-from .models import FlowTemplate, WorkItem
-from .services import start_instance, submit_task, claim_work_item, release_work_item, _overrides_from_rules
-from .utils import merge_overrides, schema_properties
-from .models import FieldType
+from .models import FlowTemplate, FlowInstance, InstanceStatus, WorkItem, WorkItemCandidate, ArchivedInstance
+from .models import NodeDailyStat, NodeDwellBucket
+from .services import start_instance, start_instances_bulk, submit_task, submit_tasks_bulk, claim_work_item, release_work_item, _overrides_from_rules
+from .services import inbox_queryset, inbox_count, form_at_revision, form_change_log, search_instances
+from .compiled import get_compiled_template, get_compiled_form
+from .stats import percentile
+from . import live
+from .utils import merge_overrides, schema_properties, read_numbered_rows, encode_cursor, decode_cursor
 
 def _schema_properties(schema: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
     return schema_properties(schema)
 
 def build_fields_from_formdef(form_def, current_data: dict|None=None, overrides: dict|None=None):
     """
-    把 FormField 转为模板渲染需要的字段列表
+    把 FormField 转为模板渲染需要的字段列表（字段描述来自按 FormDef 版本缓存的编译表单）
     overrides: {"hidden": set(), "readonly": set(), "required": set()}
     """
-    current_data = current_data or {}
-    ov = overrides or {"hidden": set(), "readonly": set(), "required": set()}
-    result = []
-    for f in form_def.fields.all():
-        if f.name in ov["hidden"]:
-            continue
-        if f.type == FieldType.SELECT:
-            html = 'select'
-            opts = f.enum_list()
-        elif f.type == FieldType.BOOLEAN:
-            html = 'checkbox'
-            opts = []
-        elif f.type in (FieldType.INTEGER, FieldType.NUMBER):
-            html = 'number'
-            opts = []
-        elif f.type == FieldType.TEXT:
-            html = 'textarea'
-            opts = []
-        elif f.type == FieldType.DATE:
-            html = 'date'
-            opts = []
-        elif f.type == FieldType.DATETIME:
-            html = 'datetime'
-            opts = []
-        else:
-            html = 'text'
-            opts = []
-        result.append({
-            "name": f.name,
-            "title": f.title or f.name,
-            "html_type": html,
-            "enum": opts,
-            "value": current_data.get(f.name, "" if html != "checkbox" else False),
-            "required": (f.required or f.name in ov["required"]),
-            "readonly": (f.name in ov["readonly"]),
-        })
-    return result
+    return get_compiled_form(form_def).render(current_data, overrides)
 
 
 @login_required
@@ -88,7 +60,7 @@ def template_create(request: HttpRequest) -> HttpResponse:
 @require_http_methods(["GET", "POST"])
 def instance_start(request: HttpRequest, template_code: str) -> HttpResponse:
     tpl = get_object_or_404(FlowTemplate, code=template_code, status="active")
-    fields = build_fields_from_formdef(tpl.form_def)
+    fields = get_compiled_template(tpl).form.render()
 
     if request.method == "POST":
         form_data: Dict[str, Any] = request.POST.dict()
@@ -105,32 +77,86 @@ def instance_start(request: HttpRequest, template_code: str) -> HttpResponse:
     return render(request, "flow/instance_start.html", {"tpl": tpl, "fields": fields})
 
 
+@login_required
+@require_http_methods(["POST"])
+def instance_bulk_start(request: HttpRequest, template_code: str) -> HttpResponse:
+    """批量发起接口（管理员）：上传 CSV/JSONL 文件，返回逐行错误报告（JSON，row 为源文件行号，CSV 表头为第 1 行）"""
+    if not request.user.is_staff:
+        return JsonResponse({"error": "无权限"}, status=403)
+    tpl = get_object_or_404(FlowTemplate, code=template_code, status="active")
+    upload = request.FILES.get("file")
+    if not upload:
+        return JsonResponse({"error": "请上传 file"}, status=400)
+    fmt = "jsonl" if upload.name.lower().endswith((".jsonl", ".ndjson")) else "csv"
+    try:
+        numbered = read_numbered_rows(upload, fmt)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    rows = [r for _, r in numbered]
+    created, errors = start_instances_bulk(tpl, request.user, rows, lines=[no for no, _ in numbered])
+    return JsonResponse({
+        "total": len(rows),
+        "created": created,
+        "errors": [{"row": no, "error": msg} for no, msg in errors],
+    })
+
+
+INBOX_PAGE_SIZE = 50
+
+
 @login_required
 def work_inbox(request: HttpRequest) -> HttpResponse:
+    """
+    收件箱：按 (updated_at, id) 倒序键集分页，游标稳定，不因新待办插入而跳行/重复；
+    可按模板/节点过滤。角标数来自按用户缓存的计数。
+    """
     uid = request.user.id
-    items = (
-        WorkItem.objects.filter(status__in=["open", "claimed"])
-        .filter(Q(owner_id=uid) | Q(assignees__contains=[uid]))
-        .select_related("instance", "node", "node__template")
-        .order_by("-updated_at")
+    template_id = request.GET.get("template") or None
+    node_id = request.GET.get("node") or None
+    template_id = int(template_id) if template_id and template_id.isdigit() else None
+    node_id = int(node_id) if node_id and node_id.isdigit() else None
+
+    qs = inbox_queryset(uid, template_id=template_id, node_id=node_id)
+    cursor = decode_cursor(request.GET.get("after", ""))
+    if cursor:
+        ts, pk = cursor
+        qs = qs.filter(Q(updated_at__lt=ts) | Q(updated_at=ts, id__lt=pk))
+    items = list(
+        qs.select_related("instance", "node", "node__template")
+        .order_by("-updated_at", "-id")[:INBOX_PAGE_SIZE + 1]
     )
-    return render(request, "flow/work_inbox.html", {"items": items})
+    next_cursor = None
+    if len(items) > INBOX_PAGE_SIZE:
+        items = items[:INBOX_PAGE_SIZE]
+        next_cursor = encode_cursor(items[-1].updated_at, items[-1].id)
+
+    nodes = []
+    if template_id:
+        tpl = FlowTemplate.objects.filter(pk=template_id).first()
+        if tpl:
+            nodes = [n for n in get_compiled_template(tpl).nodes.values() if n.type not in ("start", "end")]
+    return render(request, "flow/work_inbox.html", {
+        "items": items,
+        "next_cursor": next_cursor,
+        "is_first_page": cursor is None,
+        "badge_count": inbox_count(uid),
+        "templates": FlowTemplate.objects.filter(status="active").only("id", "name").order_by("name"),
+        "nodes": nodes,
+        "template_id": template_id,
+        "node_id": node_id,
+    })
 
 
 @login_required
 @require_http_methods(["GET", "POST"])
 def work_submit(request: HttpRequest, pk: int) -> HttpResponse:
-    wi = get_object_or_404(
-        WorkItem.objects.select_related("instance", "node", "instance__template", "instance__template__form"),
-        pk=pk,
-    )
+    wi = get_object_or_404(WorkItem.objects.select_related("instance", "node", "instance__template"), pk=pk)
     instance = wi.instance
     tpl = instance.template
-    schema = tpl.form.json_schema or {}
 
-    # 读节点覆盖
-    overrides = _overrides_from_rules(wi.node, None)
-    fields = build_fields_from_formdef(tpl.form_def, current_data=instance.form_data or {}, overrides=overrides)
+    # 字段描述与节点覆盖都来自编译模板，不再逐次查询 FormField / NodeFieldRule
+    ct = get_compiled_template(tpl)
+    fields = ct.form.render(instance.form_data or {}, ct.node(wi.node_id).overrides)
 
     if request.method == "POST":
         action = request.POST.get("action") or "submit"
@@ -161,17 +187,284 @@ def work_submit(request: HttpRequest, pk: int) -> HttpResponse:
     )
 
 
+@login_required
+@require_http_methods(["POST"])
+def work_batch_submit(request: HttpRequest) -> HttpResponse:
+    """收件箱批量审批：选中的工作项以同一动作/意见一次提交，逐项返回结果"""
+    ids = [x for x in request.POST.getlist("ids") if x.isdigit()]
+    if not ids:
+        messages.error(request, "请先勾选要处理的工作项")
+        return redirect("flow_work_inbox")
+    action = request.POST.get("action") or "submit"
+    comment = request.POST.get("comment") or ""
+    results = submit_tasks_bulk(ids, request.user, action, comment)
+
+    if "application/json" in request.headers.get("Accept", ""):
+        return JsonResponse({
+            "results": [{"id": wid, "ok": err is None, "error": err or ""} for wid, err in results.items()],
+        })
+    rows = [{"id": wid, "ok": err is None, "error": err or ""} for wid, err in results.items()]
+    ok = sum(1 for r in rows if r["ok"])
+    return render(request, "flow/work_batch_result.html", {
+        "rows": rows, "ok": ok, "failed": len(rows) - ok, "action": action,
+    })
+
+
 # 认领 / 释放
 @login_required
 def work_claim(request: HttpRequest, pk: int) -> HttpResponse:
     wi = get_object_or_404(WorkItem, pk=pk)
-    claim_work_item(wi, request.user)
-    messages.success(request, "已认领")
+    try:
+        claim_work_item(wi, request.user)
+    except (ValueError, PermissionError) as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, "已认领")
     return redirect("flow_work_inbox")
 
 @login_required
 def work_release(request: HttpRequest, pk: int) -> HttpResponse:
     wi = get_object_or_404(WorkItem, pk=pk)
-    release_work_item(wi, request.user)
-    messages.success(request, "已释放")
+    try:
+        release_work_item(wi, request.user)
+    except (ValueError, PermissionError) as e:
+        messages.error(request, str(e))
+    else:
+        messages.success(request, "已释放")
     return redirect("flow_work_inbox")
+
+
+# 实时推送（SSE）
+LIVE_HEARTBEAT = 15  # 秒；让代理不因空闲断开连接
+
+
+@login_required
+async def live_events(request: HttpRequest) -> HttpResponse:
+    """
+    Server-Sent Events：?channels=inbox,outbound。只在 ASGI 下提供长连接；
+    WSGI 部署返回 204，浏览器的 EventSource 收到 204 后不再重连，页面退化为手动刷新。
+    """
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    user = await request.auser()
+    channels = [c for c in request.GET.get("channels", "inbox").split(",") if c in live.CHANNELS]
+    if not channels:
+        return HttpResponse(status=204)
+    last_id = request.headers.get("Last-Event-ID", "")
+    sub = live.hub.subscribe(user.id, channels, int(last_id) if last_id.isdigit() else None)
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    yield await asyncio.wait_for(sub.queue.get(), LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+        finally:
+            live.hub.unsubscribe(sub)
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # 关闭 nginx 缓冲
+    return response
+
+
+SEARCH_PAGE_SIZE = 50
+SEARCH_RESERVED = {"status", "after", "format"}
+
+
+@login_required
+def instance_search(request: HttpRequest, template_code: str) -> HttpResponse:
+    """
+    按建索引字段筛选实例（报表用）：?ocr_score__gte=90&kind=book&status=running。
+    管理员可查全部实例，普通用户只查自己发起的；?format=json 或 Accept: application/json 返回 JSON。
+    """
+    tpl = get_object_or_404(FlowTemplate, code=template_code)
+    form = get_compiled_template(tpl).form
+    filters = {k: v for k, v in request.GET.items() if k not in SEARCH_RESERVED and v.strip()}
+    want_json = request.GET.get("format") == "json" or "application/json" in request.headers.get("Accept", "")
+
+    error = None
+    try:
+        qs = search_instances(tpl, filters)
+    except ValueError as e:
+        error, qs = str(e), FlowInstance.objects.none()
+    if not request.user.is_staff:
+        qs = qs.filter(starter=request.user)
+    status = request.GET.get("status") or ""
+    if status:
+        qs = qs.filter(status=status)
+    after = request.GET.get("after", "")
+    if after.isdigit():
+        qs = qs.filter(id__lt=int(after))
+    items = list(qs.select_related("starter", "current_node").order_by("-id")[:SEARCH_PAGE_SIZE + 1])
+    next_after = None
+    if len(items) > SEARCH_PAGE_SIZE:
+        items = items[:SEARCH_PAGE_SIZE]
+        next_after = items[-1].id
+
+    if want_json:
+        if error:
+            return JsonResponse({"error": error}, status=400)
+        return JsonResponse({
+            "results": [
+                {
+                    "id": ins.id, "title": ins.title, "status": ins.status,
+                    "starter": str(ins.starter) if ins.starter_id else None,
+                    "current_node": ins.current_node.name if ins.current_node_id else None,
+                    "updated_at": ins.updated_at.isoformat(),
+                    "fields": {f.name: (ins.form_data or {}).get(f.name) for f in form.indexed},
+                }
+                for ins in items
+            ],
+            "next_after": next_after,
+        })
+
+    if error:
+        messages.error(request, error)
+    rows = [(ins, [(ins.form_data or {}).get(f.name, "") for f in form.indexed]) for ins in items]
+    controls = [
+        {
+            "field": f,
+            "value": filters.get(f.name, ""),
+            "gte": filters.get(f"{f.name}__gte", ""),
+            "lte": filters.get(f"{f.name}__lte", ""),
+            "contains": filters.get(f"{f.name}__contains", ""),
+        }
+        for f in form.indexed
+    ]
+    query = request.GET.copy()
+    query.pop("after", None)
+    return render(request, "flow/instance_search.html", {
+        "tpl": tpl, "indexed": form.indexed, "controls": controls, "rows": rows, "status": status,
+        "statuses": InstanceStatus.choices, "next_after": next_after, "query": query.urlencode(),
+    })
+
+
+@login_required
+def instance_history(request: HttpRequest, pk: int) -> HttpResponse:
+    """表单历史：逐版本列出谁在哪个节点改了哪些字段；?rev=N 查看第 N 版的完整表单"""
+    ins = get_object_or_404(FlowInstance.objects.select_related("template", "starter"), pk=pk)
+    user = request.user
+    if not (user.is_staff or ins.starter_id == user.id
+            or WorkItemCandidate.objects.filter(work_item__instance=ins, user=user).exists()):
+        raise Http404("实例不存在")
+
+    rev = request.GET.get("rev", "")
+    seq = int(rev) if rev.isdigit() else None
+    try:
+        form = form_at_revision(ins, seq)
+    except ValueError as e:
+        messages.error(request, str(e))
+        seq, form = None, form_at_revision(ins)
+    return render(request, "flow/instance_history.html", {
+        "ins": ins, "history": form_change_log(ins), "form": form, "seq": seq,
+    })
+
+
+def _duration(seconds) -> str:
+    if seconds is None:
+        return "-"
+    if seconds < 60:
+        return f"{seconds:.0f} 秒"
+    if seconds < 3600:
+        return f"{seconds / 60:.1f} 分钟"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} 小时"
+    return f"{seconds / 86400:.1f} 天"
+
+
+@login_required
+def node_stats(request: HttpRequest) -> HttpResponse:
+    """节点瓶颈看板（管理员）：只读节点日统计聚合，按区间汇总进入/完成/停留时长分位"""
+    if not request.user.is_staff:
+        raise Http404()
+    templates = FlowTemplate.objects.only("id", "name", "version").order_by("name")
+    tid = request.GET.get("template", "")
+    tpl = FlowTemplate.objects.filter(pk=int(tid)).first() if tid.isdigit() else templates.first()
+    days = request.GET.get("days", "")
+    days = min(int(days), 366) if days.isdigit() and int(days) > 0 else 30
+    since = timezone.localdate() - timedelta(days=days - 1)
+
+    rows, series = [], []
+    if tpl:
+        stats = NodeDailyStat.objects.filter(node__template=tpl, day__gte=since)
+        totals = {
+            r["node_id"]: r for r in stats.values("node_id").annotate(
+                entered_sum=Sum("entered"), completed_sum=Sum("completed"),
+                dwell_total=Sum("dwell_sum"), longest=Max("dwell_max"),
+            )
+        }
+        buckets: Dict[int, Dict[int, int]] = {}
+        for node_id, b, c in (NodeDwellBucket.objects.filter(stat__in=stats)
+                              .values("stat__node_id", "bucket").annotate(n=Sum("count"))
+                              .values_list("stat__node_id", "bucket", "n")):
+            buckets.setdefault(node_id, {})[b] = c
+        for node in tpl.nodes.exclude(type__in=("start", "end")).order_by("id"):
+            t = totals.get(node.id, {})
+            done = t.get("completed_sum") or 0
+            b = buckets.get(node.id, {})
+            rows.append({
+                "node": node,
+                "entered": t.get("entered_sum") or 0,
+                "completed": done,
+                "avg": (t.get("dwell_total") or 0) / done if done else None,
+                "p50": percentile(b, 50), "p90": percentile(b, 90), "p95": percentile(b, 95),
+                "max": t.get("longest"),
+            })
+        rows.sort(key=lambda r: -(r["p90"] or 0))
+        for r in rows:
+            for k in ("avg", "p50", "p90", "p95", "max"):
+                r[k] = _duration(r[k])
+        series = list(stats.values("day").annotate(entered=Sum("entered"), completed=Sum("completed")).order_by("day"))
+    return render(request, "flow/node_stats.html", {
+        "templates": templates, "tpl": tpl, "days": days, "since": since, "rows": rows, "series": series,
+    })
+
+
+# 归档历史（只读）
+ARCHIVE_PAGE_SIZE = 50
+
+
+def _archive_qs(user):
+    qs = ArchivedInstance.objects.all()
+    return qs if user.is_staff else qs.filter(starter=user)
+
+
+@login_required
+def archive_list(request: HttpRequest) -> HttpResponse:
+    """已归档实例列表：管理员看全部，普通用户只看自己发起的；按 (finished_at, id) 键集分页"""
+    qs = _archive_qs(request.user).select_related("template", "starter").defer("payload")
+    q = (request.GET.get("q") or "").strip()
+    if q:
+        cond = Q(title__icontains=q)
+        if q.isdigit():
+            cond |= Q(id=int(q))
+        qs = qs.filter(cond)
+    cursor = decode_cursor(request.GET.get("after", ""))
+    if cursor:
+        ts, pk = cursor
+        qs = qs.filter(Q(finished_at__lt=ts) | Q(finished_at=ts, id__lt=pk))
+    items = list(qs.order_by("-finished_at", "-id")[:ARCHIVE_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(items) > ARCHIVE_PAGE_SIZE:
+        items = items[:ARCHIVE_PAGE_SIZE]
+        next_cursor = encode_cursor(items[-1].finished_at, items[-1].id)
+    return render(request, "flow/archive_list.html", {
+        "items": items, "next_cursor": next_cursor, "is_first_page": cursor is None, "q": q,
+    })
+
+
+@login_required
+def archive_detail(request: HttpRequest, pk: int) -> HttpResponse:
+    arc = _archive_qs(request.user).select_related("template", "starter").filter(pk=pk).first()
+    if arc is None:
+        raise Http404("归档实例不存在")
+    data = arc.data()
+    return render(request, "flow/archive_detail.html", {
+        "arc": arc,
+        "form_data": data["instance"].get("form_data") or {},
+        "work_items": data["work_items"],
+        "logs": data["logs"],
+    })
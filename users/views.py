@@ -39,6 +39,7 @@ def register(request):
     return render(request, 'users/register.html')
 
 from django.contrib.auth.models import Group
+from digitization.services import pipeline_dashboard
 @login_required
 def dashboard(request):
     user = request.user
@@ -48,4 +49,7 @@ def dashboard(request):
         'is_quality_staff': user.groups.filter(name='数字化室').exists(),
         "can_manage_attendance": request.user.has_perm("attendance.can_manage_attendance"),  # ✅ 传入模板
     }
+    if user.is_staff:
+        # 管理员看板：数字化流程统计（带短时缓存，阶段变化即失效）
+        context['pipeline'] = pipeline_dashboard()
     return render(request, 'users/dashboard.html', context)
\ No newline at end of file